@@ -1,40 +1,144 @@
 # api.py
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File
+import time
+from subsystems import SubsystemRegistry
+
+# Created before anything else so the startup report measures from the start of this module's import
+subsystems = SubsystemRegistry()
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from typing import List, Optional, Dict, Any, Union
+from datetime import datetime
 import uvicorn
 from pydantic import BaseModel
 import logging
+import os
 import base64
 import io
-from PIL import Image
 import json
 import re
 import asyncio
+import argparse
+import subprocess
+import uuid
 import httpx
+import numpy as np
 
-# Import existing Ollama functionality
-try:
-    import ollama
-except ImportError:
-    raise ImportError("Please install ollama package with: pip install ollama")
-
-# Import RAG functionality
-try:
-    from rag_helper import get_rag_manager
-except ImportError:
-    logging.error("RAG dependencies not available. Install with: pip install chromadb langchain langchain-community")
-    get_rag_manager = None
+# Lightweight local modules (stdlib + httpx only)
+from prompt_registry import get_prompt_registry
+from model_residency import ModelResidencyManager, to_ollama_model_name
+from provider_routing import ProviderRouter, extract_stream_delta
+from shared_state import get_shared_state, worker_id
+from ingestion import get_ingestion_manager, spool_upload, UploadTooLarge
+from embedding_migration import start_migration, get_migration_status, cancel_migration, MigrationConflict
+from store_maintenance import StoreMaintenance, MaintenanceBusy, DEFAULT_SNAPSHOT_DIR, DEFAULT_MIN_FREE_RATIO
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# --- Lazily loaded heavy subsystems ---
+# These imports cost seconds, so they are loaded by the startup warm-up (in the
+# background while the port binds) or on first use, whichever comes first.
+def load_litellm():
+    import litellm
+    return litellm
+
+def load_ollama():
+    try:
+        import ollama
+    except ImportError:
+        raise ImportError("Please install ollama package with: pip install ollama")
+    return ollama
+
+def load_rag():
+    try:
+        import rag_helper
+    except ImportError as e:
+        raise ImportError(f"RAG dependencies not available ({e}). Install with: pip install chromadb langchain langchain-community")
+    # Open the vector store as part of the warm-up too
+    rag_helper.get_rag_manager()
+    return rag_helper
+
+subsystems.register("litellm", load_litellm, required=True, description="LiteLLM provider client used for chat")
+subsystems.register("ollama", load_ollama, description="Ollama client used for model listing")
+subsystems.register("rag", load_rag, description="ChromaDB/LangChain document retrieval")
+warmup_task = None
+
 app = FastAPI(title="Ollama WebUI API")
 
 # Image generation service configuration
 IMAGE_SERVICE_URL = "http://localhost:8001"
 MCP_SERVER_URL = "http://localhost:8002"
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+# Ollama model residency: which models stay loaded and for how long
+memory_budget_gb = float(os.environ.get("OLLAMA_MEMORY_BUDGET_GB", "0"))
+residency_manager = ModelResidencyManager(
+    ollama_base_url=OLLAMA_BASE_URL,
+    memory_budget_bytes=int(memory_budget_gb * 1024 ** 3) if memory_budget_gb > 0 else None,
+    preload_models=[m.strip() for m in os.environ.get("OLLAMA_PRELOAD_MODELS", "").split(",") if m.strip()],
+    shared_state=get_shared_state()
+)
+
+# Optional per-model failover/hedging policies across providers
+provider_router = ProviderRouter.from_file(
+    os.environ.get("ROUTING_POLICIES_PATH", "./routing_policies.json"),
+    residency_manager=residency_manager,
+    litellm_loader=lambda: subsystems.aget("litellm")
+)
+
+# Scheduled compaction and snapshots of the RAG stores (intervals of 0 disable the schedule)
+store_maintenance = StoreMaintenance(
+    rag_loader=lambda: require_rag_manager(),
+    compact_interval=float(os.environ.get("STORE_COMPACT_INTERVAL_HOURS", "6")) * 3600,
+    snapshot_interval=float(os.environ.get("STORE_SNAPSHOT_INTERVAL_HOURS", "0")) * 3600,
+    snapshot_dir=os.environ.get("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR),
+    keep_snapshots=int(os.environ.get("SNAPSHOT_KEEP", "3")),
+    min_free_ratio=float(os.environ.get("STORE_COMPACT_MIN_FREE_RATIO", str(DEFAULT_MIN_FREE_RATIO))),
+    shared_state=get_shared_state()
+)
+
+# Largest accepted RAG upload (0 disables the limit); uploads are spooled to disk, not held in memory
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+
+# Most texts accepted by one /api/embeddings call
+EMBEDDINGS_MAX_TEXTS = int(os.environ.get("EMBEDDINGS_MAX_TEXTS", "2048"))
+# Models /api/embeddings accepts besides the ones the collections already use (comma-separated)
+EMBEDDINGS_ALLOWED_MODELS = [model.strip() for model in os.environ.get("EMBEDDINGS_ALLOWED_MODELS", "").split(",") if model.strip()]
+
+# Per-client rate limit shared by all workers (0 disables it)
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "0"))
+RATE_LIMITED_PREFIXES = ("/api/chat", "/api/compare", "/api/rag/", "/api/embeddings")
+
+def check_rate_limit(client_host):
+    """
+    Count a request against the client's per-minute limit.
+    Returns None if allowed, otherwise the seconds until the window resets.
+    """
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return None
+    allowed, _, reset_in = get_shared_state().rate_limit_hit(f"client:{client_host}", RATE_LIMIT_PER_MINUTE, 60)
+    return None if allowed else reset_in
+
+# Registered before CORS so CORS stays the outermost middleware and 429s carry CORS headers
+@app.middleware("http")
+async def worker_middleware(request, call_next):
+    if request.url.path.startswith(RATE_LIMITED_PREFIXES):
+        client_host = request.client.host if request.client else "unknown"
+        retry_after = await asyncio.to_thread(check_rate_limit, client_host)
+        if retry_after is not None:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded"},
+                headers={"Retry-After": str(int(retry_after) + 1)}
+            )
+
+    response = await call_next(request)
+    # Lets clients and load balancers see (and pin to) the worker that served them
+    response.headers["X-Worker-Id"] = worker_id()
+    return response
 
 # Configure CORS for frontend connection
 app.add_middleware(
@@ -105,7 +209,7 @@ def get_ollama_models():
         logging.info("Fetching fresh model list from Ollama...")
         
         # Call ollama.list() to get the most recent model list
-        models_response = ollama.list()
+        models_response = subsystems.get("ollama").list()
         logging.debug(f"Raw Ollama response type: {type(models_response)}")
         
         model_names = []
@@ -194,13 +298,123 @@ def check_ollama_connection():
     """
     try:
         # Try to get the list of models to test connection
-        response = ollama.list()
+        response = subsystems.get("ollama").list()
         logging.info("Ollama connection successful")
         return True
     except Exception as e:
         logging.error(f"Ollama connection failed: {e}")
         return False
 
+def process_messages_for_litellm(messages):
+    """
+    Convert request messages into the plain dict format LiteLLM expects.
+    Pydantic content items are turned into dicts, dicts are passed through as-is.
+    """
+    processed_messages = []
+    for msg in messages:
+        processed_msg = {"role": msg.role}
+
+        # Handle different content types
+        if isinstance(msg.content, str):
+            processed_msg["content"] = msg.content
+        elif isinstance(msg.content, list):
+            processed_content = []
+            for content_item in msg.content:
+                if isinstance(content_item, MessageContent):
+                    # Convert Pydantic object to dict
+                    content_dict = {"type": content_item.type}
+                    if content_item.text is not None:
+                        content_dict["text"] = content_item.text
+                    if content_item.image_url is not None:
+                        content_dict["image_url"] = content_item.image_url
+                    processed_content.append(content_dict)
+                elif isinstance(content_item, dict):
+                    # Already a dict, use as-is
+                    processed_content.append(content_item)
+                else:
+                    # Fallback for other types
+                    processed_content.append(str(content_item))
+            processed_msg["content"] = processed_content
+        else:
+            # Fallback for other content types
+            processed_msg["content"] = str(msg.content)
+
+        processed_messages.append(processed_msg)
+
+    return processed_messages
+
+def apply_system_prompt(processed_messages, system_prompt):
+    """
+    Return a copy of processed_messages with system_prompt as the leading system message.
+    An existing leading system message is replaced rather than stacked.
+    """
+    if not system_prompt:
+        return list(processed_messages)
+
+    remaining = list(processed_messages)
+    if remaining and remaining[0].get("role") == "system":
+        remaining = remaining[1:]
+    return [{"role": "system", "content": system_prompt}] + remaining
+
+def resolve_system_prompt(system_prompt_id=None, system_prompt=None):
+    """
+    Resolve a request's system prompt to its canonical registry form.
+    Raises KeyError if system_prompt_id is not registered.
+    """
+    return get_prompt_registry().resolve(system_prompt_id, system_prompt)
+
+def prompt_cache_report(model, messages, usage):
+    """
+    Extract the backend's own prompt cache numbers from a LiteLLM usage object.
+
+    Returns None when usage is missing or only carries a total prompt size,
+    which says nothing about how much of the prompt was reused.
+    """
+    # Ollama's prompt_eval_count (surfaced as prompt_tokens) only covers tokens it had to evaluate
+    if to_ollama_model_name(model) is not None:
+        # The first request after a load found an empty KV cache; consume that even without usage
+        cold = residency_manager.consume_cold_start(model)
+        prompt_eval_tokens = getattr(usage, 'prompt_tokens', None) if usage is not None else None
+        if prompt_eval_tokens is None:
+            return None
+        prompt_chars = 0
+        for msg in messages:
+            content = msg.get("content")
+            if isinstance(content, str):
+                prompt_chars += len(content)
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict) and item.get("text"):
+                        prompt_chars += len(item["text"])
+        return {
+            "source": "prompt_eval",
+            "prompt_eval_tokens": prompt_eval_tokens,
+            "prompt_chars": prompt_chars,
+            "cold": cold
+        }
+
+    if usage is None:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) if details is not None else None
+    if cached_tokens is None:
+        cached_tokens = getattr(usage, 'cache_read_input_tokens', None)
+    if cached_tokens is None:
+        return None
+    return {"source": "cached_tokens", "prompt_tokens": getattr(usage, 'prompt_tokens', None), "cached_tokens": cached_tokens}
+
+def record_system_prompt_usage(resolved_prompt, model, processed_messages, usage, prefill_ms):
+    """Feed the backend's prompt cache report for a request into the registry's cache stats."""
+    # Built for every request so a cold start is consumed by the request that paid for it
+    report = prompt_cache_report(model, processed_messages, usage)
+    if not resolved_prompt:
+        return
+    get_prompt_registry().record_prompt_eval(resolved_prompt, model, report, prefill_ms)
+
+def completion_options(keep_alive):
+    """Extra LiteLLM kwargs for a request; keep_alive is only set for Ollama models."""
+    return {"keep_alive": keep_alive} if keep_alive else {}
+
 # --- API Data Models ---
 class MessageContent(BaseModel):
     type: str  # "text" or "image_url"
@@ -215,6 +429,7 @@ class ChatRequest(BaseModel):
     model: str
     messages: List[Message]
     system_prompt: Optional[str] = None
+    system_prompt_id: Optional[str] = None
     temperature: float = 0.7
     stream: bool = False
     
@@ -222,19 +437,84 @@ class ChatResponse(BaseModel):
     message: Message
     model: str
 
+# Prompt Comparison Models
+class ComparisonVariant(BaseModel):
+    id: Optional[str] = None
+    model: str
+    system_prompt: Optional[str] = None
+    system_prompt_id: Optional[str] = None
+    temperature: Optional[float] = None
+
+class ComparisonRequest(BaseModel):
+    messages: List[Message]
+    variants: List[ComparisonVariant]
+    temperature: float = 0.7
+
+# System Prompt Registry Models
+class SystemPromptCreateRequest(BaseModel):
+    id: str
+    prompt: str
+    name: Optional[str] = None
+    description: str = ""
+    category: str = "Custom"
+
 # RAG Request Models
 class DocumentUploadResponse(BaseModel):
     success: bool
     message: str
     filename: Optional[str] = None
+    job_id: Optional[str] = None
+
+class RAGFilters(BaseModel):
+    sources: Optional[List[str]] = None  # Only these source documents
+    page_min: Optional[int] = None  # First page, inclusive (as in the sources' "page" metadata)
+    page_max: Optional[int] = None  # Last page, inclusive
+    ingested_after: Optional[datetime] = None  # Documents first indexed at or after this time (ISO 8601 or Unix time)
+    ingested_before: Optional[datetime] = None  # Documents first indexed before this time
 
 class RAGQueryRequest(BaseModel):
     query: str
     model: Optional[str] = None
+    n_results: int = 8  # Passages retrieved; as many as fit the model's context window are used
+    vector_weight: float = 1.0  # Weight of dense retrieval in rank fusion (0 disables it)
+    lexical_weight: float = 1.0  # Weight of BM25 retrieval in rank fusion (0 disables it)
+    mmr_lambda: Optional[float] = 0.7  # MMR relevance/diversity trade-off (None or 1.0 disables it)
+    merge_adjacent: bool = True  # Merge neighbouring chunks of a source and strip their overlap
+    temperature: float = 0.7  # Sampling temperature of streamed answers
+    collection: Optional[str] = None  # Collection to search (default collection if omitted)
+    collections: Optional[List[str]] = None  # Search several collections concurrently and merge the results
+    filters: Optional[RAGFilters] = None  # Restrict retrieval by source, page and ingest time
     
 class RAGQueryResponse(BaseModel):
     response: str
     sources: List[dict]
+    timings_ms: Optional[Dict[str, float]] = None
+    context: Optional[Dict[str, Any]] = None  # Token budget usage of the packed context
+
+class RAGSearchRequest(BaseModel):
+    query: str
+    n_results: int = 5
+    vector_weight: float = 1.0
+    lexical_weight: float = 1.0
+    mmr_lambda: Optional[float] = 0.7
+    merge_adjacent: bool = True
+    collection: Optional[str] = None
+    collections: Optional[List[str]] = None
+    filters: Optional[RAGFilters] = None
+
+class CollectionCreateRequest(BaseModel):
+    name: str
+    hnsw: Optional[Dict[str, Any]] = None  # Chroma HNSW settings: space ("l2", "cosine", "ip"), M, construction_ef, search_ef
+
+class EmbeddingMigrationRequest(BaseModel):
+    embedding_model: str  # Ollama embedding model to re-embed the collection with
+    max_chunks_per_second: Optional[float] = 50.0  # Embedding rate limit, so live traffic keeps most of Ollama (null for none)
+    batch_size: int = 32
+
+class EmbeddingsRequest(BaseModel):
+    texts: List[str]
+    model: Optional[str] = None  # Ollama embedding model (the default collection's if omitted)
+    format: str = "json"  # "json" (float lists), "base64" (float32 little-endian per text) or "binary" (one float32 matrix)
 
 # Image Generation Request Models
 class ImageGenerationRequest(BaseModel):
@@ -274,6 +554,40 @@ async def get_ollama_status():
         "service": "ollama"
     }
 
+@app.get("/api/ready")
+async def readiness():
+    """Readiness probe: 200 once required subsystems are loaded, 503 while warming up."""
+    status = subsystems.readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/api/startup-report")
+async def startup_report():
+    """Startup milestones and the load cost of each lazily imported subsystem."""
+    return subsystems.startup_report()
+
+@app.get("/api/workers")
+async def get_workers():
+    """This worker's id plus shared-state leases and live stream sessions per worker."""
+    return await asyncio.to_thread(get_shared_state().get_status)
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Look up which worker owns a live stream session."""
+    session = await asyncio.to_thread(get_shared_state().get_session, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return session
+
+@app.get("/api/ollama/residency")
+async def get_ollama_residency():
+    """Loaded Ollama models, memory budget usage, cold-start counts and recent load/evict events."""
+    return residency_manager.get_status()
+
+@app.get("/api/routing")
+async def get_routing_status():
+    """Failover/hedging policies per model, current hedge deadlines and routing counters."""
+    return provider_router.get_status()
+
 @app.get("/api/models/{provider}")
 async def get_provider_models(provider: str, t: Optional[str] = None, force_refresh: bool = False):
     """Get models for a specific provider. 
@@ -398,77 +712,79 @@ async def chat(request: ChatRequest):
                             }
         
         # Regular chat processing
-        from litellm import completion
+        completion = (await subsystems.aget("litellm")).completion
         
         # Process messages to ensure they're in the correct format for LiteLLM
-        processed_messages = []
-        for msg in request.messages:
-            processed_msg = {"role": msg.role}
-            
-            # Handle different content types
-            if isinstance(msg.content, str):
-                processed_msg["content"] = msg.content
-            elif isinstance(msg.content, list):
-                processed_content = []
-                for content_item in msg.content:
-                    if isinstance(content_item, MessageContent):
-                        # Convert Pydantic object to dict
-                        content_dict = {"type": content_item.type}
-                        if content_item.text is not None:
-                            content_dict["text"] = content_item.text
-                        if content_item.image_url is not None:
-                            content_dict["image_url"] = content_item.image_url
-                        processed_content.append(content_dict)
-                    elif isinstance(content_item, dict):
-                        # Already a dict, use as-is
-                        processed_content.append(content_item)
-                    else:
-                        # Fallback for other types
-                        processed_content.append(str(content_item))
-                processed_msg["content"] = processed_content
-            else:
-                # Fallback for other content types
-                processed_msg["content"] = str(msg.content)
+        processed_messages = process_messages_for_litellm(request.messages)
+        
+        # Inject the canonical system prompt ahead of the conversation so it forms a stable cache prefix
+        try:
+            resolved_prompt = resolve_system_prompt(request.system_prompt_id, request.system_prompt)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"System prompt '{request.system_prompt_id}' not found")
+        if resolved_prompt:
+            processed_messages = apply_system_prompt(processed_messages, resolved_prompt["prompt"])
+        
+        started_at = time.perf_counter()
+        served_by = request.model
+        
+        if provider_router.has_policy(request.model):
+            # Routed models go through failover/hedging across providers
+            routed = await provider_router.complete(request.model, processed_messages, request.temperature)
+            response_content = routed["content"]
+            usage = routed["usage"]
+            served_by = routed["model"]
+        else:
+            # Process the request using LiteLLM
+            async with residency_manager.track(request.model) as keep_alive:
+                response = completion(
+                    model=request.model,
+                    messages=processed_messages,
+                    temperature=request.temperature,
+                    stream=False,
+                    **completion_options(keep_alive)
+                )
+            usage = getattr(response, 'usage', None)
             
-            processed_messages.append(processed_msg)
-        
-        # Process the request using LiteLLM
-        response = completion(
-            model=request.model,
-            messages=processed_messages,
-            temperature=request.temperature,
-            stream=False
-        )
+            # Extract the response content
+            response_content = ""
+            if hasattr(response, 'choices') and response.choices:
+                if hasattr(response.choices[0], 'message'):
+                    response_content = response.choices[0].message.content
+                elif hasattr(response.choices[0], 'text'):
+                    response_content = response.choices[0].text
+            elif hasattr(response, 'content'):
+                response_content = response.content
+            elif hasattr(response, 'text'):
+                response_content = response.text
         
-        # Extract the response content
-        response_content = ""
-        if hasattr(response, 'choices') and response.choices:
-            if hasattr(response.choices[0], 'message'):
-                response_content = response.choices[0].message.content
-            elif hasattr(response.choices[0], 'text'):
-                response_content = response.choices[0].text
-        elif hasattr(response, 'content'):
-            response_content = response.content
-        elif hasattr(response, 'text'):
-            response_content = response.text
+        record_system_prompt_usage(resolved_prompt, served_by, processed_messages, usage, (time.perf_counter() - started_at) * 1000)
         
         return {
             "message": {
                 "role": "assistant",
                 "content": response_content
             },
-            "model": request.model
+            "model": request.model,
+            "served_by": served_by
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in chat: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.websocket("/api/chat/stream")
 async def chat_stream(websocket: WebSocket):
+    session_id = None
     try:
         await websocket.accept()
         logging.info("WebSocket connection accepted")
         
+        if await asyncio.to_thread(check_rate_limit, websocket.client.host if websocket.client else "unknown") is not None:
+            await websocket.send_json({"error": "Rate limit exceeded"})
+            return
+        
         # Receive the initial chat request
         data = await websocket.receive_text()
         request_data = json.loads(data)
@@ -488,6 +804,10 @@ async def chat_stream(websocket: WebSocket):
         # Force stream to true for WebSocket API
         chat_request.stream = True
         
+        # The stream lives on this worker for its whole lifetime; record the owner so any worker can look it up
+        session_id = uuid.uuid4().hex
+        await asyncio.to_thread(get_shared_state().register_session, session_id, "chat", {"model": chat_request.model})
+        
         # Check for image generation commands in streaming chat
         if chat_request.messages and len(chat_request.messages) > 0:
             latest_message = chat_request.messages[-1]
@@ -605,71 +925,41 @@ async def chat_stream(websocket: WebSocket):
                         return
             
         try:
-            from litellm import completion
-            
             logging.info(f"Starting streaming completion for model: {chat_request.model}")
             
             # Process messages to ensure they're in the correct format for LiteLLM
-            processed_messages = []
-            for msg in chat_request.messages:
-                processed_msg = {"role": msg.role}
-                
-                # Handle different content types
-                if isinstance(msg.content, str):
-                    processed_msg["content"] = msg.content
-                elif isinstance(msg.content, list):
-                    processed_content = []
-                    for content_item in msg.content:
-                        if isinstance(content_item, MessageContent):
-                            # Convert Pydantic object to dict
-                            content_dict = {"type": content_item.type}
-                            if content_item.text is not None:
-                                content_dict["text"] = content_item.text
-                            if content_item.image_url is not None:
-                                content_dict["image_url"] = content_item.image_url
-                            processed_content.append(content_dict)
-                        elif isinstance(content_item, dict):
-                            # Already a dict, use as-is
-                            processed_content.append(content_item)
-                        else:
-                            # Fallback for other types
-                            processed_content.append(str(content_item))
-                    processed_msg["content"] = processed_content
-                else:
-                    # Fallback for other content types
-                    processed_msg["content"] = str(msg.content)
-                
-                processed_messages.append(processed_msg)
+            processed_messages = process_messages_for_litellm(chat_request.messages)
             
-            # Stream the chat response
-            response_stream = completion(
-                model=chat_request.model,
-                messages=processed_messages,
-                temperature=chat_request.temperature,
-                stream=True
-            )
+            # Inject the canonical system prompt ahead of the conversation so it forms a stable cache prefix
+            try:
+                resolved_prompt = resolve_system_prompt(chat_request.system_prompt_id, chat_request.system_prompt)
+            except KeyError:
+                await websocket.send_json({"error": f"System prompt '{chat_request.system_prompt_id}' not found"})
+                return
+            if resolved_prompt:
+                processed_messages = apply_system_prompt(processed_messages, resolved_prompt["prompt"])
             
+            # Stream the chat response through the provider router (failover/hedging when configured)
+            started_at = time.perf_counter()
             full_response = ""
+            first_token_ms = None
+            usage = None
+            served_by = chat_request.model
             
-            for chunk in response_stream:
-                delta = None
+            async for event in provider_router.stream(chat_request.model, processed_messages, chat_request.temperature):
+                served_by = event["model"]
+                if getattr(event["chunk"], 'usage', None) is not None:
+                    usage = event["chunk"].usage
                 
-                # Handle different response formats
-                if hasattr(chunk, 'choices') and chunk.choices:
-                    if hasattr(chunk.choices[0], 'delta'):
-                        if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content is not None:
-                            delta = chunk.choices[0].delta.content
-                        elif hasattr(chunk.choices[0].delta, 'text') and chunk.choices[0].delta.text is not None:
-                            delta = chunk.choices[0].delta.text
-                    elif hasattr(chunk.choices[0], 'text') and chunk.choices[0].text is not None:
-                        delta = chunk.choices[0].text
-                    elif hasattr(chunk.choices[0], 'message') and hasattr(chunk.choices[0].message, 'content') and chunk.choices[0].message.content is not None:
-                        delta = chunk.choices[0].message.content
+                delta = event["delta"]
                 
                 # Skip empty deltas
                 if not delta:
                     continue
                 
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started_at) * 1000
+                
                 # Detect and handle <think> tags while streaming
                 full_response += delta
                 
@@ -692,9 +982,13 @@ async def chat_stream(websocket: WebSocket):
                     "role": "assistant",
                     "content": full_response
                 },
-                "model": chat_request.model
+                "model": chat_request.model,
+                "served_by": served_by,
+                "session": session_id,
+                "worker": worker_id()
             })
             
+            record_system_prompt_usage(resolved_prompt, served_by, processed_messages, usage, first_token_ms)
             logging.info("Streaming completed successfully")
                 
         except Exception as e:
@@ -707,18 +1001,360 @@ async def chat_stream(websocket: WebSocket):
     except Exception as e:
         logging.error(f"WebSocket error: {str(e)}", exc_info=True)
     finally:
+        if session_id:
+            await asyncio.to_thread(get_shared_state().end_session, session_id)
         # Ensure the connection is closed properly
         try:
             await websocket.close()
         except:
             pass
 
+# System Prompt Registry Endpoints
+@app.get("/api/system-prompts")
+async def list_system_prompts():
+    """List the server-side system prompt library"""
+    return {"prompts": get_prompt_registry().list_prompts()}
+
+@app.get("/api/system-prompts/stats")
+async def system_prompt_cache_stats():
+    """Prefix cache hit statistics per system prompt, derived from backend prompt-eval reports"""
+    return get_prompt_registry().get_cache_stats()
+
+@app.get("/api/system-prompts/{prompt_id}")
+async def get_system_prompt(prompt_id: str):
+    """Get a single system prompt by id"""
+    entry = get_prompt_registry().get_prompt(prompt_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"System prompt '{prompt_id}' not found")
+    return entry
+
+@app.post("/api/system-prompts")
+async def create_system_prompt(request: SystemPromptCreateRequest):
+    """Create or replace a user-defined system prompt"""
+    if not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt text must not be empty")
+
+    try:
+        return get_prompt_registry().register_prompt(
+            request.id,
+            request.prompt,
+            name=request.name,
+            description=request.description,
+            category=request.category
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error saving system prompt: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/system-prompts/{prompt_id}")
+async def delete_system_prompt(prompt_id: str):
+    """Delete a user-defined system prompt"""
+    if not get_prompt_registry().delete_prompt(prompt_id):
+        raise HTTPException(status_code=404, detail=f"Custom system prompt '{prompt_id}' not found")
+    return {"message": f"System prompt '{prompt_id}' deleted successfully"}
+
+# Prompt Comparison Endpoints
+MAX_COMPARISON_VARIANTS = 8
+
+class StartGate:
+    """Releases a fixed number of tasks together once every one of them has arrived"""
+    
+    def __init__(self, parties: int):
+        self.parties = parties
+        self.arrived = 0
+        self._released = asyncio.Event()
+    
+    async def arrive_and_wait(self):
+        self.arrived += 1
+        if self.arrived >= self.parties:
+            self._released.set()
+        await self._released.wait()
+
+def compute_stream_metrics(started_at, first_token_at, finished_at, completion_tokens):
+    """
+    Build the timing report for one streamed completion.
+    Tokens/s is measured over the decode phase only (first token to last token),
+    so slow prompt processing shows up in TTFT instead of diluting throughput.
+    """
+    ttft = first_token_at - started_at if first_token_at is not None else None
+    decode_time = finished_at - first_token_at if first_token_at is not None else 0
+    tokens_per_second = completion_tokens / decode_time if decode_time > 0 and completion_tokens else None
+
+    return {
+        "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+        "total_ms": round((finished_at - started_at) * 1000, 1),
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": round(tokens_per_second, 2) if tokens_per_second is not None else None
+    }
+
+async def run_comparison_variant(variant_id, variant, resolved_prompt, processed_messages, temperature, start_gate, send_queue):
+    """
+    Stream a single comparison variant, pushing its frames onto send_queue.
+    Arrives at start_gate once prepared, so every variant is released at the same instant.
+    """
+    variant_messages = apply_system_prompt(processed_messages, resolved_prompt["prompt"] if resolved_prompt else None)
+    full_response = ""
+    streamed_chunks = 0
+    usage = None
+    usage_tokens = None
+    first_token_at = None
+    error = None
+
+    # Loading LiteLLM and residency bookkeeping (and any eviction it triggers) happen before
+    # the gate so they are not timed. A variant that fails here still arrives, so the others
+    # are not held at the gate.
+    acompletion = None
+    keep_alive = None
+    tracked = False
+    try:
+        acompletion = (await subsystems.aget("litellm")).acompletion
+        keep_alive = await residency_manager.before_request(variant.model)
+        tracked = True
+    except Exception as e:
+        logging.error(f"Comparison variant {variant_id} ({variant.model}) could not start: {str(e)}")
+        error = str(e)
+    await start_gate.arrive_and_wait()
+
+    started_at = time.perf_counter()
+    try:
+        if error:
+            raise RuntimeError(error)
+        response_stream = await acompletion(
+            model=variant.model,
+            messages=variant_messages,
+            temperature=variant.temperature if variant.temperature is not None else temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **completion_options(keep_alive)
+        )
+
+        async for chunk in response_stream:
+            # Some providers report exact usage on the last chunk
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+                if getattr(usage, 'completion_tokens', None):
+                    usage_tokens = usage.completion_tokens
+
+            delta = extract_stream_delta(chunk)
+            if not delta:
+                continue
+
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            streamed_chunks += 1
+            full_response += delta
+            await send_queue.put({"variant": variant_id, "chunk": delta})
+
+    except Exception as e:
+        if not error:
+            logging.error(f"Comparison variant {variant_id} ({variant.model}) failed: {str(e)}")
+            error = str(e)
+    finally:
+        if tracked:
+            residency_manager.after_request(variant.model)
+
+    metrics = compute_stream_metrics(
+        started_at, first_token_at, time.perf_counter(),
+        usage_tokens if usage_tokens is not None else streamed_chunks
+    )
+    metrics["token_count_source"] = "usage" if usage_tokens is not None else "chunks"
+    if not error:
+        record_system_prompt_usage(resolved_prompt, variant.model, variant_messages, usage, metrics["ttft_ms"])
+
+    result = {
+        "variant": variant_id,
+        "done": True,
+        "model": variant.model,
+        "system_prompt": resolved_prompt["prompt"] if resolved_prompt else None,
+        "system_prompt_id": resolved_prompt["id"] if resolved_prompt else None,
+        "message": {
+            "role": "assistant",
+            "content": full_response
+        },
+        "metrics": metrics
+    }
+    if error:
+        result["error"] = error
+
+    await send_queue.put(result)
+    return result
+
+@app.websocket("/api/compare/stream")
+async def compare_stream(websocket: WebSocket):
+    """
+    Run one conversation against several (model, system_prompt) variants concurrently.
+
+    Frames are multiplexed over the socket and tagged with a "variant" id:
+    {"variant", "chunk"} while streaming, {"variant", "done", "metrics"} when a
+    variant finishes, and a final {"done", "results"} frame once all are complete.
+    """
+    tasks = []
+    session_id = None
+    try:
+        await websocket.accept()
+
+        if await asyncio.to_thread(check_rate_limit, websocket.client.host if websocket.client else "unknown") is not None:
+            await websocket.send_json({"error": "Rate limit exceeded"})
+            return
+
+        data = await websocket.receive_text()
+        try:
+            comparison_request = ComparisonRequest(**json.loads(data))
+        except Exception as validation_error:
+            await websocket.send_json({"error": f"Invalid request format: {str(validation_error)}"})
+            return
+
+        variants = comparison_request.variants
+        if not variants:
+            await websocket.send_json({"error": "At least one variant is required"})
+            return
+        if len(variants) > MAX_COMPARISON_VARIANTS:
+            await websocket.send_json({"error": f"At most {MAX_COMPARISON_VARIANTS} variants can be compared at once"})
+            return
+
+        variant_ids = [variant.id or f"variant_{i}" for i, variant in enumerate(variants)]
+        if len(set(variant_ids)) != len(variant_ids):
+            await websocket.send_json({"error": "Variant ids must be unique"})
+            return
+
+        try:
+            resolved_prompts = [resolve_system_prompt(v.system_prompt_id, v.system_prompt) for v in variants]
+        except KeyError as e:
+            await websocket.send_json({"error": f"System prompt '{e.args[0]}' not found"})
+            return
+
+        processed_messages = process_messages_for_litellm(comparison_request.messages)
+        session_id = uuid.uuid4().hex
+        await asyncio.to_thread(get_shared_state().register_session, session_id, "compare", {"variants": len(variants)})
+        logging.info(f"Starting comparison of {len(variants)} variants: {[v.model for v in variants]}")
+
+        await websocket.send_json({
+            "start": True,
+            "session": session_id,
+            "worker": worker_id(),
+            "variants": [
+                {
+                    "variant": variant_id,
+                    "model": variant.model,
+                    "system_prompt": resolved["prompt"] if resolved else None,
+                    "system_prompt_id": resolved["id"] if resolved else None
+                }
+                for variant_id, variant, resolved in zip(variant_ids, variants, resolved_prompts)
+            ]
+        })
+
+        # Each variant prepares (residency, eviction) and then waits at the gate, which opens
+        # only when all have arrived, so no variant gets a head start from being ready earlier
+        start_gate = StartGate(len(variants))
+        send_queue = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(run_comparison_variant(
+                variant_id, variant, resolved, processed_messages,
+                comparison_request.temperature, start_gate, send_queue
+            ))
+            for variant_id, variant, resolved in zip(variant_ids, variants, resolved_prompts)
+        ]
+
+        # A single sender drains the queue so frames from different variants never interleave mid-send
+        pending = len(tasks)
+        while pending:
+            frame = await send_queue.get()
+            await websocket.send_json(frame)
+            if frame.get("done"):
+                pending -= 1
+
+        results = [task.result() for task in tasks]
+        await websocket.send_json({
+            "done": True,
+            "results": [
+                {key: result[key] for key in ("variant", "model", "system_prompt_id", "metrics", "error") if key in result}
+                for result in results
+            ]
+        })
+
+    except WebSocketDisconnect:
+        logging.info("Comparison WebSocket disconnected")
+    except Exception as e:
+        logging.error(f"Comparison WebSocket error: {str(e)}", exc_info=True)
+        try:
+            await websocket.send_json({"error": f"Comparison error: {str(e)}"})
+        except:
+            pass
+    finally:
+        # Stop any variants still generating for a client that went away
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        if session_id:
+            await asyncio.to_thread(get_shared_state().end_session, session_id)
+        try:
+            await websocket.close()
+        except:
+            pass
+
 # RAG Endpoints
+async def require_rag_manager(collection: Optional[str] = None, create: bool = False):
+    """
+    Return the RAG manager of a collection (the default one if omitted),
+    loading the RAG subsystem off the event loop on first use.
+    Unknown collections are a 404 unless create is set.
+    """
+    try:
+        rag_helper = await subsystems.aget("rag")
+    except ImportError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        return await asyncio.to_thread(rag_helper.get_rag_manager, collection, create or not collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Collection '{collection}' not found")
+
+async def run_rag_search(request) -> dict:
+    """Hybrid search for a query or search request, fanned out when it names several collections"""
+    rag_helper = await subsystems.aget("rag")
+    where = None
+    if request.filters is not None:
+        filters = request.filters
+        where = rag_helper.build_where(
+            sources=filters.sources,
+            page_min=filters.page_min,
+            page_max=filters.page_max,
+            ingested_after=filters.ingested_after.timestamp() if filters.ingested_after else None,
+            ingested_before=filters.ingested_before.timestamp() if filters.ingested_before else None
+        )
+    search_kwargs = dict(
+        n_results=request.n_results,
+        vector_weight=request.vector_weight,
+        lexical_weight=request.lexical_weight,
+        mmr_lambda=request.mmr_lambda,
+        merge_adjacent=request.merge_adjacent,
+        where=where
+    )
+    if request.collections and len(request.collections) > 1:
+        # Resolve every collection first so unknown names are a 404, not a failed search
+        for name in request.collections:
+            await require_rag_manager(name)
+        return await asyncio.to_thread(rag_helper.search_collections, request.collections, request.query, **search_kwargs)
+    
+    collection = request.collections[0] if request.collections else request.collection
+    rag_manager = await require_rag_manager(collection)
+    return await asyncio.to_thread(rag_manager.hybrid_search, request.query, **search_kwargs)
+
 @app.post("/api/rag/upload", response_model=DocumentUploadResponse)
-async def upload_document(file: UploadFile = File(...)):
-    """Upload a document to the RAG knowledge base"""
-    if not get_rag_manager:
-        raise HTTPException(status_code=500, detail="RAG functionality not available")
+async def upload_document(file: UploadFile = File(...), collection: Optional[str] = Form(None)):
+    """
+    Upload a document to the RAG knowledge base
+    
+    The document goes into the given collection, which is created on first
+    use. Returns as soon as the document is queued; follow ingestion through
+    /api/rag/jobs/{job_id} (snapshot), /api/rag/jobs/{job_id}/events (SSE)
+    or the /api/rag/jobs/{job_id}/ws WebSocket.
+    """
+    # Fail the upload right away if the RAG subsystem or the collection is unavailable
+    await require_rag_manager(collection, create=True)
     
     try:
         # Check file type
@@ -728,86 +1364,364 @@ async def upload_document(file: UploadFile = File(...)):
                 message="Only PDF and TXT files are supported"
             )
         
-        # Read file content
-        content = await file.read()
-        
         # Get file extension
         file_type = "pdf" if file.filename.lower().endswith('.pdf') else "txt"
         
-        # Add to RAG system
-        rag_manager = get_rag_manager()
-        success = rag_manager.add_document(content, file.filename, file_type)
-        
-        if success:
-            return DocumentUploadResponse(
-                success=True,
-                message=f"Document '{file.filename}' uploaded successfully",
-                filename=file.filename
-            )
-        else:
-            return DocumentUploadResponse(
-                success=False,
-                message=f"Failed to upload document '{file.filename}'"
+        # Stream the upload to disk, hashing it on the way
+        try:
+            file_path, size_bytes, content_hash = await spool_upload(
+                file, suffix=f".{file_type}", max_bytes=MAX_UPLOAD_BYTES or None, spool_dir=UPLOAD_SPOOL_DIR
             )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        
+        # Hand off to the background ingestion pipeline, which owns the spooled file from here
+        job = get_ingestion_manager(require_rag_manager).submit(
+            file_path, file.filename, file_type, size_bytes, content_hash, collection=collection
+        )
+        
+        return DocumentUploadResponse(
+            success=True,
+            message=f"Document '{file.filename}' queued for ingestion",
+            filename=file.filename,
+            job_id=job.job_id
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error uploading document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/rag/jobs")
+async def list_ingestion_jobs():
+    """List ingestion jobs started by this worker"""
+    return {"jobs": get_ingestion_manager(require_rag_manager).list_jobs()}
+
+@app.get("/api/rag/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Current progress of an ingestion job"""
+    job = await asyncio.to_thread(get_ingestion_manager(require_rag_manager).get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job '{job_id}' not found")
+    return job
+
+@app.get("/api/rag/jobs/{job_id}/events")
+async def stream_ingestion_job(job_id: str):
+    """Stream ingestion progress as server-sent events until the job finishes"""
+    ingestion_manager = get_ingestion_manager(require_rag_manager)
+    if await asyncio.to_thread(ingestion_manager.get_job, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job '{job_id}' not found")
+    
+    async def event_stream():
+        async for snapshot in ingestion_manager.watch(job_id):
+            yield f"data: {json.dumps(snapshot)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/rag/jobs/{job_id}/ws")
+async def ingestion_job_ws(websocket: WebSocket, job_id: str):
+    """Stream ingestion progress over a WebSocket until the job finishes"""
+    await websocket.accept()
+    try:
+        sent = False
+        async for snapshot in get_ingestion_manager(require_rag_manager).watch(job_id):
+            await websocket.send_json(snapshot)
+            sent = True
+        if not sent:
+            await websocket.send_json({"error": f"Ingestion job '{job_id}' not found"})
+    except WebSocketDisconnect:
+        logging.info("Ingestion progress WebSocket disconnected")
+    finally:
+        try:
+            await websocket.close()
+        except:
+            pass
+
+async def resolve_rag_model(model: Optional[str]) -> str:
+    """Ollama model name for a RAG answer: the requested one without its "ollama/" prefix, or a preferred default"""
+    # Clean model name - remove "ollama/" prefix if present
+    model_name = model
+    if model_name and model_name.startswith("ollama/"):
+        model_name = model_name.replace("ollama/", "")
+    
+    # If no model provided, use a default from available models
+    if not model_name:
+        # Get available models and pick a good default
+        available_models = await asyncio.to_thread(get_models_for_provider, 'ollama')
+        if available_models:
+            # Prefer larger models for better RAG responses
+            preferred_models = ['llama3.3:70b', 'qwen3:32b', 'qwen2.5vl:32b', 'gemma3:27b', 'devstral:24b']
+            for preferred in preferred_models:
+                if preferred in available_models:
+                    model_name = preferred
+                    break
+            if not model_name:
+                model_name = available_models[0]  # Use first available as fallback
+        else:
+            raise HTTPException(status_code=500, detail="No models available for RAG")
+    
+    return model_name
+
 @app.post("/api/rag/query", response_model=RAGQueryResponse)
 async def rag_query(request: RAGQueryRequest):
     """Query the RAG system with context from uploaded documents"""
-    if not get_rag_manager:
-        raise HTTPException(status_code=500, detail="RAG functionality not available")
-    
-    try:
-        rag_manager = get_rag_manager()
-        
-        # Clean model name - remove "ollama/" prefix if present
-        model_name = request.model
-        if model_name and model_name.startswith("ollama/"):
-            model_name = model_name.replace("ollama/", "")
-        
-        # If no model provided, use a default from available models
-        if not model_name:
-            # Get available models and pick a good default
-            available_models = get_models_for_provider('ollama')
-            if available_models:
-                # Prefer larger models for better RAG responses
-                preferred_models = ['llama3.3:70b', 'qwen3:32b', 'qwen2.5vl:32b', 'gemma3:27b', 'devstral:24b']
-                for preferred in preferred_models:
-                    if preferred in available_models:
-                        model_name = preferred
-                        break
-                if not model_name:
-                    model_name = available_models[0]  # Use first available as fallback
-            else:
-                raise HTTPException(status_code=500, detail="No models available for RAG")
+    rag_manager = await require_rag_manager()
+    
+    try:
+        model_name = await resolve_rag_model(request.model)
         
         # Get relevant documents
-        sources = rag_manager.search_documents(request.query, n_results=3)
+        search = await run_rag_search(request)
         
-        # Generate RAG response
-        response = rag_manager.generate_rag_response(request.query, model_name)
+        # Generate RAG response from the passages that fit the model's token budget
+        answer = await asyncio.to_thread(rag_manager.answer_query, request.query, model_name, search["results"])
         
         return RAGQueryResponse(
-            response=response,
-            sources=sources
+            response=answer["response"],
+            sources=answer["sources"],
+            timings_ms=search["timings_ms"],
+            context=answer["context"]
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in RAG query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def rag_answer_events(request: RAGQueryRequest):
+    """
+    Events of a streamed RAG answer
+    
+    Retrieves once, yields the sources and context budget before generation
+    starts, then the answer deltas from the provider router, then a final
+    "done" event with the full answer and latencies.
+    """
+    rag_manager = await require_rag_manager()
+    started_at = time.perf_counter()
+    model_name = await resolve_rag_model(request.model)
+    
+    search = await run_rag_search(request)
+    timings_ms = dict(search["timings_ms"])
+    
+    if not search["results"]:
+        yield {"sources": [], "context": None, "timings_ms": timings_ms}
+        yield {"done": True, "response": (await subsystems.aget("rag")).NO_CONTEXT_ANSWER, "model": model_name, "timings_ms": timings_ms}
+        return
+    
+    rag_prompt, sources, context = await asyncio.to_thread(rag_manager.build_rag_prompt, request.query, model_name, search["results"])
+    timings_ms["sources_ms"] = round((time.perf_counter() - started_at) * 1000, 2)
+    yield {"sources": sources, "context": context, "timings_ms": timings_ms}
+    
+    full_response = ""
+    served_by = f"ollama/{model_name}"
+    async for event in provider_router.stream(served_by, [{"role": "user", "content": rag_prompt}], request.temperature):
+        served_by = event["model"]
+        delta = event["delta"]
+        if not delta:
+            continue
+        if "first_token_ms" not in timings_ms:
+            timings_ms["first_token_ms"] = round((time.perf_counter() - started_at) * 1000, 2)
+        full_response += delta
+        yield {"chunk": delta}
+    
+    timings_ms["total_ms"] = round((time.perf_counter() - started_at) * 1000, 2)
+    yield {"done": True, "response": full_response, "model": model_name, "served_by": served_by, "timings_ms": timings_ms}
+
+@app.post("/api/rag/query/stream")
+async def rag_query_stream(request: RAGQueryRequest):
+    """
+    Query the RAG system and stream the answer as server-sent events
+    
+    The first event carries the sources, followed by {"chunk": ...} deltas
+    and a final {"done": true, ...} event; failures arrive as {"error": ...}.
+    """
+    await require_rag_manager()
+    
+    async def event_stream():
+        try:
+            async for event in rag_answer_events(request):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logging.error(f"Error in streamed RAG query: {str(e)}", exc_info=True)
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/rag/stream")
+async def rag_stream(websocket: WebSocket):
+    """Query the RAG system over a WebSocket; sends the same events as /api/rag/query/stream"""
+    session_id = None
+    await websocket.accept()
+    try:
+        if await asyncio.to_thread(check_rate_limit, websocket.client.host if websocket.client else "unknown") is not None:
+            await websocket.send_json({"error": "Rate limit exceeded"})
+            return
+        
+        try:
+            request = RAGQueryRequest(**json.loads(await websocket.receive_text()))
+        except Exception as validation_error:
+            await websocket.send_json({"error": f"Invalid request format: {str(validation_error)}"})
+            return
+        
+        session_id = uuid.uuid4().hex
+        await asyncio.to_thread(get_shared_state().register_session, session_id, "rag", {"model": request.model})
+        
+        try:
+            async for event in rag_answer_events(request):
+                if event.get("done"):
+                    event = {**event, "session": session_id, "worker": worker_id()}
+                await websocket.send_json(event)
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            logging.error(f"Error in streamed RAG query: {str(e)}", exc_info=True)
+            await websocket.send_json({"error": str(e)})
+    
+    except WebSocketDisconnect:
+        logging.info("RAG WebSocket disconnected")
+    finally:
+        if session_id:
+            await asyncio.to_thread(get_shared_state().end_session, session_id)
+        try:
+            await websocket.close()
+        except:
+            pass
+
+@app.post("/api/rag/search")
+async def rag_search(request: RAGSearchRequest):
+    """Hybrid (BM25 + vector) search with per-stage latency, without generating an answer"""
+    try:
+        return await run_rag_search(request)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in RAG search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/rag/collections")
+async def list_collections():
+    """List the collections (namespaces) of the knowledge base with their document counts"""
+    await require_rag_manager()
+    rag_helper = await subsystems.aget("rag")
+    
+    def describe():
+        collections = []
+        for name in rag_helper.list_collections():
+            try:
+                rag_manager = rag_helper.get_rag_manager(name, create=False)
+            except KeyError:
+                continue
+            collections.append({"name": name, **rag_manager.catalog.get_stats()})
+        return collections
+    
+    return {"collections": await asyncio.to_thread(describe)}
+
+@app.post("/api/rag/collections")
+async def create_collection(request: CollectionCreateRequest):
+    """Create a collection, optionally with its own HNSW index settings"""
+    await require_rag_manager()
+    rag_helper = await subsystems.aget("rag")
+    if request.name in await asyncio.to_thread(rag_helper.list_collections):
+        raise HTTPException(status_code=409, detail=f"Collection '{request.name}' already exists")
+    try:
+        rag_manager = await asyncio.to_thread(rag_helper.get_rag_manager, request.name, True, request.hnsw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"name": rag_manager.collection_name, "vector_store": rag_manager.vector_store.get_stats()}
+
+@app.post("/api/rag/collections/{name}/migration", status_code=202)
+async def start_embedding_migration(name: str, request: EmbeddingMigrationRequest):
+    """
+    Re-embed a collection with another embedding model in the background
+    
+    Queries keep using the current model until the new vectors are complete;
+    then the collection switches over atomically. Follow progress with
+    GET /api/rag/collections/{name}/migration.
+    """
+    rag_manager = await require_rag_manager(name)
+    if not await asyncio.to_thread(rag_manager.check_embedding_model_available, request.embedding_model):
+        raise HTTPException(status_code=400, detail=f"Embedding model {request.embedding_model} is not available in Ollama")
+    try:
+        migration = await asyncio.to_thread(
+            start_migration, rag_manager, request.embedding_model,
+            request.max_chunks_per_second, max(1, request.batch_size)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except MigrationConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return migration.to_dict()
+
+@app.get("/api/rag/collections/{name}/migration")
+async def get_embedding_migration(name: str):
+    """Progress of the collection's current or last embedding-model migration"""
+    await require_rag_manager(name)
+    status = await asyncio.to_thread(get_migration_status, name)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No migration of collection '{name}'")
+    return status
+
+@app.delete("/api/rag/collections/{name}/migration")
+async def cancel_embedding_migration(name: str):
+    """Stop a running migration and drop its partial store; the collection keeps its current model"""
+    await require_rag_manager(name)
+    if not await asyncio.to_thread(cancel_migration, name):
+        raise HTTPException(status_code=404, detail=f"No running migration of collection '{name}'")
+    return {"message": f"Cancelling the migration of collection '{name}'"}
+
+@app.get("/api/rag/maintenance")
+async def get_store_maintenance():
+    """Compaction and snapshot schedule, the last run of each and the snapshots on disk"""
+    return await asyncio.to_thread(store_maintenance.get_status)
+
+@app.post("/api/rag/maintenance/compact")
+async def compact_stores():
+    """
+    Compact all RAG stores now and report their size on disk before and after
+    
+    Ingestion into a collection waits while it is compacted; searches continue.
+    """
+    try:
+        return await store_maintenance.compact()
+    except MaintenanceBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error compacting RAG stores: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/rag/maintenance/snapshot")
+async def snapshot_stores():
+    """Take a consistent snapshot of all RAG stores for backup without stopping the API"""
+    try:
+        return await store_maintenance.snapshot()
+    except MaintenanceBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error taking a RAG snapshot: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/rag/documents")
-async def list_documents():
+async def list_documents(collection: Optional[str] = None):
     """List all documents in the RAG knowledge base"""
-    if not get_rag_manager:
-        raise HTTPException(status_code=500, detail="RAG functionality not available")
+    rag_manager = await require_rag_manager(collection)
     
     try:
-        rag_manager = get_rag_manager()
-        documents = rag_manager.list_documents()
+        documents = await asyncio.to_thread(rag_manager.list_documents)
         return {"documents": documents}
         
     except Exception as e:
@@ -815,14 +1729,13 @@ async def list_documents():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/rag/documents/{filename}")
-async def delete_document(filename: str):
+async def delete_document(filename: str, collection: Optional[str] = None):
     """Delete a document from the RAG knowledge base"""
-    if not get_rag_manager:
-        raise HTTPException(status_code=500, detail="RAG functionality not available")
+    rag_manager = await require_rag_manager(collection)
     
     try:
-        rag_manager = get_rag_manager()
-        success = rag_manager.delete_document(filename)
+        # Waits for the collection's cross-process writer lock; keep that off the event loop
+        success = await asyncio.to_thread(rag_manager.delete_document, filename)
         
         if success:
             return {"message": f"Document '{filename}' deleted successfully"}
@@ -835,24 +1748,124 @@ async def delete_document(filename: str):
         logging.error(f"Error deleting document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/rag/embedding-cache")
+async def get_embedding_cache_stats():
+    """Embedding cache size and hit rate"""
+    rag_manager = await require_rag_manager()
+    return await asyncio.to_thread(rag_manager.embedding_cache.get_stats)
+
+@app.delete("/api/rag/embedding-cache")
+async def clear_embedding_cache(model: Optional[str] = None):
+    """Drop cached embeddings (all models, or only the given one)"""
+    rag_manager = await require_rag_manager()
+    await asyncio.to_thread(rag_manager.embedding_cache.clear, model)
+    return {"message": "Embedding cache cleared"}
+
+@app.post("/api/embeddings")
+async def create_embeddings(request: EmbeddingsRequest):
+    """
+    Embed many texts in one call, through the RAG embedding cache and the batched Ollama client
+    
+    Repeated texts are embedded once. The "binary" format returns the vectors as
+    one row-major little-endian float32 matrix (application/octet-stream), with
+    its shape in the X-Embedding-Count and X-Embedding-Dimensions headers.
+    """
+    if request.format not in ("json", "base64", "binary"):
+        raise HTTPException(status_code=400, detail="format must be 'json', 'base64' or 'binary'")
+    if not request.texts:
+        raise HTTPException(status_code=400, detail="texts must not be empty")
+    if EMBEDDINGS_MAX_TEXTS and len(request.texts) > EMBEDDINGS_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {EMBEDDINGS_MAX_TEXTS} texts per request")
+    
+    rag_manager = await require_rag_manager()
+    rag_helper = await subsystems.aget("rag")
+    model = request.model or rag_manager.embedding_model
+    # Every model gets a long-lived client and its own cache rows, so only known models are served
+    allowed_models = rag_helper.embedding_models_in_use() | set(EMBEDDINGS_ALLOWED_MODELS)
+    if model not in allowed_models:
+        raise HTTPException(status_code=400, detail=f"Unknown embedding model '{model}'; expected one of {sorted(allowed_models)}")
+    unique_texts = list(dict.fromkeys(request.texts))
+    started_at = time.perf_counter()
+    try:
+        vectors, cache_hits = await asyncio.to_thread(rag_manager.embed_chunks, unique_texts, model)
+    except Exception as e:
+        logging.error(f"Error embedding {len(unique_texts)} texts with {model}: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e))
+    elapsed_ms = round((time.perf_counter() - started_at) * 1000, 2)
+    
+    # Rows in request order; duplicates share the row of their first occurrence
+    matrix = np.asarray(vectors, dtype="<f4")
+    position = {text: i for i, text in enumerate(unique_texts)}
+    if len(unique_texts) != len(request.texts):
+        matrix = matrix[[position[text] for text in request.texts]]
+    
+    if request.format == "binary":
+        return Response(
+            content=matrix.tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Embedding-Model": model,
+                "X-Embedding-Count": str(matrix.shape[0]),
+                "X-Embedding-Dimensions": str(matrix.shape[1]),
+                "X-Embedding-Unique-Texts": str(len(unique_texts)),
+                "X-Embedding-Cache-Hits": str(cache_hits)
+            }
+        )
+    
+    if request.format == "base64":
+        embeddings = [base64.b64encode(row.tobytes()).decode("ascii") for row in matrix]
+    else:
+        embeddings = matrix.tolist()
+    return {
+        "model": model,
+        "dimensions": matrix.shape[1],
+        "embeddings": embeddings,
+        "unique_texts": len(unique_texts),
+        "cache_hits": cache_hits,
+        "embed_ms": elapsed_ms
+    }
+
 @app.get("/api/rag/status")
 async def rag_status():
     """Check RAG system status"""
-    if not get_rag_manager:
+    try:
+        rag_manager = await require_rag_manager()
+    except HTTPException as e:
         return {
             "available": False,
-            "error": "RAG dependencies not installed"
+            "error": e.detail
+        }
+    
+    rag_helper = await subsystems.aget("rag")
+    
+    def collect_stats():
+        # SQLite and Chroma reads; run in a thread together with the Ollama check
+        return {
+            "collections": rag_helper.list_collections(),
+            "migration": get_migration_status(rag_manager.collection_name),
+            "maintenance": store_maintenance.get_status(),
+            "vector_store": rag_manager.vector_store.get_stats(),
+            "embedding_client": rag_manager.embedding_client.get_stats(),
+            "embedding_cache": rag_manager.embedding_cache.get_stats(),
+            "catalog": rag_manager.catalog.get_stats(),
+            "lexical_index": rag_manager.lexical_index.get_stats(),
+            "token_counter": rag_manager.context_packer.token_counter.get_stats(),
+            "query_embedding_cache": rag_manager.query_embedding_cache.get_stats(),
+            "result_cache": {**rag_manager.result_cache.get_stats(), "collection_version": rag_manager.collection_version()}
         }
     
     try:
-        rag_manager = get_rag_manager()
-        embedding_available = rag_manager.check_embedding_model_available()
+        embedding_available, stats = await asyncio.gather(
+            asyncio.to_thread(rag_manager.check_embedding_model_available),
+            asyncio.to_thread(collect_stats)
+        )
         
         return {
             "available": True,
             "embedding_model": rag_manager.embedding_model,
             "embedding_model_available": embedding_available,
-            "collection_name": rag_manager.collection_name
+            "collection_name": rag_manager.collection_name,
+            **stats
         }
         
     except Exception as e:
@@ -1006,5 +2019,82 @@ async def mcp_tool_call(request: dict):
         logging.error(f"MCP tool call failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Startup and shutdown
+@app.on_event("startup")
+async def startup_event():
+    """Start the subsystem warm-up, residency and store maintenance without delaying the port bind"""
+    global warmup_task
+    warmup_task = asyncio.create_task(subsystems.warm_up())
+    residency_manager.start()
+    store_maintenance.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and persist model usage"""
+    await residency_manager.stop()
+    await store_maintenance.stop()
+    await get_ingestion_manager(require_rag_manager).shutdown()
+    get_shared_state().clear_worker_sessions()
+
+subsystems.mark_app_imported()
+
+def start_chroma_server(port):
+    """Run the single Chroma server process that owns ./chroma_db in multi-worker mode"""
+    logging.info(f"Starting Chroma server for ./chroma_db on port {port}...")
+    return subprocess.Popen(["chroma", "run", "--path", "./chroma_db", "--host", "127.0.0.1", "--port", str(port)])
+
+def wait_for_chroma_server(url, process=None, timeout=60.0):
+    """
+    Block until the Chroma server answers its heartbeat
+    
+    Workers load RAG during their startup warm-up, so they must not start
+    before the server accepts connections.
+    
+    Args:
+        url: Base URL of the Chroma server
+        process: The server process, if started here (fails fast when it exits)
+        timeout: Seconds to wait before giving up
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Chroma server exited with status {process.returncode}")
+        # /api/v2 is served by Chroma 1.x, /api/v1 by older servers
+        for path in ("/api/v2/heartbeat", "/api/v1/heartbeat"):
+            try:
+                if httpx.get(f"{url}{path}", timeout=2.0).status_code == 200:
+                    logging.info(f"Chroma server at {url} is up")
+                    return
+            except httpx.HTTPError:
+                pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Chroma server at {url} did not answer within {timeout:.0f}s")
+        time.sleep(0.5)
+
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ollama WebUI API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes; >1 serves the vector store from a shared Chroma server")
+    parser.add_argument("--chroma-port", type=int, default=8003)
+    parser.add_argument("--chroma-timeout", type=float, default=60.0,
+                        help="Seconds to wait for the Chroma server before starting the workers")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run("api:app", host=args.host, port=args.port, reload=True)
+    else:
+        # Workers inherit these; RAGManager connects to the Chroma server instead of opening ./chroma_db itself
+        os.environ["API_WORKERS"] = str(args.workers)
+        chroma_process = None
+        if not os.environ.get("CHROMA_SERVER_URL"):
+            chroma_process = start_chroma_server(args.chroma_port)
+            os.environ["CHROMA_SERVER_URL"] = f"http://127.0.0.1:{args.chroma_port}"
+        try:
+            wait_for_chroma_server(os.environ["CHROMA_SERVER_URL"], chroma_process, args.chroma_timeout)
+            uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
+        finally:
+            if chroma_process is not None:
+                chroma_process.terminate()
+                chroma_process.wait(timeout=10)
\ No newline at end of file
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark the batched embedding client against the previous one-text-per-request path.
+
+Runs a stub Ollama embedding server in-process, so no Ollama or GPU is needed.
+Each stub request costs a fixed overhead plus a per-text cost, which is what
+makes per-text round trips expensive against a real server.
+
+Usage:
+    python benchmark_embeddings.py --texts 2000 --batch-size 64 --concurrency 4
+"""
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from embedding_client import OllamaEmbeddingClient
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DIMENSIONS = 768
+
+
+def make_stub_handler(request_overhead_ms: float, per_text_ms: float, failure_rate: float, embed=None):
+    """
+    Build a handler emulating Ollama's /api/embeddings (single) and /api/embed (batched)
+
+    embed maps a list of texts to their vectors; by default every text gets a
+    constant vector, which is enough for measuring throughput.
+    """
+
+    class StubEmbeddingHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+            if self.path == "/api/embeddings":
+                texts = [body.get("prompt", "")]
+            elif self.path == "/api/embed":
+                texts = body.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+            else:
+                self.send_error(404)
+                return
+
+            time.sleep((request_overhead_ms + per_text_ms * len(texts)) / 1000)
+
+            if random.random() < failure_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            if embed is not None:
+                vectors = embed(texts)
+            else:
+                vectors = [[(hash(text) % 1000) / 1000.0] * DIMENSIONS for text in texts]
+            payload = {"embedding": vectors[0]} if self.path == "/api/embeddings" else {"embeddings": vectors}
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StubEmbeddingHandler
+
+
+def start_stub_server(request_overhead_ms: float, per_text_ms: float, failure_rate: float, embed=None):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(request_overhead_ms, per_text_ms, failure_rate, embed))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def embed_one_per_request(base_url: str, model: str, texts):
+    """The previous path: one /api/embeddings call per text, serially (as OllamaEmbeddingFunction does)"""
+    session = requests.Session()
+    embeddings = []
+    for text in texts:
+        response = session.post(f"{base_url}/api/embeddings", json={"model": model, "prompt": text})
+        response.raise_for_status()
+        embeddings.append(response.json()["embedding"])
+    return embeddings
+
+
+def run_benchmark(args) -> dict:
+    server, base_url = start_stub_server(args.request_overhead_ms, args.per_text_ms, args.failure_rate)
+    texts = [f"chunk {i} " + "lorem ipsum " * 80 for i in range(args.texts)]
+
+    results = {}
+    try:
+        if not args.skip_baseline:
+            # The baseline has no retries, so it always runs against a healthy server
+            server.RequestHandlerClass = make_stub_handler(args.request_overhead_ms, args.per_text_ms, 0.0)
+            started_at = time.perf_counter()
+            embed_one_per_request(base_url, args.model, texts)
+            elapsed = time.perf_counter() - started_at
+            results["one_per_request"] = {
+                "seconds": round(elapsed, 3),
+                "texts_per_second": round(len(texts) / elapsed, 1),
+                "requests": len(texts)
+            }
+            logging.info(f"one text per request: {results['one_per_request']}")
+            server.RequestHandlerClass = make_stub_handler(args.request_overhead_ms, args.per_text_ms, args.failure_rate)
+
+        client = OllamaEmbeddingClient(
+            base_url=base_url,
+            model=args.model,
+            batch_size=args.batch_size,
+            max_concurrency=args.concurrency,
+            retry_backoff=0.05
+        )
+        started_at = time.perf_counter()
+        embeddings = client.embed(texts)
+        elapsed = time.perf_counter() - started_at
+        assert len(embeddings) == len(texts)
+        stats = client.get_stats()
+        client.close()
+        results["batched"] = {
+            "seconds": round(elapsed, 3),
+            "texts_per_second": round(len(texts) / elapsed, 1),
+            "requests": stats["requests"],
+            "retries": stats["retries"]
+        }
+        logging.info(f"batched client: {results['batched']}")
+    finally:
+        server.shutdown()
+
+    if "one_per_request" in results:
+        results["speedup"] = round(results["one_per_request"]["seconds"] / results["batched"]["seconds"], 1)
+
+    return {
+        "config": {
+            "texts": args.texts,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+            "request_overhead_ms": args.request_overhead_ms,
+            "per_text_ms": args.per_text_ms,
+            "failure_rate": args.failure_rate
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched vs. per-text Ollama embedding requests")
+    parser.add_argument("--texts", type=int, default=1000, help="Number of texts to embed")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--model", default="nomic-embed-text")
+    parser.add_argument("--request-overhead-ms", type=float, default=5.0, help="Stub server cost per HTTP request")
+    parser.add_argument("--per-text-ms", type=float, default=0.5, help="Stub server cost per embedded text")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of batched requests answered with 503")
+    parser.add_argument("--skip-baseline", action="store_true", help="Only run the batched client")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, result in report["results"].items():
+            if isinstance(result, dict):
+                print(f"{name:>16}: {result['seconds']:8.3f}s  {result['texts_per_second']:10.1f} texts/s  {result['requests']} requests")
+        if "speedup" in report["results"]:
+            print(f"{'speedup':>16}: {report['results']['speedup']}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Benchmark RAG ingestion and retrieval end to end, as a quality/latency regression check.
+
+Builds a synthetic corpus with planted facts and runs it through RAGManager:
+splitting, batched embedding, the vector store, the BM25 index and hybrid
+search. Embeddings come from a deterministic stub server (hashed token
+counts), so no Ollama is needed and two runs on the same code give the same
+recall. Every query asks for one planted fact; a result is relevant if it
+contains the fact.
+
+Usage:
+    python benchmark_rag.py --sizes 100 400 1600 --queries 200 --json --output report.json
+    python benchmark_rag.py --baseline report.json   # exits 1 on a regression
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+
+from benchmark_embeddings import start_stub_server
+from document_catalog import DEFAULT_CATALOG_PATH
+from embedding_cache import DEFAULT_CACHE_PATH
+from lexical_index import DEFAULT_LEXICAL_INDEX_PATH
+from vector_store import DEFAULT_VECTOR_STORE_PATH
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger("httpx").setLevel(logging.WARNING)
+for name in ("rag_helper", "vector_store", "lexical_index", "document_catalog", "embedding_cache"):
+    logging.getLogger(name).setLevel(logging.WARNING)
+
+SYLLABLES = ["ka", "lo", "mer", "tis", "van", "dru", "pel", "os", "quin", "ra", "sek", "tor", "ul", "ven", "zi", "bar"]
+PARTS = ["valve", "gasket", "relay", "bearing", "sensor", "bracket", "manifold", "coupling", "filter", "actuator"]
+# Words the fake embedder ignores, as real models give little weight to function words
+STOPWORDS = {"the", "which", "what", "does", "service", "code", "covers", "cover"}
+TOPICS = 12
+WORDS_PER_TOPIC = 150
+
+# Search modes: (vector_weight, lexical_weight)
+MODES = {"hybrid": (1.0, 1.0), "vector": (1.0, 0.0), "lexical": (0.0, 1.0)}
+
+# Metrics compared against a baseline; latencies and throughputs may only regress by the tolerance
+HIGHER_IS_BETTER = ("recall", "mrr", "docs_per_second", "chunks_per_second")
+LOWER_IS_BETTER = ("p50_ms", "p99_ms")
+
+
+def pseudo_word(rng, syllables: int) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def make_corpus(documents: int, seed: int):
+    """
+    Topic-clustered documents, each with a few planted facts
+
+    Returns:
+        (documents as (filename, text), facts as dicts with code, nonce, part and filename)
+    """
+    rng = random.Random(seed)
+    vocabularies = [[pseudo_word(rng, rng.randint(2, 4)) for _ in range(WORDS_PER_TOPIC)] for _ in range(TOPICS)]
+    docs = []
+    facts = []
+    used_nonces = set()
+    for doc_index in range(documents):
+        vocabulary = vocabularies[doc_index % TOPICS]
+        paragraphs = []
+        for _ in range(rng.randint(4, 7)):
+            sentences = [
+                " ".join(rng.choice(vocabulary) for _ in range(rng.randint(6, 14))).capitalize() + "."
+                for _ in range(rng.randint(4, 6))
+            ]
+            paragraphs.append(" ".join(sentences))
+
+        filename = f"doc-{doc_index:06d}.txt"
+        for fact_index in range(rng.randint(1, 3)):
+            nonce = pseudo_word(rng, 4)
+            while nonce in used_nonces:
+                nonce = pseudo_word(rng, 4)
+            used_nonces.add(nonce)
+            fact = {
+                "code": f"SC-{doc_index:06d}-{fact_index}",
+                "nonce": nonce,
+                "part": rng.choice(PARTS),
+                "filename": filename
+            }
+            facts.append(fact)
+            # A short paragraph of its own, so the splitter never cuts the fact in half
+            paragraphs.insert(rng.randint(0, len(paragraphs)),
+                              f"Service code {fact['code']} covers the {fact['nonce']} {fact['part']}.")
+        docs.append((filename, "\n\n".join(paragraphs) + "\n"))
+    return docs, facts
+
+
+def make_queries(facts: list, count: int, seed: int) -> list:
+    """Questions asking for a fact by its nonce word or by its service code"""
+    rng = random.Random(seed + 1)
+    queries = []
+    for fact in rng.sample(facts, min(count, len(facts))):
+        if rng.random() < 0.5:
+            text = f"Which service code covers the {fact['nonce']} {fact['part']}?"
+        else:
+            text = f"What does service code {fact['code']} cover?"
+        queries.append({"text": text, "code": fact["code"]})
+    return queries
+
+
+def make_embedder(dimensions: int):
+    """Deterministic stand-in for an embedding model: signed feature hashing of lowercased tokens other than stopwords"""
+    @lru_cache(maxsize=1 << 16)
+    def token_slot(token: str):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % dimensions, 1.0 if value >> 63 else -1.0
+
+    def embed(texts):
+        vectors = []
+        for text in texts:
+            vector = np.zeros(dimensions, dtype=np.float32)
+            for token in text.lower().replace(".", " ").replace("?", " ").split():
+                if token in STOPWORDS:
+                    continue
+                slot, sign = token_slot(token)
+                vector[slot] += sign
+            norm = np.linalg.norm(vector)
+            vectors.append((vector / norm if norm else vector).tolist())
+        return vectors
+
+    return embed
+
+
+def store_bytes(prefix: str) -> int:
+    """Size of the files and directories in the current directory whose name starts with prefix (WAL files included)"""
+    total = 0
+    for name in os.listdir("."):
+        if not name.startswith(prefix):
+            continue
+        if os.path.isdir(name):
+            total += sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(name) for file in files)
+        else:
+            total += os.path.getsize(name)
+    return total
+
+
+def percentile(values: list, q: float) -> float:
+    return round(float(np.percentile(values, q)), 3) if values else 0.0
+
+
+def open_manager(args, base_url: str):
+    """A RAGManager on fresh stores in the current directory (all store paths are the relative defaults)"""
+    from rag_helper import RAGManager
+
+    if args.backend == "chroma":
+        from chromadb.api.client import SharedSystemClient
+
+        # Chroma caches clients by path; every size gets its own ./chroma_db
+        SharedSystemClient.clear_system_cache()
+    return RAGManager("benchmark", embedding_model=args.model, ollama_base_url=base_url)
+
+
+def bench_size(size: int, docs: list, facts: list, args, base_url: str, workdir: str) -> dict:
+    size_dir = os.path.join(workdir, f"size-{size}")
+    corpus_dir = os.path.join(size_dir, "corpus")
+    os.makedirs(corpus_dir)
+    os.chdir(size_dir)
+    manager = open_manager(args, base_url)
+
+    corpus_bytes = 0
+    paths = []
+    for filename, text in docs[:size]:
+        path = os.path.join(corpus_dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        corpus_bytes += len(text.encode("utf-8"))
+        paths.append((path, filename))
+
+    requests_before = manager.embedding_client.get_stats()["requests"]
+    started_at = time.perf_counter()
+    for path, filename in paths:
+        if not manager.add_document_file(path, filename, "txt", batch_size=args.batch_size):
+            raise RuntimeError(f"Ingesting {filename} failed")
+    ingest_seconds = time.perf_counter() - started_at
+    chunks = manager.catalog.get_stats()["chunks"]
+
+    ingest = {
+        "seconds": round(ingest_seconds, 3),
+        "docs_per_second": round(size / ingest_seconds, 1),
+        "chunks_per_second": round(chunks / ingest_seconds, 1),
+        "mb_per_second": round(corpus_bytes / 1e6 / ingest_seconds, 3),
+        "embed_requests": manager.embedding_client.get_stats()["requests"] - requests_before
+    }
+
+    indexed = {filename for _, filename in paths}
+    queries = make_queries([fact for fact in facts if fact["filename"] in indexed], args.queries, args.seed)
+
+    # Warm up the search threads and the store's page cache on queries that are not measured
+    for query in queries[:min(10, len(queries))]:
+        manager.hybrid_search("warm up " + query["text"], n_results=args.k)
+
+    search = {}
+    for mode, (vector_weight, lexical_weight) in MODES.items():
+        latencies = []
+        stages = {}
+        hits = 0
+        reciprocal_ranks = 0.0
+        for query in queries:
+            result = manager.hybrid_search(query["text"], n_results=args.k, vector_weight=vector_weight,
+                                           lexical_weight=lexical_weight)
+            if result["errors"]:
+                raise RuntimeError(f"{mode} search failed: {result['errors']}")
+            latencies.append(result["timings_ms"]["total_ms"])
+            for stage, value in result["timings_ms"].items():
+                if stage != "total_ms":
+                    stages.setdefault(stage, []).append(value)
+            for rank, passage in enumerate(result["results"], start=1):
+                if query["code"] in passage["content"]:
+                    hits += 1
+                    reciprocal_ranks += 1.0 / rank
+                    break
+        search[mode] = {
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+            "mean_ms": round(float(np.mean(latencies)), 3) if latencies else 0.0,
+            "recall": round(hits / len(queries), 4) if queries else 0.0,
+            "mrr": round(reciprocal_ranks / len(queries), 4) if queries else 0.0,
+            "stages_p50_ms": {stage: percentile(values, 50) for stage, values in stages.items()}
+        }
+
+    disk = {
+        "vector_store": store_bytes("chroma_db" if args.backend == "chroma" else "vector_store"),
+        "lexical_index": store_bytes("lexical_index"),
+        "catalog": store_bytes("document_catalog"),
+        "embedding_cache": store_bytes("embedding_cache")
+    }
+    return {
+        "documents": size,
+        "chunks": chunks,
+        "corpus_bytes": corpus_bytes,
+        "queries": len(queries),
+        "ingest": ingest,
+        "search": search,
+        "disk_bytes": disk
+    }
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float, max_recall_drop: float) -> list:
+    """
+    Compare a report with a baseline report of the same configuration
+
+    Args:
+        report: Current report
+        baseline: Earlier report (e.g. from the main branch)
+        tolerance: Allowed relative slowdown of latencies and throughputs (0.25 = 25%)
+        max_recall_drop: Allowed absolute drop of recall and MRR
+
+    Returns:
+        Human-readable regressions, empty if there are none
+    """
+    regressions = []
+
+    def check(label: str, metric: str, current, previous):
+        if current is None or previous is None:
+            return
+        if metric in ("recall", "mrr"):
+            if current < previous - max_recall_drop:
+                regressions.append(f"{label} {metric}: {previous} -> {current}")
+        elif metric in HIGHER_IS_BETTER:
+            if current < previous * (1 - tolerance):
+                regressions.append(f"{label} {metric}: {previous} -> {current}")
+        elif current > previous * (1 + tolerance):
+            regressions.append(f"{label} {metric}: {previous} -> {current}")
+
+    for size, result in report["results"].items():
+        previous = baseline.get("results", {}).get(size)
+        if previous is None:
+            continue
+        for metric in ("docs_per_second", "chunks_per_second"):
+            check(f"size {size} ingest", metric, result["ingest"][metric], previous["ingest"].get(metric))
+        for mode, search in result["search"].items():
+            previous_search = previous["search"].get(mode, {})
+            for metric in ("recall", "mrr") + LOWER_IS_BETTER:
+                check(f"size {size} {mode}", metric, search[metric], previous_search.get(metric))
+    return regressions
+
+
+def run_benchmark(args) -> dict:
+    embed = make_embedder(args.dimensions)
+    server, base_url = start_stub_server(args.request_overhead_ms, args.per_text_ms, 0.0, embed)
+    docs, facts = make_corpus(max(args.sizes), args.seed)
+
+    results = {}
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    # Keep the benchmark's stores, shared state and caches away from the real ones
+    overrides = {
+        "SHARED_STATE_DIR": os.path.join(workdir, "shared_state"),
+        "DOCUMENT_CATALOG_PATH": DEFAULT_CATALOG_PATH,
+        "LEXICAL_INDEX_PATH": DEFAULT_LEXICAL_INDEX_PATH,
+        "EMBEDDING_CACHE_PATH": DEFAULT_CACHE_PATH,
+        "VECTOR_STORE_PATH": DEFAULT_VECTOR_STORE_PATH,
+        "VECTOR_STORE": args.backend,
+        "CHROMA_SERVER_URL": ""
+    }
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        for size in sorted(args.sizes):
+            results[str(size)] = bench_size(size, docs, facts, args, base_url, workdir)
+            logging.info(f"{size} documents: ingest {results[str(size)]['ingest']}, "
+                         f"hybrid {results[str(size)]['search']['hybrid']}")
+    finally:
+        os.chdir(cwd)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "sizes": sorted(args.sizes),
+            "queries": args.queries,
+            "k": args.k,
+            "backend": args.backend,
+            "dimensions": args.dimensions,
+            "batch_size": args.batch_size,
+            "request_overhead_ms": args.request_overhead_ms,
+            "per_text_ms": args.per_text_ms,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG ingestion and retrieval quality and latency")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 400, 1600], help="Corpus sizes in documents")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per corpus size and search mode")
+    parser.add_argument("--k", type=int, default=5, help="Passages returned per query")
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "mmap"])
+    parser.add_argument("--model", default="nomic-embed-text")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks embedded and stored per batch")
+    parser.add_argument("--request-overhead-ms", type=float, default=0.0, help="Stub server cost per HTTP request")
+    parser.add_argument("--per-text-ms", type=float, default=0.0, help="Stub server cost per embedded text")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report to compare against; exit with status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative latency/throughput regression")
+    parser.add_argument("--max-recall-drop", type=float, default=0.02, help="Allowed absolute recall/MRR drop")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            logging.warning("Baseline was run with a different configuration; comparing anyway")
+        report["regressions"] = find_regressions(report, baseline, args.tolerance, args.max_recall_drop)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'docs':>6}  {'chunks':>7}  {'docs/s':>8}  {'mode':>8}  {'p50 ms':>7}  {'p99 ms':>7}  {'recall':>6}  {'mrr':>6}")
+        for size, result in report["results"].items():
+            for mode, search in result["search"].items():
+                print(f"{size:>6}  {result['chunks']:7d}  {result['ingest']['docs_per_second']:8.1f}  {mode:>8}  "
+                      f"{search['p50_ms']:7.2f}  {search['p99_ms']:7.2f}  {search['recall']:6.3f}  {search['mrr']:6.3f}")
+        for regression in report.get("regressions", []):
+            print(f"REGRESSION {regression}")
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
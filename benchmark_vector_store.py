@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vector store backends: Chroma (HNSW) against the memory-mapped
+NumPy store in float16, int8 and float16 with an IVF coarse index.
+
+Vectors are synthetic (clustered, unit-normalized), so no Ollama is needed.
+Recall@k is measured against an exact float32 search.
+
+Usage:
+    python benchmark_vector_store.py --vectors 20000 --dimensions 768 --queries 200
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+
+from vector_store import ChromaVectorStore, MmapVectorStore
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INSERT_BATCH = 1000
+
+
+def make_vectors(count: int, dimensions: int, clusters: int, rng) -> np.ndarray:
+    """Unit vectors scattered around random cluster centres, like embeddings of related chunks"""
+    centres = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+    vectors = centres[rng.integers(clusters, size=count)] + 0.6 * rng.normal(size=(count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> list:
+    scores = queries @ corpus.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def open_store(backend: str, path: str, args):
+    if backend == "chroma":
+        import chromadb
+        from chromadb.api.client import SharedSystemClient
+
+        # Drop the process-wide client cache so reopening measures a real cold start
+        SharedSystemClient.clear_system_cache()
+        client = chromadb.PersistentClient(path=path)
+        return ChromaVectorStore(client.get_or_create_collection("benchmark", embedding_function=None))
+    dtype = "int8" if backend == "mmap_int8" else "float16"
+    ivf_lists = args.ivf_lists if backend == "mmap_ivf" else 0
+    return MmapVectorStore(path, dtype=dtype, ivf_lists=ivf_lists, nprobe=args.nprobe)
+
+
+def bench_backend(backend: str, corpus: np.ndarray, queries: np.ndarray, truth: list, args, workdir: str) -> dict:
+    path = os.path.join(workdir, backend)
+    store = open_store(backend, path, args)
+
+    ids = [f"chunk-{i}" for i in range(len(corpus))]
+    started_at = time.perf_counter()
+    for start in range(0, len(corpus), INSERT_BATCH):
+        end = min(start + INSERT_BATCH, len(corpus))
+        store.upsert(ids[start:end], corpus[start:end].tolist(), [""] * (end - start),
+                     [{"source": "benchmark", "row": i} for i in range(start, end)])
+    insert_seconds = time.perf_counter() - started_at
+    del store
+
+    # Cold start: open the store again and answer a first query
+    started_at = time.perf_counter()
+    store = open_store(backend, path, args)
+    store.query(queries[0].tolist(), args.k)
+    cold_start_ms = (time.perf_counter() - started_at) * 1000
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started_at = time.perf_counter()
+        results = store.query(query.tolist(), args.k)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        hits += len(expected & {int(result["id"].split("-")[1]) for result in results})
+
+    return {
+        "insert_seconds": round(insert_seconds, 3),
+        "inserts_per_second": round(len(corpus) / insert_seconds, 1),
+        "cold_start_ms": round(cold_start_ms, 2),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "query_p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        f"recall_at_{args.k}": round(hits / (len(queries) * args.k), 4),
+        "disk_bytes": directory_bytes(path)
+    }
+
+
+def run_benchmark(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    corpus = make_vectors(args.vectors, args.dimensions, args.clusters, rng)
+    queries = make_vectors(args.queries, args.dimensions, args.clusters, np.random.default_rng(args.seed))
+    # Queries come from the same clusters as the corpus, as questions about indexed documents do
+    queries = corpus[rng.integers(len(corpus), size=args.queries)] + 0.3 * queries
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = exact_neighbours(corpus, queries, args.k)
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="vector_store_bench_")
+    try:
+        for backend in args.backends:
+            results[backend] = bench_backend(backend, corpus, queries, truth, args, workdir)
+            logging.info(f"{backend}: {results[backend]}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "vectors": args.vectors,
+            "dimensions": args.dimensions,
+            "clusters": args.clusters,
+            "queries": args.queries,
+            "k": args.k,
+            "ivf_lists": args.ivf_lists,
+            "nprobe": args.nprobe
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Chroma against the memory-mapped vector store")
+    parser.add_argument("--vectors", type=int, default=20000, help="Corpus size")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=200, help="Topic clusters in the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ivf-lists", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", default=["chroma", "mmap_float16", "mmap_int8", "mmap_ivf"],
+                        choices=["chroma", "mmap_float16", "mmap_int8", "mmap_ivf"])
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        recall_key = f"recall_at_{args.k}"
+        print(f"{'backend':>14}  {'insert/s':>10}  {'cold ms':>8}  {'p50 ms':>7}  {'p99 ms':>7}  {'recall':>6}  {'disk MB':>8}")
+        for name, result in report["results"].items():
+            print(f"{name:>14}  {result['inserts_per_second']:10.1f}  {result['cold_start_ms']:8.1f}  "
+                  f"{result['query_p50_ms']:7.2f}  {result['query_p99_ms']:7.2f}  {result[recall_key]:6.3f}  "
+                  f"{result['disk_bytes'] / 1e6:8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
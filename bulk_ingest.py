@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Bulk-load documents into the RAG knowledge base from directories and zip archives.
+
+PDF and TXT files are parsed and split in a process pool, while this process
+is the only writer: it embeds new chunks in batches (through the embedding
+cache and the batched Ollama client) and stores them with RAGManager. Files
+whose content hash is already in the document catalog are skipped, so an
+interrupted run is resumed by starting it again.
+
+Usage:
+    python bulk_ingest.py ./manuals ./archive.zip --workers 8
+    python bulk_ingest.py ./manuals --force --json
+    python bulk_ingest.py ./contracts --collection legal
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import zipfile
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Optional, Tuple
+
+from document_catalog import DocumentCatalog, file_sha256
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+SUPPORTED_SUFFIXES = (".pdf", ".txt")
+
+# (archive path or None, path of the file or archive member, source name, file type)
+SourceTask = Tuple[Optional[str], str, str, str]
+
+
+def file_type_of(name: str) -> str:
+    return "pdf" if name.lower().endswith(".pdf") else "txt"
+
+
+def discover(paths: List[str]) -> Iterator[SourceTask]:
+    """
+    Supported files under the given directories, zip archives and files
+
+    Sources are named by their path relative to the directory given, their
+    path inside the archive, or their file name for files given directly.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(SUPPORTED_SUFFIXES):
+                        full_path = os.path.join(root, name)
+                        yield None, full_path, os.path.relpath(full_path, path).replace(os.sep, "/"), file_type_of(name)
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for member in sorted(archive.namelist()):
+                    if member.endswith("/") or member.startswith("__MACOSX/"):
+                        continue
+                    if member.lower().endswith(SUPPORTED_SUFFIXES):
+                        yield path, member, member, file_type_of(member)
+        elif os.path.isfile(path) and path.lower().endswith(SUPPORTED_SUFFIXES):
+            yield None, path, os.path.basename(path), file_type_of(path)
+        else:
+            logger.warning(f"Skipping {path}: not a directory, zip archive, PDF or TXT file")
+
+
+# --- Parse workers ---
+_worker = {}
+
+
+def _init_worker(catalog_path: str, force: bool):
+    from rag_helper import make_text_splitter
+
+    _worker["splitter"] = make_text_splitter()
+    _worker["catalog"] = DocumentCatalog(catalog_path)
+    _worker["force"] = force
+
+
+def parse_source(task: SourceTask) -> dict:
+    """
+    Hash, parse and split one file in a worker process
+
+    Returns:
+        Dict with source, file_type, content_hash, bytes and either
+        "skipped" (the indexed document with the same content) or
+        pages and chunks as (text, page) pairs
+    """
+    from rag_helper import iter_document_pages
+
+    archive_path, path, source, file_type = task
+    result = {"source": source, "file_type": file_type}
+    tmp_dir = None
+    try:
+        if archive_path is not None:
+            tmp_dir = tempfile.mkdtemp(prefix="bulk_ingest_")
+            with zipfile.ZipFile(archive_path) as archive:
+                path = archive.extract(path, tmp_dir)
+
+        result["bytes"] = os.path.getsize(path)
+        result["content_hash"] = file_sha256(path)
+        if not _worker["force"]:
+            indexed = _worker["catalog"].find_by_content_hash(result["content_hash"])
+            if indexed:
+                result["skipped"] = indexed[0]["source"]
+                return result
+
+        pages = 0
+        chunks = []
+        for page in iter_document_pages(path, file_type):
+            pages += 1
+            for chunk in _worker["splitter"].split_documents([page]):
+                chunks.append((chunk.page_content, chunk.metadata.get("page", 0)))
+        result["pages"] = pages
+        result["chunks"] = chunks
+        return result
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# --- Single writer ---
+def index_parsed(rag_manager, parsed: dict, batch_size: int) -> dict:
+    """
+    Store the new chunks of a parsed file and record it in the catalog
+
+    Returns:
+        Counts of stored, reused, cached and deleted chunks
+    """
+    plan = rag_manager.plan_document(parsed["source"])
+    records = []
+    for text, page in parsed["chunks"]:
+        record = plan.add_chunk(text, page)
+        if record is not None:
+            records.append(record)
+
+    cached = 0
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        model = rag_manager.embedding_model
+        vectors, cache_hits = rag_manager.embed_chunks([text for _, text, _ in batch], model)
+        cached += cache_hits
+        rag_manager.upsert_chunks(
+            [chunk_id for chunk_id, _, _ in batch],
+            [text for _, text, _ in batch],
+            [metadata for _, _, metadata in batch],
+            vectors,
+            model
+        )
+    deleted = rag_manager.finish_document(plan, parsed["content_hash"], parsed["file_type"])
+    return {"stored": len(records), "reused": plan.reused, "cached": cached, "deleted": deleted}
+
+
+def run(paths: List[str], workers: int, batch_size: int, force: bool, collection: Optional[str] = None) -> dict:
+    """Ingest every supported file under paths into a collection and return the throughput report"""
+    from rag_helper import get_rag_manager
+
+    rag_manager = get_rag_manager(collection)
+    catalog_path = rag_manager.catalog.path
+
+    report = {
+        "files_indexed": 0,
+        "files_skipped": 0,
+        "files_failed": 0,
+        "bytes": 0,
+        "pages": 0,
+        "chunks": 0,
+        "chunks_stored": 0,
+        "chunks_reused": 0,
+        "chunks_cached": 0,
+        "chunks_deleted": 0,
+        "failures": [],
+        "interrupted": False
+    }
+    started_at = time.perf_counter()
+
+    tasks = discover(paths)
+    # Spawned workers do not inherit this process's Chroma client and threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(catalog_path, force)) as pool:
+        pending = set()
+        try:
+            # Keep a bounded number of files in flight so parsed chunks never pile up
+            for task in tasks:
+                pending.add(pool.submit(parse_source, task))
+                if len(pending) < workers * 2:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _write(rag_manager, future.result(), batch_size, force, report)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _write(rag_manager, future.result(), batch_size, force, report)
+        except KeyboardInterrupt:
+            report["interrupted"] = True
+            for future in pending:
+                future.cancel()
+            logger.warning("Interrupted; run the same command again to resume")
+
+    elapsed = time.perf_counter() - started_at
+    report["seconds"] = round(elapsed, 2)
+    report["pages_per_second"] = round(report["pages"] / elapsed, 2) if elapsed > 0 else None
+    report["chunks_per_second"] = round(report["chunks"] / elapsed, 2) if elapsed > 0 else None
+    return report
+
+
+def _write(rag_manager, parsed: dict, batch_size: int, force: bool, report: dict):
+    source = parsed["source"]
+    if "error" in parsed:
+        report["files_failed"] += 1
+        report["failures"].append({"source": source, "error": parsed["error"]})
+        logger.error(f"Failed to parse {source}: {parsed['error']}")
+        return
+
+    # Re-check here: two identical files of this run both pass the workers' check
+    if not force and "skipped" not in parsed:
+        indexed = rag_manager.catalog.find_by_content_hash(parsed["content_hash"])
+        if indexed:
+            parsed["skipped"] = indexed[0]["source"]
+    if "skipped" in parsed:
+        report["files_skipped"] += 1
+        logger.info(f"Skipped {source}: already indexed as {parsed['skipped']}")
+        return
+
+    try:
+        counts = index_parsed(rag_manager, parsed, batch_size)
+    except Exception as e:
+        report["files_failed"] += 1
+        report["failures"].append({"source": source, "error": str(e)})
+        logger.error(f"Failed to index {source}: {str(e)}")
+        return
+
+    report["files_indexed"] += 1
+    report["bytes"] += parsed["bytes"]
+    report["pages"] += parsed["pages"]
+    report["chunks"] += len(parsed["chunks"])
+    report["chunks_stored"] += counts["stored"]
+    report["chunks_reused"] += counts["reused"]
+    report["chunks_cached"] += counts["cached"]
+    report["chunks_deleted"] += counts["deleted"]
+    logger.info(f"Indexed {source}: {parsed['pages']} pages, {counts['stored']} new chunks "
+                f"({counts['cached']} from cache), {counts['reused']} reused, {counts['deleted']} deleted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load PDF and TXT files into the RAG knowledge base")
+    parser.add_argument("paths", nargs="+", help="Directories, zip archives or files to ingest")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Parser processes")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded and stored per write")
+    parser.add_argument("--collection", help="Collection to load into (created if missing; default collection if omitted)")
+    parser.add_argument("--force", action="store_true", help="Re-index files whose content is already indexed")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.paths, max(1, args.workers), max(1, args.batch_size), args.force, args.collection)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Files:  {report['files_indexed']} indexed, {report['files_skipped']} skipped, {report['files_failed']} failed")
+        print(f"Pages:  {report['pages']} ({report['pages_per_second']} pages/s)")
+        print(f"Chunks: {report['chunks']} ({report['chunks_per_second']} chunks/s), {report['chunks_stored']} stored, "
+              f"{report['chunks_cached']} from cache, {report['chunks_reused']} reused, {report['chunks_deleted']} deleted")
+        print(f"Time:   {report['seconds']} s")
+        for failure in report["failures"]:
+            print(f"  failed: {failure['source']}: {failure['error']}")
+    return 1 if report["files_failed"] or report["interrupted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from prompt_registry import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Sentence ends (Latin and CJK punctuation) and paragraph breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?。！？])\s+|\n{2,}")
+
+RAG_PROMPT_TEMPLATE = """Use the following context to answer the question. If the answer cannot be found in the context, say "I don't have enough information to answer this question."
+
+Context:
+{context}
+
+Question: {query}
+
+Answer:"""
+
+
+def _load_encoding():
+    """tiktoken's cl100k encoding if it is installed and its vocabulary is available, else None"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.info(f"tiktoken unavailable ({str(e)}); estimating token counts from text length")
+        return None
+
+
+class TokenCounter:
+    def __init__(self, max_cached: int = 50000):
+        """
+        Token counts with a per-text LRU cache
+
+        Retrieved chunks repeat across queries, so each chunk is tokenized
+        once. Uses tiktoken's cl100k vocabulary as an approximation of the
+        local models' tokenizers, or a length-based estimate without it.
+
+        Args:
+            max_cached: Texts whose counts are kept
+        """
+        self.max_cached = max_cached
+        self._encoding = None
+        self._encoding_loaded = False
+        self._encoding_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def method(self) -> str:
+        return "tiktoken" if self._encoding is not None else "estimate"
+
+    def _count_uncached(self, text: str) -> int:
+        if not self._encoding_loaded:
+            with self._encoding_lock:
+                if not self._encoding_loaded:
+                    self._encoding = _load_encoding()
+                    self._encoding_loaded = True
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+    def count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+
+        tokens = self._count_uncached(text)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = tokens
+            if len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "method": self.method,
+                "cached": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+class ContextPacker:
+    def __init__(self,
+                 token_counter: Optional[TokenCounter] = None,
+                 response_reserve: int = 1024,
+                 min_passage_tokens: int = 48,
+                 separator: str = "\n\n"):
+        """
+        Assemble retrieved passages into a prompt that fits the model's context window
+
+        Passages are added in relevance order while they fit. The first one
+        that does not fit is cut at a sentence boundary to use the remaining
+        budget, so the prompt size (and therefore prefill time) is bounded
+        by the window while as much evidence as possible gets in.
+
+        Args:
+            token_counter: Cached token counter (a new one if omitted)
+            response_reserve: Tokens kept free for the model's answer
+            min_passage_tokens: Smallest truncated passage worth including
+            separator: Text between passages
+        """
+        self.token_counter = token_counter or TokenCounter()
+        self.response_reserve = response_reserve
+        self.min_passage_tokens = min_passage_tokens
+        self.separator = separator
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Longest prefix of text that ends at a sentence boundary and fits max_tokens
+
+        Falls back to a word boundary when even the first sentence is too long.
+        """
+        sentences = [s for s in SENTENCE_BOUNDARY.split(text) if s.strip()]
+        kept = []
+        used = 0
+        for sentence in sentences:
+            tokens = self.token_counter.count(sentence) + (1 if kept else 0)
+            if used + tokens > max_tokens:
+                break
+            kept.append(sentence)
+            used += tokens
+        if kept:
+            return " ".join(kept)
+
+        # No sentence end in reach (tables, code, lists): binary search the longest word prefix that fits
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.token_counter._count_uncached(" ".join(words[:middle])) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+    def pack(self, query: str, passages: List[dict], context_window: int,
+             template: str = RAG_PROMPT_TEMPLATE) -> Tuple[str, List[dict], dict]:
+        """
+        Build the prompt from as many passages as fit
+
+        Args:
+            query: User question
+            passages: Retrieved passages (with "content"), most relevant first
+            context_window: Model context size in tokens
+            template: Prompt template with {context} and {query} placeholders
+
+        Returns:
+            (prompt, included passages with "tokens" and "truncated", usage report)
+        """
+        overhead = self.token_counter.count(template.format(context="", query=query))
+        separator_tokens = self.token_counter.count(self.separator)
+        available = max(0, context_window - self.response_reserve - overhead)
+
+        included = []
+        parts = []
+        used = 0
+        truncated = 0
+        for passage in passages:
+            cost = separator_tokens if parts else 0
+            remaining = available - used - cost
+            tokens = self.token_counter.count(passage["content"])
+
+            if tokens <= remaining:
+                parts.append(passage["content"])
+                included.append({**passage, "tokens": tokens, "truncated": False})
+                used += cost + tokens
+                continue
+
+            # The first passage that does not fit gets what is left, cut at a sentence end
+            if remaining >= self.min_passage_tokens:
+                text = self.truncate(passage["content"], remaining)
+                text_tokens = self.token_counter.count(text) if text else 0
+                if text and text_tokens <= remaining:
+                    parts.append(text)
+                    included.append({**passage, "content": text, "tokens": text_tokens, "truncated": True})
+                    used += cost + text_tokens
+                    truncated += 1
+            break
+
+        prompt = template.format(context=self.separator.join(parts), query=query)
+        report = {
+            "context_window": context_window,
+            "reserved_for_answer": self.response_reserve,
+            "prompt_overhead_tokens": overhead,
+            "tokens_available": available,
+            "tokens_used": used,
+            "passages_included": len(included),
+            "passages_truncated": truncated,
+            "passages_dropped": len(passages) - len(included),
+            "token_counter": self.token_counter.method
+        }
+        return prompt, included, report
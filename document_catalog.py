@@ -0,0 +1,208 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlite_tuning import connect_wal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = "./document_catalog.sqlite3"
+
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """sha256 of a file as recorded in the catalog, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCatalog:
+    def __init__(self, path: str = DEFAULT_CATALOG_PATH):
+        """
+        Catalog of the documents in the vector store
+
+        Keeps one row per source document (chunk count, bytes, ingest time,
+        file hash) plus the ids of its chunks, updated on every ingest and
+        delete. Listing documents and finding a document's chunks then read
+        this small index instead of scanning every chunk in the collection.
+
+        Args:
+            path: SQLite database file (WAL mode, shared by all workers)
+        """
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT PRIMARY KEY,
+                chunk_count INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                content_hash TEXT,
+                file_type TEXT,
+                ingested_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                bytes INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source);
+            CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_wal(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements):
+        """Run statements(conn) in one write transaction"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row_to_document(row) -> dict:
+        return {
+            "source": row[0],
+            "chunk_count": row[1],
+            "bytes": row[2],
+            "content_hash": row[3],
+            "file_type": row[4],
+            "ingested_at": row[5],
+            "updated_at": row[6]
+        }
+
+    def record_document(self, source: str, chunk_bytes: Dict[str, int],
+                        content_hash: Optional[str] = None, file_type: Optional[str] = None):
+        """
+        Replace the catalog entry of a document after it was (re-)indexed
+
+        Args:
+            source: Source document name
+            chunk_bytes: Chunk id -> UTF-8 size of the chunk text, for every chunk now stored
+            content_hash: sha256 of the uploaded file
+            file_type: 'pdf' or 'txt'
+        """
+        now = time.time()
+
+        def statements(conn):
+            row = conn.execute("SELECT ingested_at FROM documents WHERE source = ?", (source,)).fetchone()
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, source, bytes) VALUES (?, ?, ?)",
+                [(chunk_id, source, size) for chunk_id, size in chunk_bytes.items()]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (source, chunk_count, bytes, content_hash, file_type, ingested_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source, len(chunk_bytes), sum(chunk_bytes.values()), content_hash, file_type,
+                 row[0] if row else now, now)
+            )
+
+        self._write(statements)
+
+    def remove_document(self, source: str) -> Optional[dict]:
+        """Remove a document from the catalog, returning its former entry"""
+        def statements(conn):
+            document = self._get(conn, source)
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+            return document
+
+        return self._write(statements)
+
+    def _get(self, conn, source: str) -> Optional[dict]:
+        row = conn.execute(
+            "SELECT source, chunk_count, bytes, content_hash, file_type, ingested_at, updated_at FROM documents WHERE source = ?",
+            (source,)
+        ).fetchone()
+        return self._row_to_document(row) if row else None
+
+    def get_document(self, source: str) -> Optional[dict]:
+        return self._get(self._connect(), source)
+
+    def get_chunk_ids(self, source: str) -> List[str]:
+        return [row[0] for row in self._connect().execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))]
+
+    def find_by_content_hash(self, content_hash: str) -> List[dict]:
+        """Documents whose uploaded file had this sha256"""
+        rows = self._connect().execute(
+            "SELECT source, chunk_count, bytes, content_hash, file_type, ingested_at, updated_at FROM documents WHERE content_hash = ?",
+            (content_hash,)
+        ).fetchall()
+        return [self._row_to_document(row) for row in rows]
+
+    def list_documents(self) -> List[dict]:
+        rows = self._connect().execute(
+            "SELECT source, chunk_count, bytes, content_hash, file_type, ingested_at, updated_at FROM documents ORDER BY source"
+        ).fetchall()
+        return [self._row_to_document(row) for row in rows]
+
+    def get_meta(self) -> Dict[str, str]:
+        """Collection settings kept with the catalog (active vector store, embedding model, ...)"""
+        return dict(self._connect().execute("SELECT key, value FROM meta").fetchall())
+
+    def set_meta(self, values: Dict[str, Optional[str]]):
+        """Set (or with None, remove) several meta entries in one transaction"""
+        def statements(conn):
+            for key, value in values.items():
+                if value is None:
+                    conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+        self._write(statements)
+
+    def is_built(self) -> bool:
+        """Whether the catalog reflects the collection (built or backfilled at least once)"""
+        return self._connect().execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is not None
+
+    def rebuild(self, chunks: Iterable[Tuple[str, str, int]]):
+        """
+        Rebuild the catalog from a full listing of the collection
+
+        Args:
+            chunks: (chunk_id, source, bytes) for every stored chunk
+        """
+        now = time.time()
+
+        def statements(conn):
+            conn.execute("DELETE FROM chunks")
+            conn.execute("DELETE FROM documents")
+            conn.executemany("INSERT OR REPLACE INTO chunks (chunk_id, source, bytes) VALUES (?, ?, ?)", chunks)
+            conn.execute(
+                "INSERT INTO documents (source, chunk_count, bytes, content_hash, file_type, ingested_at, updated_at) "
+                "SELECT source, COUNT(*), SUM(bytes), NULL, NULL, ?, ? FROM chunks GROUP BY source",
+                (now, now)
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(now),))
+
+        self._write(statements)
+        logger.info(f"Rebuilt document catalog: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        conn = self._connect()
+        documents, chunks, total_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0), COALESCE(SUM(bytes), 0) FROM documents"
+        ).fetchone()
+        return {"documents": documents, "chunks": chunks, "bytes": total_bytes}
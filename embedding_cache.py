@@ -0,0 +1,207 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+from sqlite_tuning import connect_wal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "./embedding_cache.sqlite3"
+
+# Eviction frees space down to this share of max_bytes so it does not run on every insert
+EVICTION_LOW_WATER = 0.9
+
+
+def text_digest(text: str) -> str:
+    """Content address of a chunk text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Persistent embedding cache keyed by (embedding model, sha256 of the text)
+
+        Identical chunk text embeds to the same vector no matter which file or
+        upload it came from, so re-ingesting an edited document, or the same
+        document under another name, only embeds chunks never seen before.
+        Vectors are stored as float32 blobs in SQLite (WAL, shared by all
+        workers). When the stored vectors exceed max_bytes, the least
+        recently used entries are evicted.
+
+        Args:
+            path: SQLite database file
+            max_bytes: Upper bound for the stored vector bytes
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, digest)
+            );
+            CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('total_bytes', 0);
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_wal(self.path)
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for texts (None where missing), in input order"""
+        if not texts:
+            return []
+
+        digests = [text_digest(text) for text in texts]
+        unique = list(dict.fromkeys(digests))
+        conn = self._connect()
+
+        found: Dict[str, List[float]] = {}
+        # Stay well below SQLite's bound parameter limit
+        for i in range(0, len(unique), 500):
+            part = unique[i:i + 500]
+            rows = conn.execute(
+                f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({','.join('?' * len(part))})",
+                [model, *part]
+            ).fetchall()
+            for digest, blob in rows:
+                found[digest] = array("f", blob).tolist()
+
+        if found:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                    [(now, model, digest) for digest in found]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        results = [found.get(digest) for digest in digests]
+        hits = sum(1 for vector in results if vector is not None)
+        with self._stats_lock:
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Store vectors for texts, evicting least recently used entries when over budget"""
+        if not texts:
+            return
+
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            rows[text_digest(text)] = array("f", vector).tobytes()
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            added_bytes = 0
+            written = 0
+            for digest, blob in rows.items():
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (model, digest, vector, last_used) VALUES (?, ?, ?, ?)",
+                    (model, digest, blob, now)
+                )
+                if cursor.rowcount:
+                    added_bytes += len(blob)
+                    written += 1
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (added_bytes,))
+            total_bytes = conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+            evicted = 0
+            if total_bytes > self.max_bytes:
+                evicted, freed = self._evict(conn, total_bytes - int(self.max_bytes * EVICTION_LOW_WATER))
+                conn.execute("UPDATE meta SET value = value - ? WHERE key = 'total_bytes'", (freed,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._stats_lock:
+            self.stats["writes"] += written
+            self.stats["evictions"] += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} cached embeddings to stay under {self.max_bytes} bytes")
+
+    def _evict(self, conn: sqlite3.Connection, bytes_to_free: int):
+        """Delete least recently used entries until bytes_to_free are released; caller holds the transaction"""
+        evicted = 0
+        freed = 0
+        while freed < bytes_to_free:
+            rows = conn.execute(
+                "SELECT rowid, length(vector) FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            batch = []
+            for rowid, size in rows:
+                batch.append(rowid)
+                freed += size
+                if freed >= bytes_to_free:
+                    break
+            conn.execute(f"DELETE FROM embeddings WHERE rowid IN ({','.join('?' * len(batch))})", batch)
+            evicted += len(batch)
+        return evicted, freed
+
+    def clear(self, model: Optional[str] = None):
+        """Drop all cached vectors, or only those of one model"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if model:
+                conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            else:
+                conn.execute("DELETE FROM embeddings")
+            total_bytes = conn.execute("SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'total_bytes'", (total_bytes,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_stats(self) -> dict:
+        """Hit rate of this worker plus the size of the shared cache"""
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total_bytes = conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+            "writes": stats["writes"],
+            "evictions": stats["evictions"]
+        }
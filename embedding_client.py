@@ -0,0 +1,162 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limiting and server-side failures (model loading, OOM, restarts)
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when a batch could not be embedded after all retries"""
+
+
+class _RetryableStatus(Exception):
+    """Transient HTTP status from the embedding server"""
+
+
+class OllamaEmbeddingClient:
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 model: str = "nomic-embed-text",
+                 batch_size: int = 64,
+                 max_concurrency: int = 4,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5,
+                 timeout: float = 120.0):
+        """
+        Batched embedding client for Ollama's /api/embed endpoint
+
+        Texts are sent batch_size at a time as one multi-input request instead
+        of one HTTP call per text. At most max_concurrency batches are in
+        flight across all callers (ingestion jobs and queries share one
+        client), so a large upload cannot flood the Ollama server.
+
+        Args:
+            base_url: Base URL for Ollama API
+            model: Embedding model
+            batch_size: Texts per request
+            max_concurrency: Batches in flight at once, process-wide for this client
+            max_retries: Retries per batch on connection errors and retryable status codes
+            retry_backoff: Initial retry delay in seconds, doubled on every retry
+            timeout: Per-request timeout in seconds
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._http = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=max_concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._legacy_api = False
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "texts": 0,
+            "retries": 0,
+            "failures": 0,
+            "request_ms_total": 0.0
+        }
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, preserving order
+
+        Raises:
+            EmbeddingError: If any batch still fails after retries
+        """
+        if not texts:
+            return []
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+
+        embeddings = []
+        for batch_embeddings in self._executor.map(self._embed_batch, batches):
+            embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query text"""
+        return self.embed([text])[0]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            started_at = time.perf_counter()
+            try:
+                with self._slots:
+                    embeddings = self._request(texts)
+                self._record(len(texts), started_at)
+                return embeddings
+            except (httpx.TransportError, _RetryableStatus) as e:
+                if attempt == self.max_retries:
+                    with self._stats_lock:
+                        self.stats["failures"] += 1
+                    raise EmbeddingError(f"Embedding batch of {len(texts)} texts failed after {attempt + 1} attempts: {str(e)}") from e
+                with self._stats_lock:
+                    self.stats["retries"] += 1
+                logger.warning(f"Embedding batch failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay *= 2
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        if not self._legacy_api:
+            response = self._http.post(f"{self.base_url}/api/embed", json={"model": self.model, "input": texts})
+            if response.status_code == 404 and "model" not in response.text.lower():
+                # Ollama before 0.3 has no /api/embed; fall back to one request per text
+                logger.warning("Ollama has no /api/embed endpoint, falling back to unbatched /api/embeddings")
+                self._legacy_api = True
+            else:
+                self._check(response)
+                embeddings = response.json().get("embeddings") or []
+                if len(embeddings) != len(texts):
+                    raise EmbeddingError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+                return embeddings
+
+        embeddings = []
+        for text in texts:
+            response = self._http.post(f"{self.base_url}/api/embeddings", json={"model": self.model, "prompt": text})
+            self._check(response)
+            embeddings.append(response.json()["embedding"])
+        return embeddings
+
+    def _check(self, response: httpx.Response):
+        if response.status_code in RETRYABLE_STATUS:
+            raise _RetryableStatus(f"HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code != 200:
+            raise EmbeddingError(f"Ollama embedding error HTTP {response.status_code}: {response.text[:200]}")
+
+    def _record(self, text_count: int, started_at: float):
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += text_count
+            self.stats["request_ms_total"] += (time.perf_counter() - started_at) * 1000
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            "model": self.model,
+            "batch_size": self.batch_size,
+            "max_concurrency": self.max_concurrency,
+            "legacy_api": self._legacy_api,
+            "requests": stats["requests"],
+            "texts": stats["texts"],
+            "retries": stats["retries"],
+            "failures": stats["failures"],
+            "avg_request_ms": round(stats["request_ms_total"] / stats["requests"], 1) if stats["requests"] else None
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._http.close()
@@ -0,0 +1,336 @@
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+from shared_state import get_shared_state, worker_id
+
+logger = logging.getLogger(__name__)
+
+# Migration states
+RUNNING = "running"
+SWAPPING = "swapping"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+TERMINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# The migrating worker renews its lease every batch; another worker may take over once it lapses
+LEASE_TTL = 300.0
+
+# A sync pass that changes at most this many chunks is followed by the final pass and the swap
+FINAL_PASS_THRESHOLD = 256
+
+# Seconds the replaced store is kept after the swap, for searches that were already running on it
+RETIRE_GRACE_SECONDS = 60.0
+
+
+class MigrationConflict(RuntimeError):
+    """Raised when a migration of the collection is already running"""
+
+
+class MigrationCancelled(Exception):
+    """Raised inside the migration thread when a cancel was requested"""
+
+
+def shadow_store_name(collection_name: str, embedding_model: str) -> str:
+    """Name of the store a migration fills: "<collection>.<model>-<hex time>" (valid for Chroma and as a directory)"""
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", embedding_model).strip("-_")[:32] or "model"
+    return f"{collection_name}.{slug}-{int(time.time()):x}"
+
+
+def _metadata_digest(metadata: Optional[dict]) -> bytes:
+    return hashlib.blake2b(json.dumps(metadata or {}, sort_keys=True, default=str).encode("utf-8"), digest_size=8).digest()
+
+
+def _status_key(collection_name: str) -> str:
+    return f"rag_migration:{collection_name}"
+
+
+def _cancel_key(collection_name: str) -> str:
+    return f"rag_migration_cancel:{collection_name}"
+
+
+class EmbeddingMigration:
+    def __init__(self, rag_manager, embedding_model: str, max_chunks_per_second: Optional[float] = 50.0,
+                 batch_size: int = 32, retire_grace_seconds: float = RETIRE_GRACE_SECONDS):
+        """
+        Re-embed a collection with another embedding model without taking it offline
+
+        Chunks are copied from the active vector store into a shadow store
+        and embedded with the new model, at most max_chunks_per_second so
+        live queries and uploads keep most of Ollama. Searches keep using the
+        active store and model meanwhile. Writes made during the copy are
+        picked up by further sync passes (new chunks copied, moved chunks'
+        metadata updated, deleted chunks removed); once a pass changes
+        little, a final pass under the collection's writer lock brings the
+        shadow store level and the catalog switches the collection to it and
+        the new model in one transaction. Every worker follows the switch on
+        its next search or write.
+
+        The lexical index and the document catalog are text-based and are
+        not touched. An interrupted migration resumes with the chunks the
+        shadow store already holds.
+
+        Args:
+            rag_manager: RAGManager of the collection
+            embedding_model: Ollama embedding model to migrate to
+            max_chunks_per_second: Embedding rate limit (None or 0 for no limit)
+            batch_size: Chunks embedded and stored per step
+            retire_grace_seconds: Delay before the replaced store is deleted
+        """
+        self.rag_manager = rag_manager
+        self.collection_name = rag_manager.collection_name
+        self.from_model = rag_manager.embedding_model
+        self.embedding_model = embedding_model
+        self.max_chunks_per_second = max_chunks_per_second
+        self.batch_size = batch_size
+        self.retire_grace_seconds = retire_grace_seconds
+        self.lease_name = f"rag_migration.{self.collection_name}"
+
+        self.shadow_name = None
+        self.status = RUNNING
+        self.error = None
+        self.sync_passes = 0
+        self.chunks_total = 0
+        self.chunks_copied = 0
+        self.chunks_embedded = 0
+        self.chunks_cached = 0
+        self.chunks_updated = 0
+        self.chunks_removed = 0
+        self.started_at = time.time()
+        self.swapped_at = None
+        self.finished_at = None
+        self._thread = None
+
+    def to_dict(self) -> dict:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        rate = self.chunks_embedded / elapsed if elapsed > 0 else None
+        remaining = max(0, self.chunks_total - self.chunks_copied)
+        return {
+            "collection": self.collection_name,
+            "from_model": self.from_model,
+            "to_model": self.embedding_model,
+            "shadow_store": self.shadow_name,
+            "status": self.status,
+            "error": self.error,
+            "worker": worker_id(),
+            "sync_passes": self.sync_passes,
+            "chunks_total": self.chunks_total,
+            "chunks_copied": self.chunks_copied,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_cached": self.chunks_cached,
+            "chunks_updated": self.chunks_updated,
+            "chunks_removed": self.chunks_removed,
+            "progress": round(min(1.0, self.chunks_copied / self.chunks_total), 4) if self.chunks_total else None,
+            "chunks_per_second": round(rate, 2) if rate is not None else None,
+            "eta_seconds": round(remaining / rate, 1) if rate and self.status == RUNNING else None,
+            "max_chunks_per_second": self.max_chunks_per_second,
+            "started_at": self.started_at,
+            "swapped_at": self.swapped_at,
+            "finished_at": self.finished_at
+        }
+
+    def _publish(self):
+        """Write progress to shared state, where every worker's status endpoint reads it"""
+        get_shared_state().cache_set(_status_key(self.collection_name), self.to_dict())
+
+    def start(self):
+        """Run the migration in a background thread"""
+        self._thread = threading.Thread(target=self.run, name=f"rag-migration-{self.collection_name}", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        state = get_shared_state()
+        catalog = self.rag_manager.catalog
+        try:
+            meta = catalog.get_meta()
+            # A store replaced by an earlier migration whose grace period was cut short by a restart
+            if meta.get("retired_store"):
+                self.rag_manager._drop_vector_store(meta["retired_store"])
+                catalog.set_meta({"retired_store": None})
+
+            # Resume into the shadow store of an interrupted migration to the same model
+            if meta.get("migration_store") and meta.get("migration_model") == self.embedding_model:
+                self.shadow_name = meta["migration_store"]
+            else:
+                if meta.get("migration_store"):
+                    self.rag_manager._drop_vector_store(meta["migration_store"])
+                self.shadow_name = shadow_store_name(self.collection_name, self.embedding_model)
+                catalog.set_meta({"migration_store": self.shadow_name, "migration_model": self.embedding_model})
+            shadow = self.rag_manager._open_vector_store(self.shadow_name, create=True, hnsw=self.rag_manager.hnsw_settings())
+            logger.info(f"Migrating collection {self.collection_name} to {self.embedding_model} in {self.shadow_name}")
+            self._publish()
+
+            # Copy, then catch up with writes made in the meantime until a pass changes little
+            while self._sync_pass(shadow, throttled=True) > FINAL_PASS_THRESHOLD:
+                pass
+
+            self.status = SWAPPING
+            self._publish()
+            with state.writer_lock(self.rag_manager._writer_lock_name):
+                self._sync_pass(shadow, throttled=False)
+                retired = self.rag_manager.store_name
+                catalog.set_meta({
+                    "vector_store_name": self.shadow_name,
+                    "embedding_model": self.embedding_model,
+                    "migration_store": None,
+                    "migration_model": None,
+                    "retired_store": retired
+                })
+                self.rag_manager._sync_active_store()
+                self.rag_manager._bump_collection_version()
+            self.swapped_at = time.time()
+            self.status = COMPLETED
+            self._publish()
+            logger.info(f"Collection {self.collection_name} switched to {self.embedding_model}: {self.to_dict()}")
+
+            # Searches that started before the swap may still read the old store for a moment
+            time.sleep(self.retire_grace_seconds)
+            self.rag_manager._drop_vector_store(retired)
+            catalog.set_meta({"retired_store": None})
+
+        except MigrationCancelled:
+            self.rag_manager._drop_vector_store(self.shadow_name)
+            catalog.set_meta({"migration_store": None, "migration_model": None})
+            self.status = CANCELLED
+            logger.info(f"Migration of collection {self.collection_name} to {self.embedding_model} cancelled")
+        except Exception as e:
+            # The shadow store is kept, so starting the same migration again resumes it
+            self.status = FAILED
+            self.error = str(e)
+            logger.error(f"Migration of collection {self.collection_name} to {self.embedding_model} failed: {str(e)}")
+        finally:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+            self._publish()
+            state.cache_delete(_cancel_key(self.collection_name))
+            state.release_lease(self.lease_name)
+
+    def _sync_pass(self, shadow, throttled: bool) -> int:
+        """
+        Bring the shadow store level with the active store
+
+        Returns:
+            Number of chunks copied, updated or removed
+        """
+        self.sync_passes += 1
+        self._check_in()
+        self.rag_manager._sync_active_store()
+        source = self.rag_manager.vector_store
+        self.chunks_total = source.count()
+
+        stored = {chunk_id: _metadata_digest(metadata) for chunk_id, metadata, _ in self.rag_manager._scan_chunks(vector_store=shadow)}
+        self.chunks_copied = len(stored)
+        changed = 0
+        batch = []
+        updates = []
+        for chunk_id, metadata, text in self.rag_manager._scan_chunks(vector_store=source):
+            digest = stored.pop(chunk_id, None)
+            if digest is None:
+                batch.append((chunk_id, text or "", metadata))
+                if len(batch) >= self.batch_size:
+                    changed += self._copy(shadow, batch, throttled)
+                    batch = []
+            elif digest != _metadata_digest(metadata):
+                # Same text, moved within its document by a re-upload
+                updates.append((chunk_id, metadata))
+                if len(updates) >= 500:
+                    changed += self._update(shadow, updates)
+                    updates = []
+        if batch:
+            changed += self._copy(shadow, batch, throttled)
+        if updates:
+            changed += self._update(shadow, updates)
+        if stored:
+            # Deleted from the collection since they were copied
+            shadow.delete(list(stored))
+            self.chunks_removed += len(stored)
+            self.chunks_copied -= len(stored)
+            changed += len(stored)
+        self._publish()
+        return changed
+
+    def _copy(self, shadow, batch: List[Tuple[str, str, dict]], throttled: bool) -> int:
+        self._check_in()
+        started_at = time.perf_counter()
+        texts = [text for _, text, _ in batch]
+        vectors, cache_hits = self.rag_manager.embed_chunks(texts, self.embedding_model)
+        shadow.upsert([chunk_id for chunk_id, _, _ in batch], vectors, texts, [metadata for _, _, metadata in batch])
+        self.chunks_copied += len(batch)
+        self.chunks_embedded += len(batch) - cache_hits
+        self.chunks_cached += cache_hits
+        self._publish()
+
+        if throttled and self.max_chunks_per_second:
+            # Pace batches so the migration stays under its share of the embedding server
+            time.sleep(max(0.0, len(batch) / self.max_chunks_per_second - (time.perf_counter() - started_at)))
+        return len(batch)
+
+    def _update(self, shadow, updates: List[Tuple[str, dict]]) -> int:
+        shadow.update_metadata([chunk_id for chunk_id, _ in updates], [metadata for _, metadata in updates])
+        self.chunks_updated += len(updates)
+        return len(updates)
+
+    def _check_in(self):
+        """Renew the lease and stop if a cancel was requested from any worker"""
+        state = get_shared_state()
+        if state.cache_get(_cancel_key(self.collection_name)):
+            raise MigrationCancelled()
+        if not state.acquire_lease(self.lease_name, LEASE_TTL):
+            raise RuntimeError("Lost the migration lease to another worker")
+
+
+# Migrations started by this process, by collection (leases only tell workers apart)
+migrations = {}
+migrations_lock = threading.Lock()
+
+
+def start_migration(rag_manager, embedding_model: str, max_chunks_per_second: Optional[float] = 50.0,
+                    batch_size: int = 32) -> EmbeddingMigration:
+    """
+    Start migrating a collection to another embedding model in the background
+
+    Raises:
+        ValueError: The collection already uses the model
+        MigrationConflict: A migration of the collection is running in some worker
+    """
+    if embedding_model == rag_manager.embedding_model:
+        raise ValueError(f"Collection {rag_manager.collection_name} already uses {embedding_model}")
+    migration = EmbeddingMigration(rag_manager, embedding_model, max_chunks_per_second, batch_size)
+    state = get_shared_state()
+    with migrations_lock:
+        running = migrations.get(rag_manager.collection_name)
+        if (running is not None and running._thread.is_alive()) or not state.acquire_lease(migration.lease_name, LEASE_TTL):
+            raise MigrationConflict(f"A migration of collection {rag_manager.collection_name} is already running")
+        state.cache_delete(_cancel_key(rag_manager.collection_name))
+        migration._publish()
+        migration.start()
+        migrations[rag_manager.collection_name] = migration
+    return migration
+
+
+def get_migration_status(collection_name: str) -> Optional[dict]:
+    """Progress of the collection's current or last migration, as published by the worker running it"""
+    state = get_shared_state()
+    status = state.cache_get(_status_key(collection_name))
+    if status is None or status["status"] in TERMINAL_STATES:
+        return status
+    # The worker that ran it died without finishing; starting the same migration again resumes it
+    leases = {lease["name"] for lease in state.get_status()["leases"]}
+    if f"rag_migration.{collection_name}" not in leases:
+        status["status"] = INTERRUPTED
+    return status
+
+
+def cancel_migration(collection_name: str) -> bool:
+    """Ask the running migration of a collection to stop and drop its shadow store"""
+    status = get_migration_status(collection_name)
+    if status is None or status["status"] not in (RUNNING,):
+        return False
+    get_shared_state().cache_set(_cancel_key(collection_name), True)
+    return True
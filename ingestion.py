@@ -0,0 +1,426 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import AsyncIterator, List, Optional, Tuple
+
+from shared_state import get_shared_state, worker_id
+from document_catalog import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL_STATES = (COMPLETED, FAILED)
+
+# Marks the end of a stage's output
+_END = object()
+
+# Upload bytes read and written per step while spooling to disk
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+async def spool_upload(upload, suffix: str = "", max_bytes: Optional[int] = None,
+                       spool_dir: Optional[str] = None) -> Tuple[str, int, str]:
+    """
+    Copy an upload to a temporary file block by block, hashing it on the way
+
+    Memory stays at one block no matter how large the upload is. The caller
+    owns the returned file.
+
+    Args:
+        upload: Object with an async read(size) method (e.g. FastAPI's UploadFile)
+        suffix: Suffix of the temporary file
+        max_bytes: Reject uploads larger than this (no limit if None)
+        spool_dir: Directory for the temporary file (system default if None)
+
+    Returns:
+        (file path, size in bytes, sha256 hex digest)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=spool_dir)
+    try:
+        with tmp_file:
+            while True:
+                block = await upload.read(SPOOL_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes")
+
+                def write(block=block):
+                    digest.update(block)
+                    tmp_file.write(block)
+
+                await asyncio.to_thread(write)
+    except BaseException:
+        os.unlink(tmp_file.name)
+        raise
+    return tmp_file.name, size, digest.hexdigest()
+
+
+class IngestionJob:
+    def __init__(self, filename: str, file_type: str, size_bytes: int, collection: Optional[str] = None):
+        """Progress of one document moving through the ingestion pipeline"""
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.collection = collection
+        self.file_type = file_type
+        self.size_bytes = size_bytes
+        self.content_hash = None
+        self.status = QUEUED
+        self.stage = None
+        self.error = None
+
+        self.pages_parsed = 0
+        self.chunks_split = 0
+        self.chunks_embedded = 0
+        self.chunks_cached = 0
+        self.chunks_stored = 0
+        self.chunks_reused = 0
+        self.chunks_deleted = 0
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self.changed = asyncio.Event()
+
+    def touch(self):
+        """Signal subscribers that the job's progress changed"""
+        self.version += 1
+        self.changed.set()
+
+    def chunks_per_second(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return round(self.chunks_embedded / elapsed, 2) if elapsed > 0 else None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "collection": self.collection,
+            "file_type": self.file_type,
+            "size_bytes": self.size_bytes,
+            "content_hash": self.content_hash,
+            "status": self.status,
+            "stage": self.stage,
+            "error": self.error,
+            "pages_parsed": self.pages_parsed,
+            "chunks_split": self.chunks_split,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_cached": self.chunks_cached,
+            "chunks_stored": self.chunks_stored,
+            "chunks_reused": self.chunks_reused,
+            "chunks_deleted": self.chunks_deleted,
+            "chunks_per_second": self.chunks_per_second(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "worker": worker_id(),
+            "version": self.version
+        }
+
+
+class IngestionManager:
+    def __init__(self,
+                 rag_manager_loader,
+                 max_concurrent_jobs: int = 2,
+                 embed_batch_size: int = 64,
+                 embed_concurrency: int = 2,
+                 queue_size: int = 4,
+                 publish_interval: float = 0.5,
+                 max_finished_jobs: int = 100):
+        """
+        Run document ingestion in the background as a pipelined set of stages
+
+        parse -> split -> embed -> upsert run as separate tasks connected by
+        bounded queues, so the next page is parsed while earlier chunks are
+        embedded and stored, and a slow stage applies backpressure instead of
+        buffering the whole document. Blocking work runs in threads, keeping
+        the event loop free.
+
+        Args:
+            rag_manager_loader: Async callable returning the RAGManager of a collection name (None for the default)
+            max_concurrent_jobs: Documents ingested at the same time; later uploads wait queued
+            embed_batch_size: Chunks per embedding request and per upsert
+            embed_concurrency: Embedding batches in flight per job
+            queue_size: Capacity of each inter-stage queue
+            publish_interval: Minimum seconds between progress snapshots written to shared state
+            max_finished_jobs: Finished jobs kept for status queries
+        """
+        self.rag_manager_loader = rag_manager_loader
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.queue_size = queue_size
+        self.publish_interval = publish_interval
+        self.max_finished_jobs = max_finished_jobs
+
+        self._jobs = {}
+        self._tasks = {}
+        self._slots = asyncio.Semaphore(max_concurrent_jobs)
+        self._source_locks = {}
+        self._last_published = {}
+
+    def submit(self, file_path: str, filename: str, file_type: str,
+               size_bytes: int, content_hash: Optional[str] = None,
+               collection: Optional[str] = None) -> IngestionJob:
+        """
+        Queue a document for ingestion and return its job immediately
+
+        Args:
+            file_path: Spooled copy of the upload; the job deletes it when done
+            filename: Source name the chunks are stored under
+            file_type: 'pdf' or 'txt'
+            size_bytes: File size
+            content_hash: sha256 of the file, if already computed while spooling
+            collection: Collection to store the document in (the default one if None)
+        """
+        job = IngestionJob(filename, file_type, size_bytes, collection)
+        job.content_hash = content_hash
+        self._jobs[job.job_id] = job
+        self._publish(job, force=True)
+        self._tasks[job.job_id] = asyncio.create_task(self._run(job, file_path))
+        self._prune_finished()
+        logger.info(f"Queued ingestion job {job.job_id} for {filename} ({size_bytes} bytes)")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Current snapshot of a job, including jobs running in other workers"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return get_shared_state().cache_get(f"ingest_job:{job_id}")
+
+    def list_jobs(self) -> List[dict]:
+        """Jobs started by this worker, newest first"""
+        return sorted((job.to_dict() for job in self._jobs.values()), key=lambda j: j["created_at"], reverse=True)
+
+    async def watch(self, job_id: str, poll_interval: float = 0.5) -> AsyncIterator[dict]:
+        """
+        Yield a job snapshot every time its progress changes, ending after the final state
+
+        Jobs owned by this worker are followed through their change event; jobs
+        running in another worker are polled from shared state.
+        """
+        last_version = None
+        while True:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.changed.clear()
+                snapshot = job.to_dict()
+            else:
+                snapshot = await asyncio.to_thread(get_shared_state().cache_get, f"ingest_job:{job_id}")
+                if snapshot is None:
+                    return
+
+            if snapshot["version"] != last_version:
+                last_version = snapshot["version"]
+                yield snapshot
+            if snapshot["status"] in TERMINAL_STATES:
+                return
+
+            if job is not None:
+                try:
+                    await asyncio.wait_for(job.changed.wait(), timeout=poll_interval * 10)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(poll_interval)
+
+    async def shutdown(self):
+        """Cancel running jobs"""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _publish(self, job: IngestionJob, force: bool = False):
+        """Mirror a job's progress into shared state so any worker can report it (throttled)"""
+        job.touch()
+        now = time.monotonic()
+        if not force and now - self._last_published.get(job.job_id, 0) < self.publish_interval:
+            return
+        self._last_published[job.job_id] = now
+        try:
+            get_shared_state().cache_set(f"ingest_job:{job.job_id}", job.to_dict(), ttl=24 * 3600)
+        except Exception as e:
+            logger.warning(f"Could not publish progress of ingestion job {job.job_id}: {str(e)}")
+
+    def _prune_finished(self):
+        finished = sorted((job for job in self._jobs.values() if job.status in TERMINAL_STATES), key=lambda j: j.created_at)
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            self._jobs.pop(job.job_id, None)
+            self._tasks.pop(job.job_id, None)
+            self._last_published.pop(job.job_id, None)
+
+    async def _run(self, job: IngestionJob, file_path: str):
+        # Re-uploads of the same source are diffed against its stored chunks, so they must not overlap
+        source_key = (job.collection, job.filename)
+        source_lock = self._source_locks.setdefault(source_key, {"lock": asyncio.Lock(), "users": 0})
+        source_lock["users"] += 1
+        try:
+            async with self._slots, source_lock["lock"]:
+                await self._run_job(job, file_path)
+        finally:
+            source_lock["users"] -= 1
+            if not source_lock["users"]:
+                del self._source_locks[source_key]
+            try:
+                os.unlink(file_path)
+            except OSError:
+                pass
+
+    async def _run_job(self, job: IngestionJob, file_path: str):
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._publish(job, force=True)
+
+        try:
+            rag_manager = await self.rag_manager_loader(job.collection)
+            if job.content_hash is None:
+                job.content_hash = await asyncio.to_thread(file_sha256, file_path)
+            await self._pipeline(job, rag_manager, file_path)
+            job.status = COMPLETED
+            logger.info(f"Ingested {job.filename}: {job.pages_parsed} pages, {job.chunks_stored} new chunks, "
+                        f"{job.chunks_reused} reused, {job.chunks_deleted} deleted ({job.chunks_per_second()} chunks/s)")
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = "Cancelled"
+            raise
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            logger.error(f"Ingestion job {job.job_id} for {job.filename} failed: {str(e)}")
+        finally:
+            job.stage = None
+            job.finished_at = time.time()
+            self._publish(job, force=True)
+
+    async def _pipeline(self, job: IngestionJob, rag_manager, file_path: str):
+        pages = asyncio.Queue(maxsize=self.queue_size)
+        batches = asyncio.Queue(maxsize=self.queue_size)
+        embedded = asyncio.Queue(maxsize=self.queue_size)
+
+        def set_stage(stage):
+            job.stage = stage
+            self._publish(job)
+
+        # End markers are only sent when a stage finishes normally. After a failure the
+        # remaining stages are cancelled instead, since the bounded queues may be full
+        # with nobody left to read them.
+        async def parse():
+            set_stage("parse")
+            page_iter = await asyncio.to_thread(rag_manager.iter_pages, file_path, job.file_type)
+            while True:
+                page = await asyncio.to_thread(next, page_iter, _END)
+                if page is _END:
+                    break
+                job.pages_parsed += 1
+                self._publish(job)
+                await pages.put(page)
+            await pages.put(_END)
+
+        async def split():
+            batch = []
+            while True:
+                page = await pages.get()
+                if page is _END:
+                    break
+                for chunk in await asyncio.to_thread(rag_manager.split_page, page):
+                    # Chunks already stored under the same content hash skip embedding and upsert
+                    record = plan.add_chunk(chunk.page_content, chunk.metadata.get("page", 0))
+                    if record is None:
+                        continue
+                    batch.append(record)
+                    if len(batch) >= self.embed_batch_size:
+                        await batches.put(batch)
+                        batch = []
+                job.chunks_split = plan.position
+                job.chunks_reused = plan.reused
+                self._publish(job)
+            if batch:
+                await batches.put(batch)
+            for _ in range(self.embed_concurrency):
+                await batches.put(_END)
+
+        async def embed():
+            while True:
+                batch = await batches.get()
+                if batch is _END:
+                    break
+                set_stage("embed")
+                model = rag_manager.embedding_model
+                vectors, cache_hits = await asyncio.to_thread(rag_manager.embed_chunks, [text for _, text, _ in batch], model)
+                job.chunks_embedded += len(batch)
+                job.chunks_cached += cache_hits
+                self._publish(job)
+                await embedded.put((batch, vectors, model))
+            await embedded.put(_END)
+
+        async def upsert():
+            producers_left = self.embed_concurrency
+            while producers_left:
+                item = await embedded.get()
+                if item is _END:
+                    producers_left -= 1
+                    continue
+                batch, vectors, model = item
+                set_stage("upsert")
+                await asyncio.to_thread(
+                    rag_manager.upsert_chunks,
+                    [chunk_id for chunk_id, _, _ in batch],
+                    [text for _, text, _ in batch],
+                    [metadata for _, _, metadata in batch],
+                    vectors,
+                    model
+                )
+                job.chunks_stored += len(batch)
+                self._publish(job)
+
+        set_stage("diff")
+        plan = await asyncio.to_thread(rag_manager.plan_document, job.filename)
+
+        stages = [asyncio.create_task(parse()), asyncio.create_task(split())]
+        stages += [asyncio.create_task(embed()) for _ in range(self.embed_concurrency)]
+        stages.append(asyncio.create_task(upsert()))
+        try:
+            # Fail fast: the first stage error cancels the rest of the pipeline
+            done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in stages:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+
+        # Only drop vanished chunks once every new chunk is stored, so the document never disappears mid-update
+        set_stage("cleanup")
+        job.chunks_deleted = await asyncio.to_thread(rag_manager.finish_document, plan, job.content_hash, job.file_type)
+
+
+# Global ingestion manager instance
+ingestion_manager = None
+
+def get_ingestion_manager(rag_manager_loader=None) -> IngestionManager:
+    """Get or create the ingestion manager for this process"""
+    global ingestion_manager
+    if ingestion_manager is None:
+        ingestion_manager = IngestionManager(rag_manager_loader)
+    return ingestion_manager
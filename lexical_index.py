@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from sqlite_tuning import connect_wal
+from vector_store import where_to_sql
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICAL_INDEX_PATH = "./lexical_index.sqlite3"
+
+# Keep '-' and '_' inside tokens so identifiers like ERR_CONN_RESET or A-1134 stay searchable as a whole
+TOKEN_CHARS = "-_"
+TOKEN_PATTERN = re.compile(r"[\w\-]+", re.UNICODE)
+
+# Reciprocal-rank fusion constant; damps the advantage of the very top ranks
+RRF_K = 60
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query matching any of its terms
+
+    Every term is quoted, so characters FTS5 treats as syntax (quotes,
+    colons, parentheses, '-', AND/OR/NOT) are searched literally.
+    """
+    terms = list(dict.fromkeys(token.lower() for token in TOKEN_PATTERN.findall(text)))
+    if not terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def reciprocal_rank_fusion(ranked_lists: List[Tuple[float, List[str]]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    Merge ranked id lists with weighted reciprocal-rank fusion
+
+    Args:
+        ranked_lists: (weight, ids best-first) per retriever
+        k: RRF constant
+
+    Returns:
+        (id, fused score) best-first
+    """
+    scores = {}
+    for weight, ids in ranked_lists:
+        if weight <= 0:
+            continue
+        for rank, item_id in enumerate(ids, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    def __init__(self, path: str = DEFAULT_LEXICAL_INDEX_PATH):
+        """
+        BM25 full-text index of the stored chunks (SQLite FTS5)
+
+        Maintained next to the vector store on every upsert and delete, so
+        exact terms (identifiers, error codes, part numbers) that dense
+        embeddings tend to blur can still be found.
+
+        Args:
+            path: SQLite database file (WAL mode, shared by all workers)
+        """
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                content,
+                chunk_id UNINDEXED,
+                source UNINDEXED,
+                metadata UNINDEXED,
+                tokenize = "unicode61 tokenchars '{TOKEN_CHARS}'"
+            );
+            CREATE TABLE IF NOT EXISTS chunk_rows (
+                chunk_id TEXT PRIMARY KEY,
+                fts_rowid INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                page INTEGER,
+                ingested_at INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        # Indexes created before filter pushdown lack the page and ingested_at columns
+        conn = self._connect()
+        present = {column for _, column, *_ in conn.execute("PRAGMA table_info(chunk_rows)")}
+        for column in ("page", "ingested_at"):
+            if column not in present:
+                conn.execute(f"ALTER TABLE chunk_rows ADD COLUMN {column} INTEGER")
+                conn.execute(
+                    f"UPDATE chunk_rows SET {column} = (SELECT json_extract(metadata, '$.{column}') "
+                    f"FROM chunks_fts WHERE chunks_fts.rowid = chunk_rows.fts_rowid)"
+                )
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_chunk_rows_source ON chunk_rows (source);
+            CREATE INDEX IF NOT EXISTS idx_chunk_rows_fts_rowid ON chunk_rows (fts_rowid);
+            CREATE INDEX IF NOT EXISTS idx_chunk_rows_page ON chunk_rows (page);
+            CREATE INDEX IF NOT EXISTS idx_chunk_rows_ingested_at ON chunk_rows (ingested_at);
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_wal(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _delete_ids(conn, chunk_ids: Iterable[str]):
+        for chunk_id in chunk_ids:
+            row = conn.execute("SELECT fts_rowid FROM chunk_rows WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM chunks_fts WHERE rowid = ?", (row[0],))
+                conn.execute("DELETE FROM chunk_rows WHERE chunk_id = ?", (chunk_id,))
+
+    @staticmethod
+    def _insert(conn, chunk_id: str, text: str, metadata: dict):
+        source = metadata.get("source", "unknown")
+        cursor = conn.execute(
+            "INSERT INTO chunks_fts (content, chunk_id, source, metadata) VALUES (?, ?, ?, ?)",
+            (text, chunk_id, source, json.dumps(metadata))
+        )
+        conn.execute(
+            "INSERT INTO chunk_rows (chunk_id, fts_rowid, source, page, ingested_at) VALUES (?, ?, ?, ?, ?)",
+            (chunk_id, cursor.lastrowid, source, metadata.get("page"), metadata.get("ingested_at"))
+        )
+
+    def upsert(self, ids: List[str], texts: List[str], metadatas: List[dict]):
+        """Index (or re-index) chunks"""
+        def statements(conn):
+            self._delete_ids(conn, ids)
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                self._insert(conn, chunk_id, text, metadata)
+
+        self._write(statements)
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        """Replace the stored metadata of already indexed chunks"""
+        def statements(conn):
+            for chunk_id, metadata in zip(ids, metadatas):
+                conn.execute(
+                    "UPDATE chunks_fts SET metadata = ? WHERE rowid = (SELECT fts_rowid FROM chunk_rows WHERE chunk_id = ?)",
+                    (json.dumps(metadata), chunk_id)
+                )
+                conn.execute(
+                    "UPDATE chunk_rows SET page = ?, ingested_at = ? WHERE chunk_id = ?",
+                    (metadata.get("page"), metadata.get("ingested_at"), chunk_id)
+                )
+
+        self._write(statements)
+
+    def delete(self, ids: List[str]):
+        self._write(lambda conn: self._delete_ids(conn, ids))
+
+    def delete_source(self, source: str) -> int:
+        """Remove every chunk of a source document; returns how many were removed"""
+        def statements(conn):
+            # chunk_rows is indexed by source; the FTS table's source column is not
+            conn.execute(
+                "DELETE FROM chunks_fts WHERE rowid IN (SELECT fts_rowid FROM chunk_rows WHERE source = ?)",
+                (source,)
+            )
+            return conn.execute("DELETE FROM chunk_rows WHERE source = ?", (source,)).rowcount
+
+        return self._write(statements)
+
+    def search(self, query: str, n_results: int = 20, where: Optional[dict] = None) -> List[dict]:
+        """
+        BM25-ranked chunks matching any query term
+
+        Args:
+            query: Free-text query
+            n_results: Number of results
+            where: Chroma-style metadata filter; source, page and ingested_at use indexed columns
+
+        Returns:
+            Dicts with id, content, metadata and score (higher is better), best first
+        """
+        match = fts_query(query)
+        if match is None:
+            return []
+
+        if where:
+            columns = {"source": "chunk_rows.source", "page": "chunk_rows.page", "ingested_at": "chunk_rows.ingested_at"}
+            sql, params = where_to_sql(where, columns, "chunks_fts.metadata")
+            rows = self._connect().execute(
+                "SELECT chunks_fts.chunk_id, content, metadata, bm25(chunks_fts) FROM chunks_fts "
+                "JOIN chunk_rows ON chunk_rows.fts_rowid = chunks_fts.rowid "
+                f"WHERE chunks_fts MATCH ? AND {sql} ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, *params, n_results)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT chunk_id, content, metadata, bm25(chunks_fts) FROM chunks_fts "
+                "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, n_results)
+            ).fetchall()
+        # FTS5's bm25() is negative with lower meaning better; flip it into a conventional score
+        return [
+            {"id": chunk_id, "content": content, "metadata": json.loads(metadata), "score": -score}
+            for chunk_id, content, metadata, score in rows
+        ]
+
+    def is_built(self) -> bool:
+        """Whether the index reflects the collection (built or backfilled at least once)"""
+        return self._connect().execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is not None
+
+    def rebuild(self, chunks: Iterable[Tuple[str, dict, str]]):
+        """
+        Rebuild the index from a full listing of the collection
+
+        Args:
+            chunks: (chunk_id, metadata, text) for every stored chunk
+        """
+        now = time.time()
+
+        def statements(conn):
+            conn.execute("DELETE FROM chunks_fts")
+            conn.execute("DELETE FROM chunk_rows")
+            for chunk_id, metadata, text in chunks:
+                self._insert(conn, chunk_id, text or "", metadata or {})
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(now),))
+
+        self._write(statements)
+        logger.info(f"Rebuilt lexical index: {self.get_stats()}")
+
+    def optimize(self):
+        """Merge the FTS5 index segments left by many small writes into one (run during maintenance)"""
+        self._write(lambda conn: conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('optimize')"))
+
+    def get_stats(self) -> dict:
+        chunks = self._connect().execute("SELECT COUNT(*) FROM chunk_rows").fetchone()[0]
+        return {"path": self.path, "chunks": chunks}
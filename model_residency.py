@@ -0,0 +1,503 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# LiteLLM prefixes that route a request to the local Ollama server
+OLLAMA_MODEL_PREFIXES = ("ollama/", "ollama_chat/")
+
+# Window used to decide whether a model is "hot"
+USAGE_WINDOW_SECONDS = 3600
+
+
+def to_ollama_model_name(model: str) -> Optional[str]:
+    """
+    Map a request model id to the name Ollama reports in /api/ps.
+    Returns None for models served by other providers.
+    """
+    if not model:
+        return None
+
+    for prefix in OLLAMA_MODEL_PREFIXES:
+        if model.startswith(prefix):
+            name = model[len(prefix):]
+            return name if ":" in name else f"{name}:latest"
+
+    return None
+
+
+class ModelResidencyManager:
+    def __init__(self,
+                 ollama_base_url: str = "http://localhost:11434",
+                 memory_budget_bytes: Optional[int] = None,
+                 preload_models: Optional[List[str]] = None,
+                 preload_top_n: int = 1,
+                 hot_keep_alive: str = "30m",
+                 default_keep_alive: str = "5m",
+                 cold_keep_alive: str = "2m",
+                 hot_requests_per_hour: int = 10,
+                 idle_evict_seconds: float = 900,
+                 poll_interval: float = 30.0,
+                 usage_path: str = "./model_usage.json",
+                 shared_state=None):
+        """
+        Keep frequently used Ollama models resident and idle ones out of memory
+
+        Args:
+            ollama_base_url: Base URL for Ollama API
+            memory_budget_bytes: Upper bound for the combined size of loaded models (None = no budget)
+            preload_models: Models always loaded at startup and kept on the hot keep_alive
+            preload_top_n: Additionally preload this many of the most used models from past runs
+            hot_keep_alive: keep_alive for pinned models and models above hot_requests_per_hour
+            default_keep_alive: keep_alive for models with some recent use
+            cold_keep_alive: keep_alive for models without recent use
+            hot_requests_per_hour: Requests in the last hour that make a model hot
+            idle_evict_seconds: Unload models idle for longer than this, budget permitting
+            poll_interval: Seconds between /api/ps polls in the maintenance loop
+            usage_path: JSON file persisting usage counts across restarts
+            shared_state: Optional SharedState; with several workers only the lease holder preloads and evicts
+        """
+        self.ollama_base_url = ollama_base_url
+        self.memory_budget_bytes = memory_budget_bytes
+        self.pinned_models = {
+            to_ollama_model_name(m if m.startswith(OLLAMA_MODEL_PREFIXES) else f"ollama/{m}")
+            for m in (preload_models or [])
+        }
+        self.preload_top_n = preload_top_n
+        self.hot_keep_alive = hot_keep_alive
+        self.default_keep_alive = default_keep_alive
+        self.cold_keep_alive = cold_keep_alive
+        self.hot_requests_per_hour = hot_requests_per_hour
+        self.idle_evict_seconds = idle_evict_seconds
+        self.poll_interval = poll_interval
+        self.usage_path = usage_path
+        self.shared_state = shared_state
+
+        self._usage = {}
+        self._resident = {}
+        self._resident_checked_at = 0.0
+        self._model_sizes = {}
+        self._in_flight = {}
+        self._cold_starts = {}
+        # Models loaded by this manager whose KV cache no request has used yet
+        self._fresh_loads = set()
+        self._events = deque(maxlen=200)
+        # Guards the bookkeeping only and is never held across Ollama calls; a model's
+        # cold start (size lookup, eviction) is serialized by that model's own lock
+        self._lock = asyncio.Lock()
+        self._model_locks = {}
+        self._refresh_lock = asyncio.Lock()
+        self._evicting = set()
+        self._lease_expires_at = 0.0
+        self._client = None
+        self._task = None
+
+        self._load_usage()
+
+    # --- Persistence ---
+    def _load_usage(self):
+        if not os.path.exists(self.usage_path):
+            return
+        try:
+            with open(self.usage_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            for model, entry in saved.items():
+                self._usage[model] = {
+                    "requests": entry.get("requests", 0),
+                    "last_used": entry.get("last_used", 0.0),
+                    "recent": deque()
+                }
+        except Exception as e:
+            logger.error(f"Error loading model usage from {self.usage_path}: {str(e)}")
+
+    def save_usage(self):
+        """Persist request counts so the next startup knows which models are hot"""
+        try:
+            data = {
+                model: {"requests": entry["requests"], "last_used": entry["last_used"]}
+                for model, entry in self._usage.items()
+            }
+            tmp_path = f"{self.usage_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.usage_path)
+        except Exception as e:
+            logger.error(f"Error saving model usage to {self.usage_path}: {str(e)}")
+
+    # --- Ollama API ---
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Loading a large model can take minutes on a cold disk
+            self._client = httpx.AsyncClient(base_url=self.ollama_base_url, timeout=600.0)
+        return self._client
+
+    def _record_event(self, event_type: str, model: str, **details):
+        event = {"time": time.time(), "type": event_type, "model": model}
+        event.update(details)
+        self._events.append(event)
+        logger.info(f"Model residency: {event_type} {model} {details if details else ''}".rstrip())
+
+    async def refresh_resident(self):
+        """Refresh the set of loaded models from /api/ps"""
+        try:
+            response = await self._get_client().get("/api/ps", timeout=5.0)
+            response.raise_for_status()
+            models = response.json().get("models", [])
+        except Exception as e:
+            logger.warning(f"Could not query loaded Ollama models: {str(e)}")
+            return
+
+        resident = {}
+        for entry in models:
+            name = entry.get("name") or entry.get("model")
+            if not name:
+                continue
+            resident[name] = {
+                "size": entry.get("size", 0),
+                "size_vram": entry.get("size_vram", 0),
+                "expires_at": entry.get("expires_at")
+            }
+            self._model_sizes[name] = entry.get("size", 0)
+
+        for name in set(self._resident) - set(resident):
+            if self._in_flight.get(name):
+                # Still loading for an in-flight request; /api/ps lists it once the load completes
+                resident[name] = self._resident[name]
+            else:
+                self._record_event("unloaded", name)
+
+        self._resident = resident
+        self._resident_checked_at = time.monotonic()
+
+    async def _refresh_model_sizes(self):
+        """Learn on-disk model sizes from /api/tags as an estimate for models not loaded yet"""
+        try:
+            response = await self._get_client().get("/api/tags", timeout=5.0)
+            response.raise_for_status()
+            for entry in response.json().get("models", []):
+                name = entry.get("name") or entry.get("model")
+                if name and name not in self._model_sizes:
+                    self._model_sizes[name] = entry.get("size", 0)
+        except Exception as e:
+            logger.warning(f"Could not query Ollama model sizes: {str(e)}")
+
+    async def preload(self, model: str) -> bool:
+        """Load a model into memory without generating anything"""
+        started_at = time.perf_counter()
+        try:
+            response = await self._get_client().post(
+                "/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive_for(model)}
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.error(f"Error preloading model {model}: {str(e)}")
+            return False
+
+        self._record_event("preload", model, load_ms=round((time.perf_counter() - started_at) * 1000, 1))
+        # Count the preload as use so idle eviction doesn't immediately undo it
+        entry = self._usage.setdefault(model, {"requests": 0, "last_used": 0.0, "recent": deque()})
+        entry["last_used"] = time.time()
+        if model not in self._resident:
+            self._fresh_loads.add(model)
+        self._resident.setdefault(model, {"size": self._model_sizes.get(model, 0), "size_vram": 0, "expires_at": None})
+        return True
+
+    async def unload(self, model: str, reason: str = "idle") -> bool:
+        """Unload a model immediately by setting keep_alive to 0"""
+        try:
+            response = await self._get_client().post(
+                "/api/generate",
+                json={"model": model, "keep_alive": 0},
+                timeout=30.0
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.error(f"Error unloading model {model}: {str(e)}")
+            return False
+        finally:
+            self._evicting.discard(model)
+
+        # A request that arrived meanwhile reloads the model; keep it listed for that request
+        if not self._in_flight.get(model):
+            self._resident.pop(model, None)
+        self._record_event("evict", model, reason=reason)
+        return True
+
+    # --- Policy ---
+    def _recent_requests(self, model: str) -> int:
+        entry = self._usage.get(model)
+        if not entry:
+            return 0
+        cutoff = time.time() - USAGE_WINDOW_SECONDS
+        recent = entry["recent"]
+        while recent and recent[0] < cutoff:
+            recent.popleft()
+        return len(recent)
+
+    def keep_alive_for(self, model: str) -> str:
+        """Pick a keep_alive duration for a model from its recent usage"""
+        if model in self.pinned_models:
+            return self.hot_keep_alive
+
+        recent = self._recent_requests(model)
+        if recent >= self.hot_requests_per_hour:
+            return self.hot_keep_alive
+        if recent > 0:
+            return self.default_keep_alive
+        return self.cold_keep_alive
+
+    def _resident_bytes(self) -> int:
+        """Bytes of the resident models, not counting those already being unloaded"""
+        return sum(entry.get("size", 0) for name, entry in self._resident.items() if name not in self._evicting)
+
+    def _eviction_candidates(self, exclude: Optional[str] = None) -> List[str]:
+        """Resident models that may be unloaded, least recently used first"""
+        candidates = [
+            name for name in self._resident
+            if name != exclude and not self._in_flight.get(name) and name not in self._evicting
+        ]
+        return sorted(
+            candidates,
+            key=lambda name: (name in self.pinned_models, self._usage.get(name, {}).get("last_used", 0.0))
+        )
+
+    def _plan_room(self, model: str) -> List[str]:
+        """
+        Pick least recently used models to evict so model fits in the memory budget
+
+        Synchronous, so it runs under the bookkeeping lock; the picked models are
+        marked as being unloaded and the caller unloads them after releasing it.
+        """
+        if not self.memory_budget_bytes:
+            return []
+
+        needed = self._model_sizes.get(model, 0)
+        victims = []
+        for candidate in self._eviction_candidates(exclude=model):
+            if self._resident_bytes() + needed <= self.memory_budget_bytes:
+                break
+            self._evicting.add(candidate)
+            victims.append(candidate)
+        return victims
+
+    def _plan_idle_evictions(self) -> List[Tuple[str, str]]:
+        """(model, reason) for idle models and models over the memory budget, marked as being unloaded"""
+        now = time.time()
+        victims = []
+        for model in self._eviction_candidates():
+            over_budget = bool(self.memory_budget_bytes) and self._resident_bytes() > self.memory_budget_bytes
+            idle_for = now - self._usage.get(model, {}).get("last_used", 0.0)
+
+            if over_budget:
+                victims.append((model, "memory_budget"))
+            elif model not in self.pinned_models and idle_for > self.idle_evict_seconds:
+                victims.append((model, "idle"))
+            else:
+                continue
+            self._evicting.add(model)
+        return victims
+
+    async def evict_idle(self):
+        """Unload idle models and enforce the memory budget"""
+        async with self._lock:
+            victims = self._plan_idle_evictions()
+        for model, reason in victims:
+            await self.unload(model, reason=reason)
+
+    # --- Request hooks ---
+    async def before_request(self, model: str) -> Optional[str]:
+        """
+        Record a request and decide its keep_alive
+
+        Args:
+            model: Request model id (e.g. "ollama/llama3.2:latest")
+
+        Returns:
+            keep_alive to send with the request, or None for non-Ollama models
+        """
+        name = to_ollama_model_name(model)
+        if name is None:
+            return None
+
+        async with self._lock:
+            now = time.time()
+            entry = self._usage.setdefault(name, {"requests": 0, "last_used": 0.0, "recent": deque()})
+            entry["requests"] += 1
+            entry["last_used"] = now
+            entry["recent"].append(now)
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+
+        try:
+            await self._refresh_resident_if_stale()
+
+            # Concurrent first requests for one model wait for each other (one cold start);
+            # requests for other models are not held up by this model's Ollama calls
+            async with self._model_locks.setdefault(name, asyncio.Lock()):
+                if name not in self._resident or name in self._evicting:
+                    if name not in self._model_sizes:
+                        await self._refresh_model_sizes()
+                    async with self._lock:
+                        # This request pays the model load; mark it resident so concurrent requests are not counted twice
+                        self._cold_starts[name] = self._cold_starts.get(name, 0) + 1
+                        self._record_event("cold_start", name)
+                        self._fresh_loads.add(name)
+                        victims = self._plan_room(name) if self._may_evict() else []
+                        self._resident[name] = {"size": self._model_sizes.get(name, 0), "size_vram": 0, "expires_at": None}
+                    for victim in victims:
+                        await self.unload(victim, reason="memory_budget")
+        except BaseException:
+            self.after_request(model)
+            raise
+
+        return self.keep_alive_for(name)
+
+    async def _refresh_resident_if_stale(self, max_age: float = 5.0):
+        """Refresh the resident models if the last /api/ps is older than max_age; one refresh at a time"""
+        if time.monotonic() - self._resident_checked_at <= max_age:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._resident_checked_at > max_age:
+                await self.refresh_resident()
+
+    def after_request(self, model: str):
+        """Mark a request as finished"""
+        name = to_ollama_model_name(model)
+        if name is None:
+            return
+        self._in_flight[name] = max(0, self._in_flight.get(name, 0) - 1)
+
+    def consume_cold_start(self, model: str) -> bool:
+        """
+        Whether a finished request was the first one served since this manager loaded the model
+
+        Such a request found an empty KV cache, so the backend evaluated its whole
+        prompt. Returns True once per load.
+        """
+        name = to_ollama_model_name(model)
+        if name is None or name not in self._fresh_loads:
+            return False
+        self._fresh_loads.discard(name)
+        return True
+
+    @asynccontextmanager
+    async def track(self, model: str):
+        """Context manager wrapping before_request/after_request; yields the keep_alive to use"""
+        keep_alive = await self.before_request(model)
+        try:
+            yield keep_alive
+        finally:
+            self.after_request(model)
+
+    # --- Lifecycle ---
+    async def preload_hot_models(self):
+        """Preload pinned models plus the most used models from previous runs"""
+        await self.refresh_resident()
+        await self._refresh_model_sizes()
+
+        most_used = sorted(self._usage, key=lambda name: self._usage[name]["requests"], reverse=True)
+        candidates = list(self.pinned_models) + [m for m in most_used if m not in self.pinned_models][:self.preload_top_n]
+
+        for model in candidates:
+            if model in self._resident:
+                continue
+            if self._model_sizes and model not in self._model_sizes:
+                logger.warning(f"Skipping preload of {model}: not installed in Ollama")
+                continue
+            if self.memory_budget_bytes and self._resident_bytes() + self._model_sizes.get(model, 0) > self.memory_budget_bytes:
+                logger.info(f"Skipping preload of {model}: would exceed the memory budget")
+                continue
+            await self.preload(model)
+
+    async def _holds_lease(self) -> bool:
+        """With several API workers, only the holder of the residency lease preloads and evicts"""
+        if self.shared_state is None:
+            return True
+        ttl = self.poll_interval * 3
+        held = await asyncio.to_thread(self.shared_state.acquire_lease, "model_residency", ttl)
+        self._lease_expires_at = time.monotonic() + ttl if held else 0.0
+        return held
+
+    def _may_evict(self) -> bool:
+        """Whether requests in this worker may evict models (as last seen by the maintenance loop, without I/O)"""
+        return self.shared_state is None or time.monotonic() < self._lease_expires_at
+
+    async def _maintenance_loop(self):
+        preloaded = False
+        while True:
+            try:
+                if await self._holds_lease():
+                    if not preloaded:
+                        await self.preload_hot_models()
+                        preloaded = True
+                    else:
+                        async with self._refresh_lock:
+                            await self.refresh_resident()
+                        await self.evict_idle()
+                        self.save_usage()
+            except Exception as e:
+                logger.error(f"Error in model residency maintenance: {str(e)}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Start preloading and the background maintenance loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self):
+        """Stop the maintenance loop and persist usage"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self.save_usage()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_status(self) -> dict:
+        """Resident models, budget usage, cold-start counts and recent load events"""
+        now = time.time()
+        resident = []
+        for name, entry in self._resident.items():
+            last_used = self._usage.get(name, {}).get("last_used")
+            resident.append({
+                "model": name,
+                "size": entry.get("size", 0),
+                "size_vram": entry.get("size_vram", 0),
+                "expires_at": entry.get("expires_at"),
+                "idle_seconds": round(now - last_used, 1) if last_used else None,
+                "in_flight": self._in_flight.get(name, 0),
+                "pinned": name in self.pinned_models,
+                "keep_alive": self.keep_alive_for(name)
+            })
+
+        return {
+            "resident": resident,
+            "resident_bytes": self._resident_bytes(),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "cold_starts": dict(self._cold_starts),
+            "total_cold_starts": sum(self._cold_starts.values()),
+            "usage": {
+                name: {
+                    "requests": entry["requests"],
+                    "requests_last_hour": self._recent_requests(name),
+                    "last_used": entry["last_used"]
+                }
+                for name, entry in self._usage.items()
+            },
+            "events": list(self._events)
+        }
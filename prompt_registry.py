@@ -0,0 +1,377 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import statistics
+import unicodedata
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the built-in prompts of the frontend SystemPromptLibrary so the same ids work on both sides
+BUILTIN_PROMPTS = [
+    {
+        "id": "helpful-assistant",
+        "name": "Helpful Assistant",
+        "description": "A friendly, helpful AI assistant",
+        "category": "Basic",
+        "prompt": "You are a helpful, harmless, and honest AI assistant. Provide clear, accurate, and concise responses to the user's questions."
+    },
+    {
+        "id": "creative-writer",
+        "name": "Creative Writer",
+        "description": "Specialized in creative writing and storytelling",
+        "category": "Creative",
+        "prompt": "You are a creative writing assistant with expertise in storytelling, poetry, and creative expression. Help users develop compelling narratives, interesting characters, and vivid descriptions. Be imaginative and inspiring while maintaining good writing principles."
+    },
+    {
+        "id": "socratic-teacher",
+        "name": "Socratic Teacher",
+        "description": "Teaches through questions and guided discovery",
+        "category": "Educational",
+        "prompt": "You are a Socratic teacher. Instead of giving direct answers, guide students to discover solutions through thoughtful questions. Ask probing questions that help them think critically and arrive at understanding on their own. Be patient and encouraging."
+    },
+    {
+        "id": "code-reviewer",
+        "name": "Code Reviewer",
+        "description": "Reviews code with constructive feedback",
+        "category": "Programming",
+        "prompt": "You are an experienced software engineer conducting code reviews. Analyze code for:\n- Correctness and functionality\n- Best practices and conventions\n- Performance considerations\n- Security implications\n- Readability and maintainability\n\nProvide constructive feedback with specific suggestions for improvement."
+    },
+    {
+        "id": "math-tutor",
+        "name": "Math Tutor",
+        "description": "Patient math teacher with step-by-step explanations",
+        "category": "Educational",
+        "prompt": "You are a patient and encouraging math tutor. Break down complex problems into manageable steps. Show your work clearly, explain the reasoning behind each step, and check for understanding. Adapt your explanations to the student's level."
+    },
+    {
+        "id": "language-partner",
+        "name": "Language Learning Partner",
+        "description": "Helps with language learning and practice",
+        "category": "Educational",
+        "prompt": "You are a friendly language learning partner. Help users practice their target language by:\n- Having conversations at their level\n- Correcting mistakes gently with explanations\n- Teaching new vocabulary in context\n- Explaining grammar rules clearly\n- Encouraging practice and progress\n\nAsk what language they want to practice first."
+    },
+    {
+        "id": "debate-partner",
+        "name": "Debate Partner",
+        "description": "Engages in respectful, logical debates",
+        "category": "Critical Thinking",
+        "prompt": "You are an intelligent debate partner who engages in respectful, logical discussions. Present well-reasoned arguments, ask for evidence, point out logical fallacies constructively, and help explore different perspectives on topics. Stay objective and focus on ideas, not personal attacks."
+    }
+]
+
+# A request counts as a prefix-cache hit when at least this share of the system prompt was not re-evaluated
+PREFIX_HIT_THRESHOLD = 0.5
+
+# Cold evaluations kept per model to calibrate its characters-per-token ratio
+CALIBRATION_SAMPLES = 20
+
+
+def canonicalize_prompt(text: str) -> str:
+    """
+    Normalize a system prompt into a byte-stable form.
+
+    Two prompts that differ only in unicode composition, line endings or
+    trailing whitespace render to the same bytes, so the model server sees an
+    identical prefix and can reuse its prompt/KV cache across users.
+    """
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = [line.rstrip() for line in text.split("\n")]
+    return "\n".join(lines).strip("\n")
+
+
+def prompt_digest(canonical_text: str) -> str:
+    """Short content hash identifying a canonical prompt prefix"""
+    return hashlib.sha256(canonical_text.encode("utf-8")).hexdigest()[:16]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used when no tokenizer is available"""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+class SystemPromptRegistry:
+    def __init__(self, storage_path: str = "./system_prompts.json"):
+        """
+        Initialize the system prompt registry
+
+        Args:
+            storage_path: JSON file holding user-defined prompts (built-ins are never written)
+        """
+        self.storage_path = storage_path
+        self._lock = threading.Lock()
+        self._prompts = {}
+        self._stats = {}
+        self._chars_per_token = {}
+        self._loaded_mtime = None
+
+        for entry in BUILTIN_PROMPTS:
+            self._prompts[entry["id"]] = self._build_entry(entry, builtin=True)
+
+        self._load_custom_prompts()
+
+    def _build_entry(self, entry: dict, builtin: bool = False) -> dict:
+        canonical = canonicalize_prompt(entry["prompt"])
+        return {
+            "id": entry["id"],
+            "name": entry.get("name") or entry["id"],
+            "description": entry.get("description", ""),
+            "category": entry.get("category", "Custom"),
+            "prompt": canonical,
+            "digest": prompt_digest(canonical),
+            "builtin": builtin
+        }
+
+    def _load_custom_prompts(self):
+        """Load user-defined prompts from disk, if any"""
+        if not os.path.exists(self.storage_path):
+            return
+
+        try:
+            self._loaded_mtime = os.path.getmtime(self.storage_path)
+            with open(self.storage_path, "r", encoding="utf-8") as f:
+                custom_prompts = json.load(f)
+
+            self._prompts = {key: entry for key, entry in self._prompts.items() if entry["builtin"]}
+            for entry in custom_prompts:
+                if entry.get("id") in self._prompts and self._prompts[entry["id"]]["builtin"]:
+                    continue
+                self._prompts[entry["id"]] = self._build_entry(entry)
+
+            logger.info(f"Loaded {len(custom_prompts)} custom system prompts from {self.storage_path}")
+        except Exception as e:
+            logger.error(f"Error loading system prompts from {self.storage_path}: {str(e)}")
+
+    def _save_custom_prompts(self):
+        """Persist user-defined prompts; callers must hold the lock"""
+        custom_prompts = [
+            {key: entry[key] for key in ("id", "name", "description", "category", "prompt")}
+            for entry in self._prompts.values()
+            if not entry["builtin"]
+        ]
+
+        tmp_path = f"{self.storage_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(custom_prompts, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.storage_path)
+        self._loaded_mtime = os.path.getmtime(self.storage_path)
+
+    def _reload_if_changed(self):
+        """Pick up prompts saved by other API workers; callers must hold the lock"""
+        try:
+            mtime = os.path.getmtime(self.storage_path)
+        except OSError:
+            return
+        if mtime != self._loaded_mtime:
+            self._load_custom_prompts()
+
+    def list_prompts(self) -> List[dict]:
+        """List all registered prompts, built-ins first"""
+        with self._lock:
+            self._reload_if_changed()
+            return sorted(self._prompts.values(), key=lambda entry: (not entry["builtin"], entry["id"]))
+
+    def get_prompt(self, prompt_id: str) -> Optional[dict]:
+        """Get a prompt by id"""
+        with self._lock:
+            self._reload_if_changed()
+            return self._prompts.get(prompt_id)
+
+    def register_prompt(self, prompt_id: str, prompt: str, name: Optional[str] = None,
+                        description: str = "", category: str = "Custom") -> dict:
+        """
+        Create or replace a user-defined prompt
+
+        Args:
+            prompt_id: Stable id clients use to reference the prompt
+            prompt: Prompt text; stored in canonical form
+            name: Display name (defaults to the id)
+            description: Short description
+            category: Library category
+
+        Returns:
+            The stored prompt entry
+        """
+        with self._lock:
+            self._reload_if_changed()
+            existing = self._prompts.get(prompt_id)
+            if existing and existing["builtin"]:
+                raise ValueError(f"Built-in prompt '{prompt_id}' cannot be modified")
+
+            entry = self._build_entry({
+                "id": prompt_id,
+                "name": name,
+                "description": description,
+                "category": category,
+                "prompt": prompt
+            })
+            self._prompts[prompt_id] = entry
+            self._save_custom_prompts()
+
+        logger.info(f"Registered system prompt '{prompt_id}' ({entry['digest']})")
+        return entry
+
+    def delete_prompt(self, prompt_id: str) -> bool:
+        """Delete a user-defined prompt; built-ins cannot be deleted"""
+        with self._lock:
+            self._reload_if_changed()
+            existing = self._prompts.get(prompt_id)
+            if not existing or existing["builtin"]:
+                return False
+
+            del self._prompts[prompt_id]
+            self._save_custom_prompts()
+            return True
+
+    def resolve(self, prompt_id: Optional[str] = None, system_prompt: Optional[str] = None) -> Optional[dict]:
+        """
+        Resolve the system prompt for a request
+
+        A registered id wins over raw text. Raw text is canonicalized the same
+        way, so ad-hoc prompts also share a cache prefix when they match.
+
+        Returns:
+            Dict with id, prompt and digest, or None if the request has no system prompt
+
+        Raises:
+            KeyError: If prompt_id is not registered
+        """
+        if prompt_id:
+            entry = self.get_prompt(prompt_id)
+            if entry is None:
+                raise KeyError(prompt_id)
+            return {"id": entry["id"], "prompt": entry["prompt"], "digest": entry["digest"]}
+
+        if system_prompt and system_prompt.strip():
+            canonical = canonicalize_prompt(system_prompt)
+            return {"id": None, "prompt": canonical, "digest": prompt_digest(canonical)}
+
+        return None
+
+    def record_prompt_eval(self, resolved: dict, model: str, report: Optional[dict], prefill_ms: Optional[float]):
+        """
+        Record the backend's prompt cache report for a request using a resolved prompt
+
+        Hits are only inferred from numbers the backend itself reports, so no
+        client-side token estimate is compared against a different tokenizer:
+
+        - "cached_tokens": the provider reports how many prompt tokens came
+          from its cache (OpenAI cached_tokens, Anthropic cache reads). Any
+          cached tokens mean the shared system prefix was reused.
+        - "prompt_eval": Ollama's prompt_eval_count, which only covers the part
+          of the prompt not already in its KV cache. The request's full prompt
+          size is converted to the model's tokens with a characters-per-token
+          ratio calibrated from that model's cold evaluations (first request
+          after a load, when nothing can be cached). It is a hit when at least
+          PREFIX_HIT_THRESHOLD of the system prompt was not re-evaluated. Until
+          a model has been calibrated its warm requests count as unknown.
+
+        Requests without a usable report are counted as unknown.
+
+        Args:
+            resolved: Result of resolve()
+            model: Model that served the request
+            report: {"source": "cached_tokens", "prompt_tokens", "cached_tokens"} or
+                {"source": "prompt_eval", "prompt_eval_tokens", "prompt_chars", "cold"},
+                None if usage was missing
+            prefill_ms: Time until the first token (streaming) or the full request (non-streaming)
+        """
+        prefix_tokens = estimate_tokens(resolved["prompt"])
+
+        with self._lock:
+            stats = self._stats.setdefault(resolved["digest"], {
+                "digest": resolved["digest"],
+                "prompt_id": resolved["id"],
+                "prefix_tokens_estimate": prefix_tokens,
+                "requests": 0,
+                "observed": 0,
+                "hits": 0,
+                "unknown": 0,
+                "prompt_eval_tokens": 0,
+                "prompt_eval_samples": 0,
+                "cached_tokens": 0,
+                "prefill_ms_total": 0.0,
+                "prefill_samples": 0
+            })
+            stats["requests"] += 1
+
+            if prefill_ms is not None:
+                stats["prefill_ms_total"] += prefill_ms
+                stats["prefill_samples"] += 1
+
+            hit = None
+            if report is not None and report["source"] == "cached_tokens":
+                stats["cached_tokens"] += report["cached_tokens"]
+                hit = report["cached_tokens"] > 0
+            elif report is not None and report["source"] == "prompt_eval":
+                evaluated = report["prompt_eval_tokens"]
+                stats["prompt_eval_tokens"] += evaluated
+                stats["prompt_eval_samples"] += 1
+                ratios = self._chars_per_token.setdefault(model, deque(maxlen=CALIBRATION_SAMPLES))
+                if report["cold"]:
+                    # The whole prompt was evaluated, so this is both a miss and a calibration sample
+                    if evaluated > 0:
+                        ratios.append(report["prompt_chars"] / evaluated)
+                    hit = False
+                elif ratios:
+                    chars_per_token = statistics.median(ratios)
+                    reused_tokens = report["prompt_chars"] / chars_per_token - evaluated
+                    hit = reused_tokens >= len(resolved["prompt"]) / chars_per_token * PREFIX_HIT_THRESHOLD
+
+            if hit is None:
+                stats["unknown"] += 1
+                return
+
+            stats["observed"] += 1
+            if hit:
+                stats["hits"] += 1
+
+    def get_cache_stats(self) -> dict:
+        """Prefix cache statistics per prompt digest plus overall totals"""
+        with self._lock:
+            prompts = []
+            total_observed = 0
+            total_hits = 0
+            total_unknown = 0
+            for stats in self._stats.values():
+                total_observed += stats["observed"]
+                total_hits += stats["hits"]
+                total_unknown += stats["unknown"]
+                prompts.append({
+                    "digest": stats["digest"],
+                    "prompt_id": stats["prompt_id"],
+                    "prefix_tokens_estimate": stats["prefix_tokens_estimate"],
+                    "requests": stats["requests"],
+                    "observed": stats["observed"],
+                    "hits": stats["hits"],
+                    "unknown": stats["unknown"],
+                    "hit_rate": stats["hits"] / stats["observed"] if stats["observed"] else None,
+                    "avg_prompt_eval_tokens": stats["prompt_eval_tokens"] / stats["prompt_eval_samples"] if stats["prompt_eval_samples"] else None,
+                    "cached_tokens": stats["cached_tokens"],
+                    "avg_prefill_ms": round(stats["prefill_ms_total"] / stats["prefill_samples"], 1) if stats["prefill_samples"] else None
+                })
+
+        return {
+            "observed": total_observed,
+            "hits": total_hits,
+            "unknown": total_unknown,
+            "hit_rate": total_hits / total_observed if total_observed else None,
+            "prompts": sorted(prompts, key=lambda p: p["requests"], reverse=True)
+        }
+
+
+# Global prompt registry instance
+prompt_registry = None
+
+def get_prompt_registry() -> SystemPromptRegistry:
+    """Get or create global system prompt registry instance"""
+    global prompt_registry
+    if prompt_registry is None:
+        prompt_registry = SystemPromptRegistry()
+    return prompt_registry
@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROUTING_MODES = ("single", "failover", "hedge")
+
+
+def extract_stream_delta(chunk):
+    """Extract the text delta from a LiteLLM streaming chunk, or None if it carries no text."""
+    delta = None
+
+    # Handle different response formats
+    if hasattr(chunk, 'choices') and chunk.choices:
+        if hasattr(chunk.choices[0], 'delta'):
+            if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content is not None:
+                delta = chunk.choices[0].delta.content
+            elif hasattr(chunk.choices[0].delta, 'text') and chunk.choices[0].delta.text is not None:
+                delta = chunk.choices[0].delta.text
+        elif hasattr(chunk.choices[0], 'text') and chunk.choices[0].text is not None:
+            delta = chunk.choices[0].text
+        elif hasattr(chunk.choices[0], 'message') and hasattr(chunk.choices[0].message, 'content') and chunk.choices[0].message.content is not None:
+            delta = chunk.choices[0].message.content
+
+    return delta
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        """Rolling window of time-to-first-token samples per model"""
+        self.window = window
+        self._samples = {}
+
+    def record(self, model: str, seconds: float):
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, model: str) -> int:
+        return len(self._samples.get(model, ()))
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class _Attempt:
+    """One provider request being pumped into a queue so several can be raced"""
+
+    def __init__(self, model: str, stream_factory):
+        self.model = model
+        self.started_at = time.perf_counter()
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump(stream_factory))
+
+    async def _pump(self, stream_factory):
+        stream = stream_factory(self.model)
+        try:
+            async for chunk in stream:
+                await self.queue.put(("chunk", chunk))
+            await self.queue.put(("end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.queue.put(("error", e))
+        finally:
+            await stream.aclose()
+
+    async def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class ProviderRouter:
+    def __init__(self,
+                 policies: Optional[dict] = None,
+                 residency_manager=None,
+                 litellm_loader=None,
+                 hedge_percentile: float = 0.95,
+                 default_hedge_delay: float = 2.0,
+                 min_hedge_delay: float = 0.25,
+                 max_hedge_delay: float = 15.0,
+                 min_samples: int = 20):
+        """
+        Route chat requests across providers with optional failover and hedging
+
+        Args:
+            policies: Map of requested model id -> {"mode": "failover"|"hedge", "backups": [model ids]}
+            residency_manager: Optional ModelResidencyManager consulted for every Ollama attempt
+            litellm_loader: Optional async callable returning the litellm module (defaults to a plain import)
+            hedge_percentile: TTFT percentile of the primary used as the hedge deadline
+            default_hedge_delay: Deadline in seconds until min_samples TTFTs have been seen
+            min_hedge_delay: Lower bound for the hedge deadline
+            max_hedge_delay: Upper bound for the hedge deadline
+            min_samples: TTFT samples needed before the percentile is trusted
+        """
+        self.policies = {}
+        for model, policy in (policies or {}).items():
+            self.set_policy(model, policy)
+        self.residency_manager = residency_manager
+        self.litellm_loader = litellm_loader
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.min_samples = min_samples
+
+        self.latency = LatencyTracker()
+        self.stats = {
+            "requests": 0,
+            "failovers": 0,
+            "hedges_fired": 0,
+            "hedge_wins": 0,
+            "errors": {}
+        }
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ProviderRouter":
+        """Create a router with policies loaded from a JSON file, if it exists"""
+        policies = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    policies = json.load(f)
+                logger.info(f"Loaded {len(policies)} routing policies from {path}")
+            except Exception as e:
+                logger.error(f"Error loading routing policies from {path}: {str(e)}")
+        return cls(policies=policies, **kwargs)
+
+    def set_policy(self, model: str, policy: dict):
+        """Register the routing policy for requests to model"""
+        mode = policy.get("mode", "failover")
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode '{mode}' for {model}; expected one of {ROUTING_MODES}")
+        self.policies[model] = {"mode": mode, "backups": list(policy.get("backups", []))}
+
+    def has_policy(self, model: str) -> bool:
+        """Whether requests to model are routed across more than one provider"""
+        policy = self.policies.get(model)
+        return bool(policy) and policy["mode"] != "single" and bool(policy["backups"])
+
+    def get_candidates(self, model: str) -> List[str]:
+        """Primary model followed by its backups"""
+        policy = self.policies.get(model)
+        if not policy or policy["mode"] == "single":
+            return [model]
+        return [model] + [backup for backup in policy["backups"] if backup != model]
+
+    def hedge_deadline(self, model: str) -> float:
+        """Seconds to wait for the primary's first token before firing a hedge"""
+        if self.latency.count(model) < self.min_samples:
+            return self.default_hedge_delay
+        deadline = self.latency.percentile(model, self.hedge_percentile)
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, deadline))
+
+    def _record_error(self, model: str, error: Exception):
+        self.stats["errors"][model] = self.stats["errors"].get(model, 0) + 1
+        logger.warning(f"Provider attempt for {model} failed: {str(error)}")
+
+    def _stream_factory(self, messages, temperature):
+        """Build a per-model async chunk generator sharing the request's messages"""
+        async def open_stream(model):
+            if self.litellm_loader is not None:
+                acompletion = (await self.litellm_loader()).acompletion
+            else:
+                from litellm import acompletion
+
+            keep_alive = None
+            if self.residency_manager is not None:
+                keep_alive = await self.residency_manager.before_request(model)
+            response_stream = None
+            try:
+                response_stream = await acompletion(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **({"keep_alive": keep_alive} if keep_alive else {})
+                )
+                async for chunk in response_stream:
+                    yield chunk
+            finally:
+                try:
+                    # Close the provider stream so a cancelled attempt (a losing hedge or a
+                    # disconnected client) drops its connection and stops generating
+                    if response_stream is not None and hasattr(response_stream, "aclose"):
+                        await response_stream.aclose()
+                finally:
+                    if self.residency_manager is not None:
+                        self.residency_manager.after_request(model)
+
+        return open_stream
+
+    async def stream(self, model: str, messages: List[dict], temperature: float = 0.7):
+        """
+        Stream a chat completion according to the model's routing policy
+
+        Yields dicts with "model" (the provider actually serving), "delta" (text or
+        None) and "chunk" (the raw LiteLLM chunk). Failover only happens before
+        the first token; once text has been yielded the serving model is fixed.
+        """
+        self.stats["requests"] += 1
+        policy = self.policies.get(model, {"mode": "single"})
+        candidates = self.get_candidates(model)
+        factory = self._stream_factory(messages, temperature)
+
+        live = []
+        getters = {}
+        next_candidate = 0
+        winner = None
+        winner_ended = False
+        answered = set()
+        first_chunk = None
+        last_error = None
+        hedge_at = None
+
+        def launch():
+            nonlocal next_candidate
+            attempt = _Attempt(candidates[next_candidate], factory)
+            next_candidate += 1
+            live.append(attempt)
+            return attempt
+
+        launch()
+        if policy["mode"] == "hedge" and len(candidates) > 1:
+            hedge_at = time.perf_counter() + self.hedge_deadline(model)
+
+        try:
+            # Race the live attempts until one produces its first token
+            while winner is None:
+                for attempt in live:
+                    if attempt not in getters:
+                        getters[attempt] = asyncio.create_task(attempt.queue.get())
+
+                timeout = None
+                if hedge_at is not None and next_candidate < len(candidates):
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+
+                done, _ = await asyncio.wait(getters.values(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Primary missed its deadline: fire the backup and keep both racing
+                    self.stats["hedges_fired"] += 1
+                    logger.info(f"Hedging {model}: no first token after {self.hedge_deadline(model):.2f}s, starting {candidates[next_candidate]}")
+                    launch()
+                    hedge_at = None
+                    continue
+
+                for attempt, getter in list(getters.items()):
+                    if getter not in done:
+                        continue
+                    del getters[attempt]
+                    kind, payload = getter.result()
+
+                    if kind == "chunk":
+                        if extract_stream_delta(payload) and attempt not in answered:
+                            answered.add(attempt)
+                            self.latency.record(attempt.model, time.perf_counter() - attempt.started_at)
+                            if winner is None:
+                                winner = attempt
+                                first_chunk = payload
+                    elif kind == "end":
+                        # Finished without any text; still a valid (empty) answer
+                        if winner is None:
+                            winner = attempt
+                            winner_ended = True
+                    else:
+                        last_error = payload
+                        self._record_error(attempt.model, payload)
+                        live.remove(attempt)
+
+                if winner is None and not live:
+                    if policy["mode"] in ("failover", "hedge") and next_candidate < len(candidates):
+                        self.stats["failovers"] += 1
+                        logger.info(f"Failing over {model} to {candidates[next_candidate]}")
+                        launch()
+                    else:
+                        raise last_error or RuntimeError(f"No provider produced a response for {model}")
+
+            # Cancel the losers so they stop consuming provider capacity
+            for getter in getters.values():
+                getter.cancel()
+            getters.clear()
+            winner_ttft = time.perf_counter() - winner.started_at
+            for attempt in live:
+                if attempt is not winner:
+                    # A loser that ran longer than the winner took has a TTFT of at least its
+                    # running time; record that, so a primary that keeps losing hedges still
+                    # raises its own deadline instead of keeping a stale one
+                    elapsed = time.perf_counter() - attempt.started_at
+                    if attempt not in answered and elapsed >= winner_ttft:
+                        self.latency.record(attempt.model, elapsed)
+                    await attempt.cancel()
+
+            if policy["mode"] == "hedge" and winner.model != model:
+                self.stats["hedge_wins"] += 1
+            if first_chunk is not None:
+                yield {"model": winner.model, "delta": extract_stream_delta(first_chunk), "chunk": first_chunk}
+
+            # Drain the winner (its end marker was already consumed if it produced no text)
+            while not winner_ended:
+                kind, payload = await winner.queue.get()
+                if kind == "chunk":
+                    yield {"model": winner.model, "delta": extract_stream_delta(payload), "chunk": payload}
+                elif kind == "end":
+                    break
+                else:
+                    self._record_error(winner.model, payload)
+                    raise payload
+        finally:
+            for getter in getters.values():
+                getter.cancel()
+            for attempt in live:
+                await attempt.cancel()
+
+    async def complete(self, model: str, messages: List[dict], temperature: float = 0.7) -> dict:
+        """
+        Run a routed request to completion
+
+        Returns:
+            Dict with "content", "model" (serving provider) and "usage" (last reported usage or None)
+        """
+        content = ""
+        served_by = model
+        usage = None
+        async for event in self.stream(model, messages, temperature):
+            served_by = event["model"]
+            if getattr(event["chunk"], 'usage', None) is not None:
+                usage = event["chunk"].usage
+            if event["delta"]:
+                content += event["delta"]
+        return {"content": content, "model": served_by, "usage": usage}
+
+    def get_status(self) -> dict:
+        """Configured policies, hedge deadlines and routing counters"""
+        return {
+            "policies": {
+                model: {
+                    **policy,
+                    "hedge_deadline_seconds": round(self.hedge_deadline(model), 3) if policy["mode"] == "hedge" else None,
+                    "ttft_samples": self.latency.count(model)
+                }
+                for model, policy in self.policies.items()
+            },
+            "stats": {
+                "requests": self.stats["requests"],
+                "failovers": self.stats["failovers"],
+                "hedges_fired": self.stats["hedges_fired"],
+                "hedge_wins": self.stats["hedge_wins"],
+                "errors": dict(self.stats["errors"])
+            }
+        }
@@ -1,22 +1,217 @@
 import os
+import re
+import math
+import time
+import shutil
+import threading
+import hashlib
 import logging
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import chromadb
-from chromadb.utils import embedding_functions
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 import requests
 import tempfile
 import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from shared_state import get_shared_state
+from sqlite_tuning import connect_wal
+from embedding_client import OllamaEmbeddingClient
+from embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH
+from document_catalog import DocumentCatalog, DEFAULT_CATALOG_PATH, file_sha256
+from lexical_index import LexicalIndex, DEFAULT_LEXICAL_INDEX_PATH, reciprocal_rank_fusion
+from retrieval_postprocess import diversify
+from context_packer import ContextPacker
+from query_cache import LRUCache
+from vector_store import ChromaVectorStore, MmapVectorStore, DEFAULT_VECTOR_STORE_PATH
 
 logger = logging.getLogger(__name__)
 
+class DocumentIndexPlan:
+    def __init__(self, filename: str, existing: Dict[str, dict], ingested_at: Optional[float] = None):
+        """
+        Diff of a document's new chunk set against the chunks stored for it
+        
+        Chunk ids are derived from the source name and the chunk's content
+        hash, so a chunk whose text did not change keeps its id across
+        re-uploads and needs neither embedding nor writing.
+        
+        Args:
+            filename: Source document name
+            existing: Stored chunk id -> metadata for this source
+            ingested_at: When the document was first indexed (now if it is new)
+        """
+        self.filename = filename
+        self.existing = existing
+        # Whole seconds: Chroma compares integer metadata only against integer filter values
+        self.ingested_at = int(ingested_at if ingested_at is not None else time.time())
+        self.source_digest = hashlib.sha256(filename.encode("utf-8")).hexdigest()[:12]
+        self.position = 0
+        self.seen_hashes = {}
+        self.kept_ids = set()
+        self.metadata_updates = {}
+        self.chunk_bytes = {}
+        self.reused = 0
+    
+    def add_chunk(self, text: str, page: int) -> Optional[Tuple[str, str, dict]]:
+        """
+        Register the document's next chunk
+        
+        Returns:
+            (id, text, metadata) if the chunk must be embedded and stored, None if it is already stored
+        """
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        # Repeated text within one document gets one id per occurrence
+        occurrence = self.seen_hashes.get(content_hash, 0)
+        self.seen_hashes[content_hash] = occurrence + 1
+        
+        chunk_id = f"{self.source_digest}_{content_hash[:32]}"
+        if occurrence:
+            chunk_id = f"{chunk_id}_{occurrence}"
+        metadata = {
+            "source": self.filename,
+            "chunk_id": self.position,
+            "page": page,
+            "content_hash": content_hash,
+            "ingested_at": self.ingested_at
+        }
+        self.position += 1
+        self.kept_ids.add(chunk_id)
+        self.chunk_bytes[chunk_id] = len(text.encode("utf-8"))
+        
+        stored = self.existing.get(chunk_id)
+        if stored is None:
+            return chunk_id, text, metadata
+        
+        self.reused += 1
+        if {key: stored.get(key) for key in metadata} != metadata:
+            # Same text, moved within the document: only its position metadata changes
+            self.metadata_updates[chunk_id] = {**stored, **metadata}
+        return None
+    
+    def vanished_ids(self) -> List[str]:
+        """Stored chunks that are no longer part of the document"""
+        return [chunk_id for chunk_id in self.existing if chunk_id not in self.kept_ids]
+
+# Text files are read in segments of about this many characters, cut at a line break
+TEXT_SEGMENT_CHARS = 1024 * 1024
+
+def iter_text_segments(file_path: str, segment_chars: int = TEXT_SEGMENT_CHARS) -> Iterator[Document]:
+    """
+    Read a text file as a sequence of Documents of bounded size
+    
+    TextLoader reads the whole file into one Document; this keeps memory
+    flat for large files. Segments end at the last paragraph or line break
+    before the size limit, so only a chunk at a segment edge can differ
+    from splitting the file in one piece.
+    """
+    carry = ""
+    with open(file_path, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(segment_chars)
+            text = carry + block
+            if not block:
+                if text.strip():
+                    yield Document(page_content=text, metadata={"source": file_path})
+                return
+            cut = text.rfind("\n\n")
+            if cut <= 0:
+                cut = text.rfind("\n")
+            if cut <= 0:
+                cut = len(text)
+            carry = text[cut:]
+            if text[:cut].strip():
+                yield Document(page_content=text[:cut], metadata={"source": file_path})
+
+def iter_document_pages(file_path: str, file_type: str = "pdf") -> Iterator[Document]:
+    """One Document per PDF page, or per segment of a text file, loaded lazily"""
+    if file_type.lower() == "pdf":
+        return PyPDFLoader(file_path).lazy_load()
+    
+    return iter_text_segments(file_path)
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    """The splitter every ingestion path uses, so chunk ids agree across them"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len,
+    )
+
+DEFAULT_COLLECTION = os.environ.get("RAG_COLLECTION_NAME", "documents")
+
+# Directory of the embedded Chroma database (also served by the Chroma server in multi-worker mode)
+DEFAULT_CHROMA_PATH = "./chroma_db"
+
+# Chroma's naming rules: 3-63 characters, alphanumerics, '_' and '-', alphanumeric at both ends
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{1,61}[A-Za-z0-9]$")
+
+# Per-collection HNSW settings accepted by Chroma (stored as "hnsw:<key>" collection metadata)
+HNSW_KEYS = ("space", "M", "construction_ef", "search_ef")
+
+def build_where(sources: Optional[List[str]] = None, page_min: Optional[int] = None,
+                page_max: Optional[int] = None, ingested_after: Optional[float] = None,
+                ingested_before: Optional[float] = None) -> Optional[dict]:
+    """
+    Metadata filter restricting a search by source, page range and ingest time
+    
+    The fields are written on every chunk at ingest and indexed by each
+    vector store and the lexical index, so the filter is applied before
+    ranking rather than on the results.
+    
+    Args:
+        sources: Source document names to search in
+        page_min: First page (inclusive, as stored in the chunks' "page" metadata)
+        page_max: Last page (inclusive)
+        ingested_after: Only documents first indexed at or after this Unix time
+        ingested_before: Only documents first indexed before this Unix time
+        
+    Returns:
+        Chroma-style where clause, or None when nothing is restricted
+    """
+    clauses = []
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    if page_min is not None:
+        clauses.append({"page": {"$gte": int(page_min)}})
+    if page_max is not None:
+        clauses.append({"page": {"$lte": int(page_max)}})
+    if ingested_after is not None:
+        clauses.append({"ingested_at": {"$gte": int(math.ceil(ingested_after))}})
+    if ingested_before is not None:
+        clauses.append({"ingested_at": {"$lt": int(math.ceil(ingested_before))}})
+    if not clauses:
+        return None
+    # Chroma takes a single field per where dict; several conditions go under $and
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def collection_path(path: str, collection_name: str) -> str:
+    """
+    Per-collection variant of a side-index path
+    
+    The default collection keeps the plain path so existing stores stay in
+    place; others insert their name before the extension
+    (./lexical_index.sqlite3 -> ./lexical_index.support.sqlite3).
+    """
+    if collection_name == DEFAULT_COLLECTION:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{collection_name}{extension}"
+
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in the knowledge base to answer your question."
+
 class RAGManager:
     def __init__(self, 
                  collection_name: str = "documents",
                  embedding_model: str = "nomic-embed-text",
-                 ollama_base_url: str = "http://localhost:11434"):
+                 ollama_base_url: str = "http://localhost:11434",
+                 chroma_server_url: Optional[str] = None,
+                 create: bool = True,
+                 hnsw: Optional[dict] = None,
+                 shared: Optional["RAGManager"] = None):
         """
         Initialize RAG Manager with ChromaDB and Ollama embeddings
         
@@ -24,56 +219,341 @@ class RAGManager:
             collection_name: Name of the ChromaDB collection
             embedding_model: Ollama embedding model to use (default: nomic-embed-text)
             ollama_base_url: Base URL for Ollama API
+            chroma_server_url: URL of a Chroma server; required when several API workers share the store
+            create: Create the collection if it does not exist (KeyError otherwise)
+            hnsw: HNSW settings for a new Chroma collection (space, M, construction_ef, search_ef)
+            shared: Manager whose store client, embedding client, caches and search threads are reused
         """
+        if not COLLECTION_NAME_PATTERN.match(collection_name):
+            raise ValueError(f"Invalid collection name '{collection_name}': use 3-63 letters, digits, '_' or '-'")
+        unknown = set(hnsw or {}) - set(HNSW_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown HNSW settings: {', '.join(sorted(unknown))}")
         self.collection_name = collection_name
         self.embedding_model = embedding_model
         self.ollama_base_url = ollama_base_url
+        self.chroma_server_url = chroma_server_url or os.environ.get("CHROMA_SERVER_URL")
+        self.vector_backend = os.environ.get("VECTOR_STORE", "chroma").lower()
+        self.chroma_client = None
         
-        # Initialize ChromaDB client
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        if self.vector_backend != "mmap":
+            # Initialize ChromaDB client. An embedded PersistentClient keeps its index in
+            # process memory, so with several workers the store must live in one Chroma
+            # server process that all workers talk to.
+            if shared is not None and shared.chroma_client is not None:
+                self.chroma_client = shared.chroma_client
+            elif self.chroma_server_url:
+                parsed = urlparse(self.chroma_server_url)
+                self.chroma_client = chromadb.HttpClient(host=parsed.hostname, port=parsed.port or 8000)
+                logger.info(f"Using Chroma server at {self.chroma_server_url}")
+            else:
+                if int(os.environ.get("API_WORKERS", "1")) > 1:
+                    logger.warning(f"Multiple API workers share {DEFAULT_CHROMA_PATH} through embedded clients; set CHROMA_SERVER_URL to avoid stale reads")
+                self.chroma_client = chromadb.PersistentClient(path=DEFAULT_CHROMA_PATH)
+                # Chroma creates its database with a rollback journal, where every write blocks all
+                # readers; in WAL mode searches keep reading while ingestion writes
+                try:
+                    connect_wal(os.path.join(DEFAULT_CHROMA_PATH, "chroma.sqlite3")).close()
+                except Exception as e:
+                    logger.warning(f"Could not switch the Chroma database to WAL mode: {str(e)}")
         
-        # Initialize Ollama embeddings
-        self.embeddings = OllamaEmbeddings(
-            model=embedding_model,
-            base_url=ollama_base_url
-        )
+        # The catalog records which vector store holds the collection and which model embedded it;
+        # an embedding-model migration switches both at once
+        catalog_path = collection_path(os.environ.get("DOCUMENT_CATALOG_PATH", DEFAULT_CATALOG_PATH), collection_name)
+        self.catalog = DocumentCatalog(catalog_path) if create or os.path.exists(catalog_path) else None
+        meta = self.catalog.get_meta() if self.catalog is not None else {}
+        self.store_name = meta.get("vector_store_name", collection_name)
+        self.vector_store = self._open_vector_store(self.store_name, create, hnsw)
+        if self.catalog is None:
+            self.catalog = DocumentCatalog(catalog_path)
+        self.embedding_model = meta.get("embedding_model", embedding_model)
+        if self.embedding_model != embedding_model:
+            logger.info(f"Collection {collection_name} is embedded with {self.embedding_model}; migrate it to switch models")
+        elif "embedding_model" not in meta:
+            self.catalog.set_meta({"embedding_model": embedding_model})
+        self._store_lock = threading.Lock()
+        
+        # Batched Ollama embedding client shared by ingestion and queries
+        self.embedding_client = get_embedding_client(self.embedding_model, ollama_base_url)
+        if shared is not None:
+            self.embedding_cache = shared.embedding_cache
+        else:
+            # Content-addressed cache so unchanged chunk text is never embedded twice
+            self.embedding_cache = EmbeddingCache(
+                path=os.environ.get("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024
+            )
+        
+        # Per-document index of the collection, backfilled once for stores that predate it
+        if not self.catalog.is_built():
+            self.catalog.rebuild(
+                (chunk_id, (metadata or {}).get("source", "unknown"), len((text or "").encode("utf-8")))
+                for chunk_id, metadata, text in self._scan_chunks()
+            )
+        
+        # BM25 index kept next to the vector store for exact-term matches
+        self.lexical_index = LexicalIndex(collection_path(os.environ.get("LEXICAL_INDEX_PATH", DEFAULT_LEXICAL_INDEX_PATH), collection_name))
+        if not self.lexical_index.is_built():
+            self.lexical_index.rebuild(self._scan_chunks())
         
-        # Get or create collection
-        self.collection = self._get_or_create_collection()
+        # Repeated and refined questions skip the whole search until the collection changes
+        self.result_cache = LRUCache(int(os.environ.get("RAG_RESULT_CACHE_SIZE", "256")), copy_values=True)
+        
+        if shared is not None:
+            self.context_packer = shared.context_packer
+            self.default_context_window = shared.default_context_window
+            self._context_windows = shared._context_windows
+            self.query_embedding_cache = shared.query_embedding_cache
+            self._search_executor = shared._search_executor
+        else:
+            # Fits retrieved passages into each model's context window
+            self.context_packer = ContextPacker(response_reserve=int(os.environ.get("RAG_RESPONSE_RESERVE", "1024")))
+            self.default_context_window = int(os.environ.get("RAG_CONTEXT_WINDOW", "4096"))
+            self._context_windows = {}
+            
+            # Repeated and refined questions skip the query embedding
+            self.query_embedding_cache = LRUCache(int(os.environ.get("RAG_QUERY_EMBEDDING_CACHE_SIZE", "1024")))
+            
+            # Runs the lexical and vector halves of a hybrid search side by side
+            self._search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-search")
         
         # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
+        self.text_splitter = make_text_splitter()
     
-    def _get_or_create_collection(self):
+    def _get_or_create_collection(self, name: str, create: bool = True, hnsw: Optional[dict] = None):
         """Get or create ChromaDB collection with Ollama embeddings"""
         try:
             # Try to get existing collection
             collection = self.chroma_client.get_collection(
-                name=self.collection_name
+                name=name
             )
-            logger.info(f"Using existing collection: {self.collection_name}")
+            logger.info(f"Using existing collection: {name}")
+            if hnsw:
+                logger.warning(f"Collection {name} already exists; HNSW settings are only applied at creation")
         except Exception:
-            # Create new collection with custom embedding function
-            embedding_function = embedding_functions.OllamaEmbeddingFunction(
-                url=f"{self.ollama_base_url}/api/embeddings",
-                model_name=self.embedding_model,
-            )
-            
+            if not create:
+                raise KeyError(self.collection_name)
+            # Create new collection. Vectors always come from the batched embedding
+            # client, so Chroma never embeds on its own.
             collection = self.chroma_client.create_collection(
-                name=self.collection_name,
-                embedding_function=embedding_function
+                name=name,
+                embedding_function=None,
+                metadata={f"hnsw:{key}": value for key, value in (hnsw or {}).items()} or None
             )
-            logger.info(f"Created new collection: {self.collection_name}")
+            logger.info(f"Created new collection: {name}")
         
         return collection
     
+    def _open_vector_store(self, store_name: str, create: bool = True, hnsw: Optional[dict] = None):
+        """
+        Open one of the collection's vector stores
+        
+        Args:
+            store_name: Chroma collection or mmap directory name (the collection name, or
+                "<collection>.<suffix>" for stores made by an embedding-model migration)
+            create: Create the store if it does not exist (KeyError otherwise)
+            hnsw: HNSW settings for a new Chroma collection
+        """
+        if self.vector_backend == "mmap":
+            # Memory-mapped matrix shared by all processes through the page cache; no server needed
+            store_path = os.path.join(os.environ.get("VECTOR_STORE_PATH", DEFAULT_VECTOR_STORE_PATH), store_name)
+            if not create and not os.path.isdir(store_path):
+                raise KeyError(self.collection_name)
+            vector_store = MmapVectorStore(
+                path=store_path,
+                dtype=os.environ.get("VECTOR_STORE_DTYPE", "float16"),
+                ivf_lists=int(os.environ.get("VECTOR_STORE_IVF_LISTS", "0")),
+                nprobe=int(os.environ.get("VECTOR_STORE_NPROBE", "8"))
+            )
+            logger.info(f"Using memory-mapped vector store at {vector_store.path}")
+            return vector_store
+        return ChromaVectorStore(self._get_or_create_collection(store_name, create, hnsw))
+    
+    def _drop_vector_store(self, store_name: str):
+        """Delete one of the collection's vector stores (never the active one)"""
+        if store_name == self.store_name:
+            raise ValueError(f"Refusing to drop the active vector store {store_name}")
+        if self.vector_backend == "mmap":
+            shutil.rmtree(os.path.join(os.environ.get("VECTOR_STORE_PATH", DEFAULT_VECTOR_STORE_PATH), store_name),
+                          ignore_errors=True)
+        else:
+            try:
+                self.chroma_client.delete_collection(store_name)
+            except Exception as e:
+                logger.warning(f"Could not delete collection {store_name}: {str(e)}")
+    
+    def hnsw_settings(self) -> Optional[dict]:
+        """HNSW settings of the active Chroma collection (None for the mmap backend)"""
+        if not isinstance(self.vector_store, ChromaVectorStore):
+            return None
+        metadata = self.vector_store.collection.metadata or {}
+        return {key[len("hnsw:"):]: value for key, value in metadata.items() if key.startswith("hnsw:")} or None
+    
+    def _sync_active_store(self):
+        """
+        Follow a vector store swap made by an embedding-model migration in any worker
+        
+        Reads the collection's catalog meta (one SQLite read); call before using
+        the vector store.
+        """
+        meta = self.catalog.get_meta()
+        store_name = meta.get("vector_store_name", self.collection_name)
+        if store_name == self.store_name:
+            return
+        with self._store_lock:
+            if store_name == self.store_name:
+                return
+            model = meta.get("embedding_model", self.embedding_model)
+            self.vector_store = self._open_vector_store(store_name, create=False)
+            self.embedding_model = model
+            self.embedding_client = get_embedding_client(model, self.ollama_base_url)
+            self.store_name = store_name
+            self.result_cache.clear()
+            logger.info(f"Collection {self.collection_name} now uses vector store {store_name} embedded with {model}")
+    
+    def _scan_chunks(self, page_size: int = 5000, vector_store=None) -> Iterator[Tuple[str, dict, str]]:
+        """Page through the whole collection (or the given store) yielding (chunk id, metadata, text)"""
+        vector_store = vector_store or self.vector_store
+        offset = 0
+        while True:
+            page = vector_store.list(limit=page_size, offset=offset)
+            if not page:
+                return
+            for chunk in page:
+                yield chunk["id"], chunk["metadata"], chunk["content"]
+            offset += len(page)
+    
+    def iter_pages(self, file_path: str, file_type: str = "pdf") -> Iterator[Document]:
+        """
+        Lazily load a document one page at a time
+        
+        Args:
+            file_path: Path of the file on disk
+            file_type: Type of file ('pdf', 'txt')
+            
+        Yields:
+            One LangChain Document per PDF page, or per segment of a text file
+        """
+        return iter_document_pages(file_path, file_type)
+    
+    def split_page(self, page: Document) -> List[Document]:
+        """Split one loaded page into chunks"""
+        return self.text_splitter.split_documents([page])
+    
+    def iter_chunks(self, file_path: str, file_type: str = "pdf") -> Iterator[Document]:
+        """Chunks of a document, produced one page at a time"""
+        for page in self.iter_pages(file_path, file_type):
+            yield from self.split_page(page)
+    
+    def embed_chunks(self, texts: List[str], model: Optional[str] = None) -> Tuple[List[List[float]], int]:
+        """
+        Embed chunk texts, reusing cached vectors for text embedded before
+        
+        Args:
+            texts: Chunk texts
+            model: Embedding model (the collection's if omitted); pass the same one to upsert_chunks
+        
+        Returns:
+            (embeddings in input order, number of texts served from the cache)
+        """
+        model = model or self.embedding_model
+        embeddings = self.embedding_cache.get_many(model, texts)
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        
+        if missing:
+            # Embed each distinct missing text once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = dict(zip(missing_texts, get_embedding_client(model, self.ollama_base_url).embed(missing_texts)))
+            self.embedding_cache.put_many(model, missing_texts, [fresh[text] for text in missing_texts])
+            for i in missing:
+                embeddings[i] = fresh[texts[i]]
+        
+        return embeddings, len(texts) - len(missing)
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of chunk texts with the collection's embedding model"""
+        return self.embed_chunks(texts)[0]
+    
+    @property
+    def _writer_lock_name(self) -> str:
+        """Writes to different collections do not block each other"""
+        return "vector_store" if self.collection_name == DEFAULT_COLLECTION else f"vector_store.{self.collection_name}"
+    
+    def collection_version(self) -> int:
+        """Counter bumped on every write to the collection, shared by all workers"""
+        return get_shared_state().cache_get(f"rag_collection_version:{self.collection_name}") or 0
+    
+    def _bump_collection_version(self):
+        """Invalidate cached search results of every worker; call after writing to the collection"""
+        get_shared_state().cache_incr(f"rag_collection_version:{self.collection_name}")
+    
+    def upsert_chunks(self, ids: List[str], texts: List[str], metadatas: List[dict],
+                      embeddings: Optional[List[List[float]]] = None, embedding_model: Optional[str] = None):
+        """
+        Write a batch of chunks to the collection (one writer at a time across workers)
+        
+        Args:
+            ids, texts, metadatas: Chunks to store
+            embeddings: Their vectors (embedded here if omitted)
+            embedding_model: Model the vectors come from; if a migration switched the
+                collection to another model since, the chunks are re-embedded
+        """
+        with get_shared_state().writer_lock(self._writer_lock_name):
+            self._sync_active_store()
+            if embeddings is None or (embedding_model is not None and embedding_model != self.embedding_model):
+                embeddings = self.embed_texts(texts)
+            self.vector_store.upsert(ids, embeddings, texts, metadatas)
+            self.lexical_index.upsert(ids, texts, metadatas)
+            self._bump_collection_version()
+    
+    def get_document_chunks(self, filename: str) -> Dict[str, dict]:
+        """Stored chunk id -> metadata for one source document"""
+        chunk_ids = self.catalog.get_chunk_ids(filename)
+        if not chunk_ids:
+            return {}
+        self._sync_active_store()
+        return {chunk["id"]: chunk["metadata"] for chunk in self.vector_store.get(chunk_ids)}
+    
+    def plan_document(self, filename: str) -> DocumentIndexPlan:
+        """Start diffing a (re-)upload of filename against its stored chunks"""
+        document = self.catalog.get_document(filename)
+        return DocumentIndexPlan(filename, self.get_document_chunks(filename),
+                                 document["ingested_at"] if document else None)
+    
+    def finish_document(self, plan: DocumentIndexPlan, content_hash: Optional[str] = None,
+                        file_type: Optional[str] = None) -> int:
+        """
+        Apply the rest of a plan once all new chunks are stored: move reused
+        chunks' position metadata, delete chunks that vanished and update the catalog
+        
+        Args:
+            plan: Plan filled with every chunk of the new version
+            content_hash: sha256 of the uploaded file, recorded in the catalog
+            file_type: Type of file ('pdf', 'txt')
+            
+        Returns:
+            Number of deleted chunks
+        """
+        vanished = plan.vanished_ids()
+        with get_shared_state().writer_lock(self._writer_lock_name):
+            self._sync_active_store()
+            if plan.metadata_updates:
+                self.vector_store.update_metadata(list(plan.metadata_updates), list(plan.metadata_updates.values()))
+                self.lexical_index.update_metadata(list(plan.metadata_updates), list(plan.metadata_updates.values()))
+            if vanished:
+                self.vector_store.delete(vanished)
+                self.lexical_index.delete(vanished)
+            self.catalog.record_document(plan.filename, plan.chunk_bytes, content_hash, file_type)
+            if plan.metadata_updates or vanished:
+                self._bump_collection_version()
+        return len(vanished)
+    
     def add_document(self, file_content: bytes, filename: str, file_type: str = "pdf") -> bool:
         """
-        Add a document to the vector database
+        Add a document to the vector database synchronously
+        
+        The API ingests uploads through the background pipeline in ingestion.py;
+        this is the blocking equivalent for scripts.
         
         Args:
             file_content: Raw file content as bytes
@@ -83,115 +563,322 @@ class RAGManager:
         Returns:
             bool: Success status
         """
+        tmp_file_path = None
         try:
             # Save file temporarily
             with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
                 tmp_file.write(file_content)
                 tmp_file_path = tmp_file.name
             
-            # Load document based on type
-            if file_type.lower() == "pdf":
-                loader = PyPDFLoader(tmp_file_path)
-            else:
-                loader = TextLoader(tmp_file_path, encoding="utf-8")
-            
-            documents = loader.load()
-            
-            # Split documents into chunks
-            chunks = self.text_splitter.split_documents(documents)
-            
-            # Prepare data for ChromaDB
-            texts = [chunk.page_content for chunk in chunks]
-            metadatas = [
-                {
-                    "source": filename,
-                    "chunk_id": i,
-                    "page": chunk.metadata.get("page", 0)
-                }
-                for i, chunk in enumerate(chunks)
-            ]
-            ids = [f"{filename}_{i}" for i in range(len(chunks))]
+            return self.add_document_file(tmp_file_path, filename, file_type, hashlib.sha256(file_content).hexdigest())
+        finally:
+            # Clean up temporary file
+            if tmp_file_path and os.path.exists(tmp_file_path):
+                os.unlink(tmp_file_path)
+    
+    def add_document_file(self, file_path: str, filename: str, file_type: str = "pdf",
+                          content_hash: Optional[str] = None, batch_size: int = 64) -> bool:
+        """
+        Index a document from disk synchronously, with memory bounded by one page and one batch
+        
+        Args:
+            file_path: Path of the file on disk
+            filename: Source name the chunks are stored under
+            file_type: Type of file ('pdf', 'txt')
+            content_hash: sha256 of the file (computed by streaming the file if omitted)
+            batch_size: Chunks embedded and stored per batch
             
-            # Add to collection
-            self.collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+        Returns:
+            bool: Success status
+        """
+        try:
+            if content_hash is None:
+                content_hash = file_sha256(file_path)
             
-            # Clean up temporary file
-            os.unlink(tmp_file_path)
+            # Split page by page, embedding and storing new chunks one batch at a time
+            plan = self.plan_document(filename)
+            stored = 0
+            batch = []
+            for chunk in self.iter_chunks(file_path, file_type):
+                record = plan.add_chunk(chunk.page_content, chunk.metadata.get("page", 0))
+                if record is not None:
+                    batch.append(record)
+                if len(batch) >= batch_size:
+                    stored += self._store_batch(batch)
+                    batch = []
+            if batch:
+                stored += self._store_batch(batch)
+            deleted = self.finish_document(plan, content_hash, file_type)
             
-            logger.info(f"Successfully added {len(chunks)} chunks from {filename}")
+            logger.info(f"Successfully indexed {filename}: {stored} new chunks, "
+                        f"{plan.reused} reused, {deleted} deleted")
             return True
             
         except Exception as e:
             logger.error(f"Error adding document {filename}: {str(e)}")
             return False
     
-    def search_documents(self, query: str, n_results: int = 5) -> List[dict]:
+    def _store_batch(self, batch: List[Tuple[str, str, dict]]) -> int:
+        """Embed and upsert (chunk id, text, metadata) records; returns the number stored"""
+        texts = [text for _, text, _ in batch]
+        model = self.embedding_model
+        self.upsert_chunks(
+            [chunk_id for chunk_id, _, _ in batch],
+            texts,
+            [metadata for _, _, metadata in batch],
+            self.embed_chunks(texts, model)[0],
+            model
+        )
+        return len(batch)
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a search query, reusing the vector of a recently seen identical query"""
+        key = (self.embedding_model, query)
+        query_embedding = self.query_embedding_cache.get(key)
+        if query_embedding is None:
+            query_embedding = self.embedding_client.embed_query(query)
+            self.query_embedding_cache.put(key, query_embedding)
+        return query_embedding
+    
+    def _vector_search(self, query: str, n_results: int, where: Optional[dict] = None) -> Tuple[List[dict], dict]:
+        """Dense search; returns ranked chunks and embed/query timings"""
+        started_at = time.perf_counter()
+        query_embedding = self.embed_query(query)
+        embedded_at = time.perf_counter()
+        ranked = self.vector_store.query(query_embedding, n_results, where)
+        finished_at = time.perf_counter()
+        
+        return ranked, {
+            "embed_ms": round((embedded_at - started_at) * 1000, 2),
+            "vector_ms": round((finished_at - embedded_at) * 1000, 2)
+        }
+    
+    def _lexical_search(self, query: str, n_results: int, where: Optional[dict] = None) -> Tuple[List[dict], dict]:
+        """BM25 search; returns ranked chunks and its timing"""
+        started_at = time.perf_counter()
+        ranked = self.lexical_index.search(query, n_results, where)
+        return ranked, {"lexical_ms": round((time.perf_counter() - started_at) * 1000, 2)}
+    
+    def retrieve(self, query: str, candidates: int, vector_weight: float = 1.0, lexical_weight: float = 1.0,
+                 where: Optional[dict] = None) -> Tuple[List[dict], List[dict], dict, dict]:
+        """
+        Run the dense and BM25 retrievers in parallel, without fusing them
+        
+        A failing retriever degrades the search to the other one instead of
+        failing it; only when every enabled retriever fails is an error raised.
+        
+        Args:
+            query: Search query
+            candidates: Results taken from each retriever
+            vector_weight: 0 skips the dense retriever
+            lexical_weight: 0 skips the BM25 retriever
+            where: Metadata filter applied inside both retrievers
+            
+        Returns:
+            (vector results by distance, lexical results by BM25 score, timings_ms, errors per retriever)
+        """
+        vector_future = self._search_executor.submit(self._vector_search, query, candidates, where) if vector_weight > 0 else None
+        lexical_future = self._search_executor.submit(self._lexical_search, query, candidates, where) if lexical_weight > 0 else None
+        
+        timings = {}
+        errors = {}
+        vector_results, lexical_results = [], []
+        if vector_future is not None:
+            try:
+                vector_results, vector_timings = vector_future.result()
+                timings.update(vector_timings)
+            except Exception as e:
+                errors["vector"] = str(e)
+        if lexical_future is not None:
+            try:
+                lexical_results, lexical_timings = lexical_future.result()
+                timings.update(lexical_timings)
+            except Exception as e:
+                errors["lexical"] = str(e)
+        if errors:
+            if len(errors) == (vector_future is not None) + (lexical_future is not None):
+                raise RuntimeError(f"All retrievers failed: {errors}")
+            logger.warning(f"Hybrid search degraded: {errors}")
+        return vector_results, lexical_results, timings, errors
+    
+    def hybrid_search(self, query: str, n_results: int = 5, vector_weight: float = 1.0,
+                      lexical_weight: float = 1.0, candidates: Optional[int] = None,
+                      mmr_lambda: Optional[float] = 0.7, merge_adjacent: bool = True,
+                      where: Optional[dict] = None) -> dict:
+        """
+        Search with dense vectors and BM25 in parallel and fuse the rankings
+        
+        The fused candidates are then diversified with MMR on their stored
+        embeddings, and neighbouring chunks of one source are merged with
+        their overlapping text removed, so the returned passages do not
+        spend context on the same text twice.
+        
+        Results are cached per collection version: a repeated search is
+        answered from memory until a document is added, updated or deleted.
+        
+        Args:
+            query: Search query
+            n_results: Number of results to return
+            vector_weight: Weight of the vector ranking in reciprocal-rank fusion (0 disables it)
+            lexical_weight: Weight of the BM25 ranking in reciprocal-rank fusion (0 disables it)
+            candidates: Results taken from each retriever before fusion (default 4x n_results, at least 20)
+            mmr_lambda: MMR relevance/diversity trade-off (None or 1.0 disables diversification)
+            merge_adjacent: Merge consecutive chunks of the same source
+            where: Metadata filter (see build_where) applied inside both retrievers, so
+                candidates are drawn from the matching chunks only
+            
+        Returns:
+            Dict with "results" (chunks with content, metadata, distance, score and per-retriever
+            ranks), "timings_ms" per stage, "errors" of retrievers that failed and
+            whether the results were "cached"
+        """
+        started_at = time.perf_counter()
+        candidates = candidates or max(20, n_results * 4)
+        self._sync_active_store()
+        
+        cache_key = (self.collection_version(), query, n_results, vector_weight, lexical_weight,
+                     candidates, mmr_lambda, merge_adjacent, json.dumps(where, sort_keys=True) if where else None)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return {
+                "results": cached,
+                "timings_ms": {"total_ms": round((time.perf_counter() - started_at) * 1000, 2)},
+                "errors": {},
+                "cached": True
+            }
+        
+        vector_results, lexical_results, timings, errors = self.retrieve(query, candidates, vector_weight, lexical_weight, where)
+        retrieved_at = time.perf_counter()
+        
+        chunks = {}
+        vector_ranks = {}
+        lexical_ranks = {}
+        for rank, result in enumerate(vector_results, start=1):
+            chunks[result['id']] = result
+            vector_ranks[result['id']] = rank
+        for rank, result in enumerate(lexical_results, start=1):
+            chunks.setdefault(result['id'], {**result, 'distance': None})
+            lexical_ranks[result['id']] = rank
+        
+        diversifying = mmr_lambda is not None and mmr_lambda < 1.0
+        fused = reciprocal_rank_fusion([
+            (vector_weight, [result['id'] for result in vector_results]),
+            (lexical_weight, [result['id'] for result in lexical_results])
+        ])[:candidates if diversifying else n_results]
+        
+        results = [
+            {
+                'content': chunks[chunk_id]['content'],
+                'metadata': chunks[chunk_id]['metadata'],
+                'distance': chunks[chunk_id].get('distance'),
+                'score': round(score, 6),
+                'vector_rank': vector_ranks.get(chunk_id),
+                'lexical_rank': lexical_ranks.get(chunk_id)
+            }
+            for chunk_id, score in fused
+        ]
+        fused_at = time.perf_counter()
+        timings["fusion_ms"] = round((fused_at - retrieved_at) * 1000, 2)
+        
+        embeddings = None
+        if diversifying and len(results) > n_results:
+            embeddings = self._get_embeddings([chunk_id for chunk_id, _ in fused])
+        results = diversify(results, embeddings, n_results, mmr_lambda, merge_adjacent)
+        finished_at = time.perf_counter()
+        
+        timings["diversify_ms"] = round((finished_at - fused_at) * 1000, 2)
+        timings["total_ms"] = round((finished_at - started_at) * 1000, 2)
+        
+        # A degraded search is not cached, so the next one retries the failed retriever
+        if not errors:
+            self.result_cache.put(cache_key, results)
+        return {"results": results, "timings_ms": timings, "errors": errors, "cached": False}
+    
+    def _get_embeddings(self, chunk_ids: List[str]):
+        """Stored embeddings for chunk ids, as a matrix aligned with chunk_ids (None if any is missing)"""
+        by_id = {chunk["id"]: chunk["embedding"] for chunk in self.vector_store.get(chunk_ids, include_embeddings=True)}
+        if len(by_id) != len(chunk_ids):
+            return None
+        return np.asarray([by_id[chunk_id] for chunk_id in chunk_ids], dtype=np.float32)
+    
+    def search_documents(self, query: str, n_results: int = 5, vector_weight: float = 1.0,
+                         lexical_weight: float = 1.0, where: Optional[dict] = None) -> List[dict]:
         """
         Search for relevant documents
         
         Args:
             query: Search query
             n_results: Number of results to return
+            vector_weight: Weight of dense retrieval in the fused ranking
+            lexical_weight: Weight of BM25 retrieval in the fused ranking
+            where: Metadata filter, e.g. build_where(sources=["manual.pdf"], page_min=10)
             
         Returns:
             List of relevant document chunks with metadata
         """
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
-            
-            # Format results
-            formatted_results = []
-            if results['documents'] and results['documents'][0]:
-                for i, doc in enumerate(results['documents'][0]):
-                    formatted_results.append({
-                        'content': doc,
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'distance': results['distances'][0][i] if results['distances'] else None
-                    })
-            
-            return formatted_results
+            return self.hybrid_search(query, n_results, vector_weight, lexical_weight, where=where)["results"]
             
         except Exception as e:
             logger.error(f"Error searching documents: {str(e)}")
             return []
     
-    def generate_rag_response(self, query: str, model: str) -> str:
+    def get_context_window(self, model: str) -> int:
         """
-        Generate RAG response by combining retrieved context with LLM
+        Context size in tokens the model runs with
+        
+        Ollama serves every model with its configured context length
+        (RAG_CONTEXT_WINDOW should match OLLAMA_CONTEXT_LENGTH); models
+        trained on a shorter context are capped at their own length.
+        """
+        if model not in self._context_windows:
+            trained_length = None
+            try:
+                response = requests.post(f"{self.ollama_base_url}/api/show", json={"model": model}, timeout=10)
+                if response.status_code == 200:
+                    model_info = response.json().get("model_info", {})
+                    trained_length = next(
+                        (value for key, value in model_info.items() if key.endswith(".context_length")), None
+                    )
+            except Exception as e:
+                logger.warning(f"Could not read context length of {model}: {str(e)}")
+            self._context_windows[model] = min(trained_length or self.default_context_window, self.default_context_window)
+        return self._context_windows[model]
+    
+    def build_rag_prompt(self, query: str, model: str, passages: List[dict]) -> Tuple[str, List[dict], dict]:
+        """
+        Pack retrieved passages into a RAG prompt within the model's token budget
+        
+        Returns:
+            (prompt, passages included in the prompt, token usage report)
+        """
+        return self.context_packer.pack(query, passages, self.get_context_window(model))
+    
+    def answer_query(self, query: str, model: str, sources: Optional[List[dict]] = None) -> dict:
+        """
+        Generate a RAG answer from retrieved passages
         
         Args:
             query: User query
             model: Ollama model to use for generation
+            sources: Passages already retrieved for the query, most relevant first (searched if omitted)
             
         Returns:
-            Generated response
+            Dict with "response", "sources" (passages that made it into the prompt) and "context" (token usage)
         """
         try:
-            # Retrieve relevant documents
-            relevant_docs = self.search_documents(query, n_results=3)
-            
-            if not relevant_docs:
-                return "I couldn't find any relevant information in the knowledge base to answer your question."
+            # Retrieve relevant documents; over-fetch and let the packer fill the budget
+            if sources is None:
+                sources = self.search_documents(query, n_results=8)
             
-            # Build context from retrieved documents
-            context = "\n\n".join([doc['content'] for doc in relevant_docs])
+            if not sources:
+                return {
+                    "response": NO_CONTEXT_ANSWER,
+                    "sources": [],
+                    "context": None
+                }
             
-            # Create RAG prompt
-            rag_prompt = f"""Use the following context to answer the question. If the answer cannot be found in the context, say "I don't have enough information to answer this question."
-
-Context:
-{context}
-
-Question: {query}
-
-Answer:"""
+            rag_prompt, included, context_report = self.build_rag_prompt(query, model, sources)
 
             # Generate response using Ollama
             response = requests.post(
@@ -205,83 +892,301 @@ Answer:"""
             
             if response.status_code == 200:
                 result = response.json()
-                return result.get('response', 'Sorry, I could not generate a response.')
+                context_report["prompt_eval_count"] = result.get("prompt_eval_count")
+                return {
+                    "response": result.get('response', 'Sorry, I could not generate a response.'),
+                    "sources": included,
+                    "context": context_report
+                }
             else:
                 logger.error(f"Ollama API error: {response.status_code}")
-                return "Sorry, there was an error generating the response."
+                return {"response": "Sorry, there was an error generating the response.", "sources": included, "context": context_report}
                 
         except Exception as e:
             logger.error(f"Error generating RAG response: {str(e)}")
-            return "Sorry, there was an error processing your request."
+            return {"response": "Sorry, there was an error processing your request.", "sources": sources or [], "context": None}
+    
+    def generate_rag_response(self, query: str, model: str) -> str:
+        """
+        Generate RAG response by combining retrieved context with LLM
+        
+        Args:
+            query: User query
+            model: Ollama model to use for generation
+            
+        Returns:
+            Generated response
+        """
+        return self.answer_query(query, model)["response"]
     
     def list_documents(self) -> List[dict]:
-        """List all documents in the collection"""
+        """List all documents in the collection (from the catalog, without touching chunks)"""
         try:
-            result = self.collection.get()
-            
-            # Group by source document
-            documents = {}
-            for i, metadata in enumerate(result['metadatas']):
-                source = metadata.get('source', 'unknown')
-                if source not in documents:
-                    documents[source] = {
-                        'source': source,
-                        'chunk_count': 0
-                    }
-                documents[source]['chunk_count'] += 1
-            
-            return list(documents.values())
+            return self.catalog.list_documents()
             
         except Exception as e:
             logger.error(f"Error listing documents: {str(e)}")
             return []
     
     def delete_document(self, filename: str) -> bool:
-        """Delete all chunks from a specific document"""
+        """
+        Delete all chunks from a specific document
+        
+        The stores are cleaned up even when the catalog has no entry for the
+        document, so chunks left by an ingestion that failed partway (and was
+        never recorded) can still be removed.
+        
+        Returns:
+            bool: Whether anything was deleted
+        """
         try:
-            # Get all items with the specific source
-            result = self.collection.get()
-            ids_to_delete = []
-            
-            for i, metadata in enumerate(result['metadatas']):
-                if metadata.get('source') == filename:
-                    ids_to_delete.append(result['ids'][i])
-            
-            if ids_to_delete:
-                self.collection.delete(ids=ids_to_delete)
-                logger.info(f"Deleted {len(ids_to_delete)} chunks from {filename}")
-                return True
+            # Filtered delete in the store; no need to read any chunks first
+            with get_shared_state().writer_lock(self._writer_lock_name):
+                self._sync_active_store()
+                vector_chunks = self.vector_store.delete_where({"source": filename})
+                lexical_chunks = self.lexical_index.delete_source(filename)
+                document = self.catalog.remove_document(filename)
+                if not (vector_chunks or lexical_chunks or document):
+                    logger.warning(f"No chunks found for {filename}")
+                    return False
+                self._bump_collection_version()
+            if document is None:
+                logger.info(f"Deleted {vector_chunks} uncatalogued chunks from {filename}")
             else:
-                logger.warning(f"No chunks found for {filename}")
-                return False
+                logger.info(f"Deleted {document['chunk_count']} chunks from {filename}")
+            return True
                 
         except Exception as e:
             logger.error(f"Error deleting document {filename}: {str(e)}")
             return False
     
-    def check_embedding_model_available(self) -> bool:
-        """Check if the embedding model is available in Ollama"""
+    def check_embedding_model_available(self, embedding_model: Optional[str] = None) -> bool:
+        """Check if the embedding model (the collection's by default) is available in Ollama"""
+        embedding_model = embedding_model or self.embedding_model
         try:
-            response = requests.get(f"{self.ollama_base_url}/api/tags")
+            response = requests.get(f"{self.ollama_base_url}/api/tags", timeout=5)
             if response.status_code == 200:
                 models = response.json()
                 available_models = [model['name'] for model in models.get('models', [])]
                 
                 # Check for exact match or with :latest tag
-                return (self.embedding_model in available_models or 
-                        f"{self.embedding_model}:latest" in available_models or
-                        any(model.startswith(f"{self.embedding_model}:") for model in available_models))
+                return (embedding_model in available_models or 
+                        f"{embedding_model}:latest" in available_models or
+                        any(model.startswith(f"{embedding_model}:") for model in available_models))
             return False
         except Exception as e:
             logger.error(f"Error checking embedding model: {str(e)}")
             return False
 
-# Global RAG manager instance
-rag_manager = None
+# RAG manager instances, one per collection
+rag_managers = {}
+rag_managers_lock = threading.Lock()
+
+# Batched embedding clients, one per (model, Ollama URL), shared by all collections of the process
+embedding_clients = {}
+embedding_clients_lock = threading.Lock()
+
+def get_embedding_client(model: str, ollama_base_url: str = "http://localhost:11434") -> OllamaEmbeddingClient:
+    """Get or create the process-wide embedding client of a model"""
+    with embedding_clients_lock:
+        key = (model, ollama_base_url)
+        if key not in embedding_clients:
+            embedding_clients[key] = OllamaEmbeddingClient(
+                base_url=ollama_base_url,
+                model=model,
+                batch_size=int(os.environ.get("EMBED_BATCH_SIZE", "64")),
+                max_concurrency=int(os.environ.get("EMBED_CONCURRENCY", "4"))
+            )
+        return embedding_clients[key]
+
+# Fans a query out to several collections at once
+_fanout_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rag-fanout")
+
+def get_rag_manager(collection_name: Optional[str] = None, create: bool = True,
+                    hnsw: Optional[dict] = None) -> RAGManager:
+    """
+    Get or create the RAG manager of a collection
+    
+    Args:
+        collection_name: Collection (namespace) name; the default collection if omitted
+        create: Create the collection if it does not exist (KeyError otherwise)
+        hnsw: HNSW settings applied if the collection is created now
+    """
+    collection_name = collection_name or DEFAULT_COLLECTION
+    with rag_managers_lock:
+        if collection_name not in rag_managers:
+            settings = dict(
+                embedding_model=os.environ.get("EMBEDDING_MODEL", "nomic-embed-text"),
+                ollama_base_url=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+            )
+            default = rag_managers.get(DEFAULT_COLLECTION)
+            if default is None and collection_name != DEFAULT_COLLECTION:
+                default = rag_managers[DEFAULT_COLLECTION] = RAGManager(DEFAULT_COLLECTION, **settings)
+            rag_managers[collection_name] = RAGManager(collection_name, create=create, hnsw=hnsw, shared=default, **settings)
+        return rag_managers[collection_name]
+
+def embedding_models_in_use() -> set:
+    """Embedding models of the collections opened in this process, plus the configured default"""
+    with rag_managers_lock:
+        models = {manager.embedding_model for manager in rag_managers.values()}
+    models.add(os.environ.get("EMBEDDING_MODEL", "nomic-embed-text"))
+    return models
+
+def list_collections() -> List[str]:
+    """Names of all collections in the vector store"""
+    default = get_rag_manager()
+    if default.vector_backend == "mmap":
+        root = os.path.dirname(default.vector_store.path)
+        names = [name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))]
+    else:
+        names = [collection.name for collection in default.chroma_client.list_collections()]
+    # Stores made by embedding-model migrations are named "<collection>.<suffix>"
+    return sorted({name.split(".", 1)[0] for name in names} | {DEFAULT_COLLECTION})
 
-def get_rag_manager() -> RAGManager:
-    """Get or create global RAG manager instance"""
-    global rag_manager
-    if rag_manager is None:
-        rag_manager = RAGManager()
-    return rag_manager 
\ No newline at end of file
+def search_collections(collection_names: List[str], query: str, n_results: int = 5, vector_weight: float = 1.0,
+                       lexical_weight: float = 1.0, candidates: Optional[int] = None,
+                       mmr_lambda: Optional[float] = 0.7, merge_adjacent: bool = True,
+                       where: Optional[dict] = None) -> dict:
+    """
+    Hybrid search over several collections, fused once across all of them
+    
+    Each collection keeps its own small index and is searched in parallel,
+    but the rankings are fused globally: vector candidates of every
+    collection sharing an embedding model form one list ordered by distance
+    (the query embedding is the same), and all BM25 candidates form one list
+    ordered by score. A chunk's fused score is normalized by the weight of
+    the retrievers its collection could answer with, so a collection that
+    fell back to lexical search is not ranked below the others by
+    construction. Results carry the "collection" they came from.
+    
+    Args:
+        collection_names: Collections to search
+        query: Search query
+        n_results, vector_weight, lexical_weight, candidates, mmr_lambda, merge_adjacent, where:
+            As for RAGManager.hybrid_search
+    
+    Returns:
+        Dict like RAGManager.hybrid_search, with "timings_ms" and "errors" per collection
+    """
+    started_at = time.perf_counter()
+    candidates = candidates or max(20, n_results * 4)
+    managers = {name: get_rag_manager(name, create=False) for name in dict.fromkeys(collection_names)}
+    
+    # Embed once per embedding model up front; every collection then finds the vector in the shared query cache.
+    # Collections whose model cannot embed the query fall back to lexical search instead of
+    # retrying the embedding one by one.
+    errors = {}
+    embedding_errors = {}
+    if vector_weight > 0:
+        for model, manager in {manager.embedding_model: manager for manager in managers.values()}.items():
+            try:
+                manager.embed_query(query)
+            except Exception as e:
+                logger.warning(f"Could not embed the query with {model}; searching lexically only: {str(e)}")
+                embedding_errors[model] = str(e)
+    
+    where_key = json.dumps(where, sort_keys=True) if where else None
+    
+    def retrieve(manager: "RAGManager", collection_vector_weight: float):
+        retrieve_started_at = time.perf_counter()
+        manager._sync_active_store()
+        cache_key = ("retrieve", manager.collection_version(), query, candidates, collection_vector_weight, lexical_weight, where_key)
+        retrieved = manager.result_cache.get(cache_key)
+        was_cached = retrieved is not None
+        if not was_cached:
+            retrieved = manager.retrieve(query, candidates, collection_vector_weight, lexical_weight, where)
+            # A degraded retrieval is not cached, so the next search retries the failed retriever
+            if not retrieved[3]:
+                manager.result_cache.put(cache_key, retrieved)
+        return retrieved, was_cached, round((time.perf_counter() - retrieve_started_at) * 1000, 2)
+    
+    futures = {}
+    for name, manager in managers.items():
+        collection_vector_weight = vector_weight
+        if manager.embedding_model in embedding_errors and lexical_weight > 0:
+            collection_vector_weight = 0.0
+            errors[name] = {"vector": embedding_errors[manager.embedding_model]}
+        futures[name] = _fanout_executor.submit(retrieve, manager, collection_vector_weight)
+    
+    vector_lists = {}
+    lexical_list = []
+    chunks = {}
+    available_weight = {}
+    timings = {}
+    cached = True
+    for name, future in futures.items():
+        try:
+            (vector_results, lexical_results, _, retrieval_errors), was_cached, timings[name] = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+            continue
+        if retrieval_errors:
+            # Degraded but answered (e.g. lexical hits while embedding is down)
+            errors[name] = {**errors.get(name, {}), **retrieval_errors}
+        cached = cached and was_cached
+        
+        model = managers[name].embedding_model
+        answered_weight = 0.0
+        if vector_weight > 0 and model not in embedding_errors and "vector" not in retrieval_errors:
+            answered_weight += vector_weight
+        if lexical_weight > 0 and "lexical" not in retrieval_errors:
+            answered_weight += lexical_weight
+        available_weight[name] = answered_weight
+        
+        for result in vector_results:
+            key = (name, result["id"])
+            chunks[key] = result
+            vector_lists.setdefault(model, []).append((result["distance"], key))
+        for result in lexical_results:
+            key = (name, result["id"])
+            chunks.setdefault(key, {**result, "distance": None})
+            lexical_list.append((result["score"], key))
+    if not available_weight:
+        raise RuntimeError(f"Search failed in every collection: {errors}")
+    retrieved_at = time.perf_counter()
+    
+    ranked_lists = [
+        (vector_weight, [key for _, key in sorted(ranked, key=lambda item: item[0])])
+        for ranked in vector_lists.values()
+    ]
+    ranked_lists.append((lexical_weight, [key for _, key in sorted(lexical_list, key=lambda item: item[0], reverse=True)]))
+    vector_ranks = {key: rank for _, keys in ranked_lists[:-1] for rank, key in enumerate(keys, start=1)}
+    lexical_ranks = {key: rank for rank, key in enumerate(ranked_lists[-1][1], start=1)}
+    
+    full_weight = max(vector_weight, 0.0) + max(lexical_weight, 0.0)
+    fused = sorted(
+        (
+            (key, score * full_weight / available_weight[key[0]])
+            for key, score in reciprocal_rank_fusion(ranked_lists)
+        ),
+        key=lambda item: item[1],
+        reverse=True
+    )
+    diversifying = mmr_lambda is not None and mmr_lambda < 1.0
+    fused = fused[:candidates if diversifying else n_results]
+    
+    # MMR and adjacent-chunk merging need one embedding space and one source, so they run per collection
+    grouped = {}
+    for key, score in fused:
+        chunk = chunks[key]
+        grouped.setdefault(key[0], []).append((key[1], {
+            'content': chunk['content'],
+            'metadata': chunk['metadata'],
+            'distance': chunk.get('distance'),
+            'score': round(score, 6),
+            'vector_rank': vector_ranks.get(key),
+            'lexical_rank': lexical_ranks.get(key),
+            'collection': key[0]
+        }))
+    merged = []
+    for name, group in grouped.items():
+        embeddings = None
+        if diversifying and len(group) > n_results:
+            embeddings = managers[name]._get_embeddings([chunk_id for chunk_id, _ in group])
+        merged += diversify([result for _, result in group], embeddings, n_results, mmr_lambda, merge_adjacent)
+    merged.sort(key=lambda result: result["score"], reverse=True)
+    
+    finished_at = time.perf_counter()
+    timings["fusion_ms"] = round((finished_at - retrieved_at) * 1000, 2)
+    timings["total_ms"] = round((finished_at - started_at) * 1000, 2)
+    return {"results": merged[:n_results], "timings_ms": timings, "errors": errors, "cached": cached}
@@ -0,0 +1,150 @@
+import logging
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def mmr_select(relevance: np.ndarray, embeddings: np.ndarray, k: int, lambda_mult: float = 0.7) -> List[int]:
+    """
+    Maximal marginal relevance selection
+
+    Greedily picks the candidate maximizing
+    lambda * relevance - (1 - lambda) * max cosine similarity to the picks so far,
+    so near-duplicates of an already chosen chunk (e.g. its overlapping
+    neighbour) lose to slightly less relevant but new content.
+
+    Args:
+        relevance: Relevance per candidate, best around 1.0 (any scale works, it is max-normalized)
+        embeddings: Candidate embeddings, one row per candidate
+        k: Number of candidates to pick
+        lambda_mult: 1.0 ranks by relevance only, 0.0 by diversity only
+
+    Returns:
+        Indices of the picked candidates in pick order
+    """
+    count = len(relevance)
+    if count == 0 or k <= 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    relevance = relevance / (relevance.max() or 1.0)
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    similarity = vectors @ vectors.T
+
+    selected = []
+    max_similarity = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    for _ in range(min(k, count)):
+        penalty = np.where(np.isinf(max_similarity), 0.0, max_similarity)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[:, best])
+
+    return selected
+
+
+def strip_overlap(previous: str, following: str, max_overlap: int = 400, min_overlap: int = 20) -> str:
+    """
+    Remove the start of following that repeats the end of previous
+
+    The text splitter repeats up to chunk_overlap characters of a chunk at
+    the start of the next one; this finds the longest such repeat.
+    """
+    limit = min(max_overlap, len(previous), len(following))
+    for size in range(limit, min_overlap - 1, -1):
+        if previous.endswith(following[:size]):
+            return following[size:]
+    return following
+
+
+def merge_adjacent_chunks(results: List[dict], max_overlap: int = 400) -> List[dict]:
+    """
+    Merge results that are consecutive chunks of the same source into one passage
+
+    Results keep the rank of their best member; merged text has the
+    overlap between neighbours removed. Metadata of a merged passage is the
+    first chunk's, with "chunk_ids" listing every merged chunk position.
+    """
+    groups = {}
+    order = []
+    for rank, result in enumerate(results):
+        metadata = result.get('metadata') or {}
+        position = metadata.get('chunk_id')
+        key = metadata.get('source')
+        if key is None or not isinstance(position, int):
+            order.append([(rank, result)])
+            continue
+        groups.setdefault(key, []).append((position, rank, result))
+
+    for members in groups.values():
+        members.sort(key=lambda member: member[0])
+        run = [members[0]]
+        for member in members[1:]:
+            if member[0] == run[-1][0] + 1:
+                run.append(member)
+            else:
+                order.append([(rank, result) for _, rank, result in run])
+                run = [member]
+        order.append([(rank, result) for _, rank, result in run])
+
+    merged = []
+    for run in order:
+        best_rank, best = min(run, key=lambda member: member[0])
+        if len(run) == 1:
+            merged.append((best_rank, best))
+            continue
+
+        content = run[0][1]['content']
+        for _, result in run[1:]:
+            content += strip_overlap(content, result['content'], max_overlap)
+        merged.append((best_rank, {
+            **best,
+            'content': content,
+            'metadata': {**run[0][1]['metadata'], 'chunk_ids': [result['metadata']['chunk_id'] for _, result in run]}
+        }))
+
+    merged.sort(key=lambda member: member[0])
+    return [result for _, result in merged]
+
+
+def drop_contained(results: List[dict]) -> List[dict]:
+    """Drop results whose text is fully contained in a better-ranked result"""
+    kept = []
+    for result in results:
+        text = " ".join(result['content'].split())
+        if any(text in " ".join(other['content'].split()) for other in kept):
+            continue
+        kept.append(result)
+    return kept
+
+
+def diversify(results: List[dict], embeddings: Optional[np.ndarray], n_results: int,
+              lambda_mult: Optional[float] = 0.7, merge_adjacent: bool = True) -> List[dict]:
+    """
+    Post-retrieval stage: MMR over the over-fetched candidates, then merge
+    neighbouring chunks and drop duplicated text
+
+    Args:
+        results: Candidates best-first, each with a "score"
+        embeddings: Candidate embeddings aligned with results (None skips MMR)
+        n_results: Passages to return
+        lambda_mult: MMR trade-off (None or 1.0 keeps the relevance order)
+        merge_adjacent: Merge consecutive chunks of a source and strip their overlap
+    """
+    if embeddings is not None and lambda_mult is not None and lambda_mult < 1.0 and len(results) > n_results:
+        picked = mmr_select(np.array([result['score'] for result in results]), embeddings, n_results, lambda_mult)
+        results = [results[i] for i in sorted(picked)]
+    else:
+        results = results[:n_results]
+
+    if merge_adjacent:
+        results = merge_adjacent_chunks(results)
+    return drop_contained(results)
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Optional, Tuple
+
+from sqlite_tuning import connect_wal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = "./run"
+
+
+def worker_id() -> str:
+    """Identifier of the current worker process"""
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+class SharedState:
+    def __init__(self, state_dir: str = DEFAULT_STATE_DIR):
+        """
+        State shared between API worker processes on one host
+
+        Backed by a SQLite database in WAL mode, so any number of workers can
+        read concurrently while writes are serialized by SQLite. Holds caches,
+        rate-limit counters, leases for singleton background tasks and the
+        registry of live stream sessions.
+
+        Args:
+            state_dir: Directory for the state database and lock files
+        """
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.db_path = os.path.join(state_dir, "shared_state.sqlite3")
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_wal(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                window_start REAL NOT NULL,
+                count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                worker TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                info TEXT
+            );
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction taking the database write lock up front"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- Cache ---
+    def cache_get(self, key: str) -> Optional[Any]:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+
+    def cache_delete(self, key: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def cache_incr(self, key: str, amount: int = 1) -> int:
+        """Atomically increment an integer cache entry (created at 0) and return the new value"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            value = (json.loads(row[0]) if row else 0) + amount
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, NULL)",
+                (key, json.dumps(value))
+            )
+        return value
+
+    # --- Rate limiting ---
+    def rate_limit_hit(self, key: str, limit: int, window_seconds: float) -> Tuple[bool, int, float]:
+        """
+        Count a hit against a fixed-window limit shared by all workers
+
+        Returns:
+            (allowed, remaining, seconds until the window resets)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT window_start, count FROM rate_limits WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[0] >= window_seconds:
+                window_start, count = now, 0
+            else:
+                window_start, count = row
+
+            allowed = count < limit
+            if allowed:
+                count += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, window_start, count) VALUES (?, ?, ?)",
+                (key, window_start, count)
+            )
+
+        return allowed, max(0, limit - count), window_start + window_seconds - now
+
+    # --- Leases ---
+    def acquire_lease(self, name: str, ttl: float, owner: Optional[str] = None) -> bool:
+        """
+        Take or renew a named lease; only one worker holds it at a time
+
+        Used to run singleton background tasks (preloading, eviction,
+        maintenance) in exactly one worker. The holder must renew before ttl.
+        """
+        owner = owner or worker_id()
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, owner, now + ttl)
+            )
+        return True
+
+    def release_lease(self, name: str, owner: Optional[str] = None):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner or worker_id()))
+
+    # --- Stream sessions ---
+    def register_session(self, session_id: str, kind: str, info: Optional[dict] = None):
+        """Record that a stream session is owned by this worker"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, worker, kind, started_at, info) VALUES (?, ?, ?, ?, ?)",
+                (session_id, worker_id(), kind, time.time(), json.dumps(info or {}))
+            )
+
+    def end_session(self, session_id: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT session_id, worker, kind, started_at, info FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "session_id": row[0],
+            "worker": row[1],
+            "kind": row[2],
+            "started_at": row[3],
+            "info": json.loads(row[4]) if row[4] else {},
+            "local": row[1] == worker_id()
+        }
+
+    def clear_worker_sessions(self):
+        """Drop sessions of this worker (on shutdown)"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE worker = ?", (worker_id(),))
+
+    # --- Vector store writer lock ---
+    @contextmanager
+    def writer_lock(self, name: str = "vector_store"):
+        """
+        Exclusive cross-process lock so only one worker writes to a store at a time
+
+        Readers never take it; holders should keep it only for the write itself.
+        """
+        lock_path = os.path.join(self.state_dir, f"{name}.lock")
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def get_status(self) -> dict:
+        conn = self._connect()
+        now = time.time()
+        leases = [
+            {"name": name, "owner": owner, "expires_in": round(expires_at - now, 1)}
+            for name, owner, expires_at in conn.execute("SELECT name, owner, expires_at FROM leases")
+            if expires_at > now
+        ]
+        sessions_by_worker = {
+            worker: count
+            for worker, count in conn.execute("SELECT worker, COUNT(*) FROM sessions GROUP BY worker")
+        }
+        return {
+            "worker": worker_id(),
+            "state_db": self.db_path,
+            "leases": leases,
+            "sessions_by_worker": sessions_by_worker
+        }
+
+
+# Global shared state instance
+shared_state = None
+
+def get_shared_state() -> SharedState:
+    """Get or create the shared state instance for this process"""
+    global shared_state
+    if shared_state is None:
+        shared_state = SharedState(os.environ.get("SHARED_STATE_DIR", DEFAULT_STATE_DIR))
+    return shared_state
@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds a connection waits for a lock held by another writer before failing
+BUSY_TIMEOUT = 10.0
+
+
+def connect_wal(path: str) -> sqlite3.Connection:
+    """
+    Autocommit connection in WAL mode with the settings shared by every store
+
+    In WAL mode readers never block the writer or each other. The rest keeps
+    that cheap with many concurrent readers: reads go through a shared memory
+    map instead of per-connection page copies, the WAL is checkpointed every
+    SQLITE_WAL_AUTOCHECKPOINT pages, and after a checkpoint it is truncated
+    to SQLITE_JOURNAL_SIZE_LIMIT_MB instead of staying at its high-water mark
+    (a WAL grows while long reads keep a checkpoint from resetting it).
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE_MB', '256')) * 1024 * 1024}")
+    conn.execute(f"PRAGMA wal_autocheckpoint={int(os.environ.get('SQLITE_WAL_AUTOCHECKPOINT', '1000'))}")
+    conn.execute(f"PRAGMA journal_size_limit={int(os.environ.get('SQLITE_JOURNAL_SIZE_LIMIT_MB', '64')) * 1024 * 1024}")
+    return conn
+
+
+def database_bytes(path: str) -> int:
+    """Size of a database on disk including its WAL"""
+    return sum(os.path.getsize(name) for name in (path, f"{path}-wal") if os.path.exists(name))
+
+
+def database_stats(path: str) -> dict:
+    """Bytes on disk, page counts and the share of free pages of a database"""
+    conn = connect_wal(path)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "path": path,
+        "bytes": database_bytes(path),
+        "wal_bytes": os.path.getsize(f"{path}-wal") if os.path.exists(f"{path}-wal") else 0,
+        "page_size": page_size,
+        "pages": pages,
+        "free_pages": free_pages,
+        "free_ratio": round(free_pages / pages, 4) if pages else 0.0
+    }
+
+
+def compact_database(path: str, min_free_ratio: float = 0.2) -> dict:
+    """
+    Checkpoint a database and VACUUM it once enough of it is free pages
+
+    SQLite never returns the pages of deleted rows to the file system; they
+    stay on the free list. VACUUM rewrites the file without them. Readers keep
+    reading during it (WAL); writers wait for it like for any other write.
+
+    Args:
+        path: SQLite database file
+        min_free_ratio: Share of free pages from which the file is rewritten
+
+    Returns:
+        Path, bytes before and after, free pages before and whether it was vacuumed
+    """
+    before = database_stats(path)
+    conn = connect_wal(path)
+    try:
+        vacuumed = before["free_ratio"] >= min_free_ratio and before["free_pages"] > 0
+        if vacuumed:
+            conn.execute("VACUUM")
+        # Copy the WAL back into the database and truncate it to zero bytes
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    after_bytes = database_bytes(path)
+    if vacuumed:
+        logger.info(f"Vacuumed {path}: {before['bytes']} -> {after_bytes} bytes")
+    return {
+        "path": path,
+        "before_bytes": before["bytes"],
+        "after_bytes": after_bytes,
+        "free_pages": before["free_pages"],
+        "vacuumed": vacuumed
+    }
+
+
+def backup_database(path: str, destination: str):
+    """
+    Copy a live database to destination with SQLite's online backup
+
+    The copy is one consistent read transaction, so writers committing
+    meanwhile never leave it half-updated.
+    """
+    source = connect_wal(path)
+    target = sqlite3.connect(destination)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
@@ -37,6 +37,21 @@ interface UploadResponse {
   success: boolean
   message: string
   filename?: string
+  job_id?: string
+}
+
+interface IngestionProgress {
+  job_id: string
+  status: 'queued' | 'running' | 'completed' | 'failed'
+  stage?: string | null
+  error?: string | null
+  pages_parsed: number
+  chunks_embedded: number
+  chunks_cached: number
+  chunks_stored: number
+  chunks_reused: number
+  chunks_deleted: number
+  chunks_per_second?: number | null
 }
 
 export default function RAGManager() {
@@ -105,6 +120,42 @@ export default function RAGManager() {
     }
   }
 
+  // Follow a background ingestion job until it finishes
+  const followIngestion = (jobId: string, filename: string) => {
+    const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api'
+    const events = new EventSource(`${API_BASE_URL}/rag/jobs/${jobId}/events`)
+
+    events.onmessage = (event) => {
+      const progress: IngestionProgress = JSON.parse(event.data)
+
+      if (progress.status === 'completed') {
+        setUploadMessage({
+          type: 'success',
+          text: `Document "${filename}" indexed: ${progress.pages_parsed} pages, ${progress.chunks_stored} new chunks (${progress.chunks_cached} from cache), ${progress.chunks_reused} unchanged, ${progress.chunks_deleted} removed`
+        })
+        events.close()
+        loadDocuments()
+      } else if (progress.status === 'failed') {
+        setUploadMessage({
+          type: 'error',
+          text: `Failed to index "${filename}": ${progress.error || 'unknown error'}`
+        })
+        events.close()
+      } else {
+        const rate = progress.chunks_per_second ? ` (${progress.chunks_per_second} chunks/s)` : ''
+        setUploadMessage({
+          type: 'success',
+          text: `Indexing "${filename}": ${progress.pages_parsed} pages parsed, ${progress.chunks_embedded} chunks embedded${rate}`
+        })
+      }
+    }
+
+    events.onerror = () => {
+      events.close()
+      loadDocuments()
+    }
+  }
+
   const handleUpload = async () => {
     if (!selectedFile) return
 
@@ -133,8 +184,12 @@ export default function RAGManager() {
         const fileInput = document.getElementById('file-upload') as HTMLInputElement
         if (fileInput) fileInput.value = ''
         
-        // Reload documents
-        loadDocuments()
+        // Reload documents once ingestion finishes
+        if (result.job_id && result.filename) {
+          followIngestion(result.job_id, result.filename)
+        } else {
+          loadDocuments()
+        }
       } else {
         setUploadMessage({ 
           type: 'error', 
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Compaction and snapshots of the RAG stores.
+
+Compaction repacks memory-mapped vector stores without their deleted rows,
+merges the full-text index segments and VACUUMs the SQLite files (catalogs,
+lexical indexes, the Chroma database, the embedding cache) once enough of
+them is free pages, reporting the bytes on disk before and after.
+
+Snapshots copy every collection's stores into ./snapshots/<UTC time>/ while
+the API keeps running: SQLite files through the online backup API, vector
+files while the collections' writer locks are held. Ingestion waits for the
+copy; searches do not.
+
+Usage:
+    python store_maintenance.py compact
+    python store_maintenance.py snapshot --keep 5
+    python store_maintenance.py list
+    python store_maintenance.py restore 20260101T030000Z    # with the API stopped
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import functools
+import threading
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from shared_state import get_shared_state
+from sqlite_tuning import backup_database, compact_database
+from vector_store import MmapVectorStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = "./snapshots"
+
+# Share of free pages (SQLite) or deleted rows (vector files) from which a store is rewritten
+DEFAULT_MIN_FREE_RATIO = 0.2
+
+# Written last, so a snapshot directory without it is incomplete
+MANIFEST_NAME = "manifest.json"
+
+
+class MaintenanceBusy(RuntimeError):
+    """Raised when a compaction or snapshot is already running in this process"""
+
+
+# One compaction or snapshot at a time per process; across workers the writer locks serialize them
+_run_lock = threading.Lock()
+
+
+def _exclusive(function):
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        if not _run_lock.acquire(blocking=False):
+            raise MaintenanceBusy("A compaction or snapshot is already running")
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _run_lock.release()
+    return run
+
+
+def _collection_managers() -> list:
+    import rag_helper
+
+    managers = []
+    for name in rag_helper.list_collections():
+        try:
+            managers.append(rag_helper.get_rag_manager(name, create=False))
+        except KeyError:
+            continue
+    return managers
+
+
+def _chroma_database(rag_manager) -> Optional[str]:
+    """Local Chroma database file, if the collections live in one on this host"""
+    from rag_helper import DEFAULT_CHROMA_PATH
+
+    path = os.path.join(DEFAULT_CHROMA_PATH, "chroma.sqlite3")
+    return path if rag_manager.chroma_client is not None and os.path.exists(path) else None
+
+
+def _writer_locks(managers: list) -> ExitStack:
+    """Hold the writer locks of all collections (in name order, so two holders cannot deadlock)"""
+    stack = ExitStack()
+    for name in sorted({manager._writer_lock_name for manager in managers}):
+        stack.enter_context(get_shared_state().writer_lock(name))
+    return stack
+
+
+def compact_collection(rag_manager, min_free_ratio: float = DEFAULT_MIN_FREE_RATIO) -> dict:
+    """
+    Compact the stores of one collection under its writer lock
+
+    Returns:
+        Per-store reports with bytes on disk before and after, and their totals
+    """
+    report = {"collection": rag_manager.collection_name, "vector_store": None, "files": []}
+    with get_shared_state().writer_lock(rag_manager._writer_lock_name):
+        rag_manager._sync_active_store()
+        if isinstance(rag_manager.vector_store, MmapVectorStore):
+            report["vector_store"] = rag_manager.vector_store.compact(min_free_ratio)
+        rag_manager.lexical_index.optimize()
+        for path in (rag_manager.lexical_index.path, rag_manager.catalog.path):
+            report["files"].append(compact_database(path, min_free_ratio))
+
+    parts = report["files"] + ([report["vector_store"]] if report["vector_store"] else [])
+    report["before_bytes"] = sum(part["before_bytes"] for part in parts)
+    report["after_bytes"] = sum(part["after_bytes"] for part in parts)
+    return report
+
+
+@_exclusive
+def compact_stores(min_free_ratio: float = DEFAULT_MIN_FREE_RATIO) -> dict:
+    """
+    Compact every collection, the shared Chroma database and the embedding cache
+
+    Each collection is compacted under its own writer lock; the Chroma
+    database, which all collections share, under all of them.
+
+    Returns:
+        Report with per-collection and per-file bytes on disk before and after
+    """
+    import rag_helper
+
+    started_at = time.time()
+    managers = _collection_managers()
+    report = {"started_at": started_at, "collections": [], "files": []}
+    for manager in managers:
+        report["collections"].append(compact_collection(manager, min_free_ratio))
+
+    default = rag_helper.get_rag_manager()
+    chroma_database = _chroma_database(default)
+    if chroma_database:
+        with _writer_locks(managers):
+            report["files"].append(compact_database(chroma_database, min_free_ratio))
+    report["files"].append(compact_database(default.embedding_cache.path, min_free_ratio))
+
+    parts = report["collections"] + report["files"]
+    report["before_bytes"] = sum(part["before_bytes"] for part in parts)
+    report["after_bytes"] = sum(part["after_bytes"] for part in parts)
+    report["finished_at"] = time.time()
+    report["seconds"] = round(report["finished_at"] - started_at, 2)
+    logger.info(f"Compacted RAG stores: {report['before_bytes']} -> {report['after_bytes']} bytes in {report['seconds']} s")
+    return report
+
+
+# --- Snapshots ---
+def _directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def _copy_store_directory(source: str, target: str):
+    """Copy a store directory, taking its SQLite databases through the backup API"""
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if name.endswith(("-wal", "-shm", "-journal")):
+            continue
+        if os.path.isdir(path):
+            _copy_store_directory(path, os.path.join(target, name))
+        elif name.endswith(".sqlite3"):
+            backup_database(path, os.path.join(target, name))
+        else:
+            shutil.copy2(path, os.path.join(target, name))
+
+
+@_exclusive
+def take_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, keep: int = 3) -> dict:
+    """
+    Copy every collection's stores into a new snapshot directory
+
+    All writer locks are held while copying, so the catalog, the lexical
+    index and the vectors of each collection are from the same moment;
+    searches continue meanwhile. The manifest lists where each copy is
+    restored to.
+
+    Args:
+        snapshot_dir: Directory holding one subdirectory per snapshot
+        keep: Newest snapshots kept; older ones are deleted (0 keeps all)
+
+    Returns:
+        The snapshot's manifest
+    """
+    import rag_helper
+
+    name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    target = os.path.join(snapshot_dir, name)
+    if os.path.exists(target):
+        raise MaintenanceBusy(f"Snapshot {name} already exists")
+    partial = f"{target}.{os.getpid()}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    started_at = time.time()
+    managers = _collection_managers()
+    default = rag_helper.get_rag_manager()
+    manifest = {"name": name, "created_at": started_at, "vector_backend": default.vector_backend,
+                "collections": [], "entries": []}
+    try:
+        with _writer_locks(managers):
+            for manager in managers:
+                manager._sync_active_store()
+                collection = manager.collection_name
+                os.makedirs(os.path.join(partial, collection))
+                entries = [
+                    ("sqlite", manager.catalog.path, f"{collection}/document_catalog.sqlite3"),
+                    ("sqlite", manager.lexical_index.path, f"{collection}/lexical_index.sqlite3")
+                ]
+                if isinstance(manager.vector_store, MmapVectorStore):
+                    entries.append(("directory", manager.vector_store.path, f"{collection}/vector_store"))
+                for kind, source, path in entries:
+                    if kind == "sqlite":
+                        backup_database(source, os.path.join(partial, path))
+                    else:
+                        _copy_store_directory(source, os.path.join(partial, path))
+                    manifest["entries"].append({"kind": kind, "path": path, "restore_to": source})
+                manifest["collections"].append({"name": collection, "store": manager.store_name,
+                                                "embedding_model": manager.embedding_model,
+                                                **manager.catalog.get_stats()})
+
+            chroma_database = _chroma_database(default)
+            if chroma_database:
+                chroma_path = os.path.dirname(chroma_database)
+                _copy_store_directory(chroma_path, os.path.join(partial, "chroma_db"))
+                manifest["entries"].append({"kind": "directory", "path": "chroma_db", "restore_to": chroma_path})
+
+        manifest["bytes"] = _directory_bytes(partial)
+        manifest["seconds"] = round(time.time() - started_at, 2)
+        with open(os.path.join(partial, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(partial, target)
+    except Exception:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+
+    logger.info(f"Snapshot {name}: {manifest['bytes']} bytes of {len(managers)} collections in {manifest['seconds']} s")
+    if keep > 0:
+        for old in list_snapshots(snapshot_dir)[keep:]:
+            shutil.rmtree(os.path.join(snapshot_dir, old["name"]), ignore_errors=True)
+            logger.info(f"Deleted snapshot {old['name']}")
+    return manifest
+
+
+def list_snapshots(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> List[dict]:
+    """Complete snapshots, newest first"""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(snapshot_dir):
+        manifest_path = os.path.join(snapshot_dir, name, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        snapshots.append({
+            **{key: manifest.get(key) for key in ("name", "created_at", "bytes", "vector_backend")},
+            "collections": [collection["name"] for collection in manifest.get("collections", [])]
+        })
+    return sorted(snapshots, key=lambda snapshot: snapshot["created_at"], reverse=True)
+
+
+def restore_snapshot(name: str, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> dict:
+    """
+    Copy a snapshot back over the live stores; only while the API and ingestion are stopped
+
+    Returns:
+        The restored snapshot's manifest
+    """
+    source = os.path.join(snapshot_dir, name)
+    with open(os.path.join(source, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    for entry in manifest["entries"]:
+        target = entry["restore_to"]
+        if entry["kind"] == "sqlite":
+            # A WAL left next to the restored file would be replayed onto it
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(target + suffix):
+                    os.remove(target + suffix)
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            shutil.copy2(os.path.join(source, entry["path"]), target)
+        else:
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(os.path.join(source, entry["path"]), target)
+        logger.info(f"Restored {entry['path']} to {target}")
+    return manifest
+
+
+class StoreMaintenance:
+    def __init__(self,
+                 rag_loader=None,
+                 compact_interval: float = 6 * 3600,
+                 snapshot_interval: float = 0,
+                 snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+                 keep_snapshots: int = 3,
+                 min_free_ratio: float = DEFAULT_MIN_FREE_RATIO,
+                 poll_interval: float = 60.0,
+                 shared_state=None):
+        """
+        Run compaction and snapshots on a schedule and on demand
+
+        With several API workers only the holder of the maintenance lease
+        runs the schedule; the last run of each kind is kept in shared state,
+        so every worker reports it and a restart does not run it again early.
+
+        Args:
+            rag_loader: Async callable that loads the RAG subsystem before a run (and raises if it cannot)
+            compact_interval: Seconds between compactions (0 disables scheduled compaction)
+            snapshot_interval: Seconds between snapshots (0 disables scheduled snapshots)
+            snapshot_dir: Directory holding the snapshots
+            keep_snapshots: Newest snapshots kept (0 keeps all)
+            min_free_ratio: Share of free pages or deleted rows from which a store is rewritten
+            poll_interval: Seconds between checks whether a run is due
+            shared_state: Optional SharedState for the lease and the last-run reports
+        """
+        self.rag_loader = rag_loader
+        self.compact_interval = compact_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_dir = snapshot_dir
+        self.keep_snapshots = keep_snapshots
+        self.min_free_ratio = min_free_ratio
+        self.poll_interval = poll_interval
+        self.shared_state = shared_state
+        self._task = None
+        self._last = {}
+
+    def _status_key(self, kind: str) -> str:
+        return f"store_maintenance:{kind}"
+
+    def _publish(self, kind: str, status: dict):
+        self._last[kind] = status
+        if self.shared_state is not None:
+            self.shared_state.cache_set(self._status_key(kind), status)
+
+    def _last_run(self, kind: str) -> Optional[dict]:
+        if self.shared_state is not None:
+            return self.shared_state.cache_get(self._status_key(kind))
+        return self._last.get(kind)
+
+    def _due(self, kind: str, interval: float) -> bool:
+        if interval <= 0:
+            return False
+        last = self._last_run(kind)
+        return last is None or time.time() - last["started_at"] >= interval
+
+    async def _run(self, kind: str, function, *args) -> dict:
+        if _run_lock.locked():
+            raise MaintenanceBusy("A compaction or snapshot is already running")
+        previous = await asyncio.to_thread(self._last_run, kind)
+        started_at = time.time()
+        # Published first so a worker taking over the lease does not start the same run again
+        await asyncio.to_thread(self._publish, kind, {"state": "running", "started_at": started_at})
+        try:
+            if self.rag_loader is not None:
+                await self.rag_loader()
+            report = await asyncio.to_thread(function, *args)
+        except MaintenanceBusy:
+            if previous is not None:
+                await asyncio.to_thread(self._publish, kind, previous)
+            raise
+        except Exception as e:
+            await asyncio.to_thread(self._publish, kind, {"state": "failed", "started_at": started_at, "error": str(e)})
+            raise
+        await asyncio.to_thread(self._publish, kind, {"state": "completed", "started_at": started_at, "report": report})
+        return report
+
+    async def compact(self) -> dict:
+        """Compact all stores now; returns the before/after report"""
+        return await self._run("compaction", compact_stores, self.min_free_ratio)
+
+    async def snapshot(self) -> dict:
+        """Take a snapshot now; returns its manifest"""
+        return await self._run("snapshot", take_snapshot, self.snapshot_dir, self.keep_snapshots)
+
+    async def _holds_lease(self) -> bool:
+        """With several API workers, only the holder of the maintenance lease runs the schedule"""
+        if self.shared_state is None:
+            return True
+        return await asyncio.to_thread(self.shared_state.acquire_lease, "store_maintenance", self.poll_interval * 3)
+
+    async def _maintenance_loop(self):
+        while True:
+            try:
+                if (self.compact_interval > 0 or self.snapshot_interval > 0) and await self._holds_lease():
+                    if await asyncio.to_thread(self._due, "compaction", self.compact_interval):
+                        await self.compact()
+                    if await asyncio.to_thread(self._due, "snapshot", self.snapshot_interval):
+                        await self.snapshot()
+            except MaintenanceBusy:
+                pass
+            except Exception as e:
+                logger.error(f"Error in store maintenance: {str(e)}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Start the background maintenance loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self):
+        """Stop the maintenance loop (a run in progress finishes in its thread)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_status(self) -> dict:
+        """Schedule, last compaction and snapshot, and the snapshots on disk"""
+        return {
+            "compact_interval": self.compact_interval,
+            "snapshot_interval": self.snapshot_interval,
+            "min_free_ratio": self.min_free_ratio,
+            "snapshot_dir": self.snapshot_dir,
+            "keep_snapshots": self.keep_snapshots,
+            "last_compaction": self._last_run("compaction"),
+            "last_snapshot": self._last_run("snapshot"),
+            "snapshots": list_snapshots(self.snapshot_dir)
+        }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Compact, snapshot and restore the RAG stores")
+    parser.add_argument("command", choices=["compact", "snapshot", "list", "restore"])
+    parser.add_argument("name", nargs="?", help="Snapshot to restore")
+    parser.add_argument("--snapshot-dir", default=os.environ.get("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR))
+    parser.add_argument("--keep", type=int, default=int(os.environ.get("SNAPSHOT_KEEP", "3")),
+                        help="Newest snapshots kept (0 keeps all)")
+    parser.add_argument("--min-free-ratio", type=float,
+                        default=float(os.environ.get("STORE_COMPACT_MIN_FREE_RATIO", str(DEFAULT_MIN_FREE_RATIO))),
+                        help="Share of free pages or deleted rows from which a store is rewritten")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        result = compact_stores(args.min_free_ratio)
+    elif args.command == "snapshot":
+        result = take_snapshot(args.snapshot_dir, args.keep)
+    elif args.command == "list":
+        result = list_snapshots(args.snapshot_dir)
+    else:
+        if not args.name:
+            parser.error("restore needs the name of a snapshot")
+        result = restore_snapshot(args.name, args.snapshot_dir)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
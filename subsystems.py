@@ -0,0 +1,191 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Subsystem states
+NOT_LOADED = "not_loaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class SubsystemUnavailable(ImportError):
+    """Raised when a subsystem failed to load (missing dependency or init error)"""
+
+
+class LazySubsystem:
+    def __init__(self, name: str, loader: Callable, required: bool = False, description: str = "",
+                 retry_backoff: float = 5.0, max_retry_backoff: float = 300.0):
+        """
+        A heavy dependency loaded on first use or by the startup warm-up
+
+        A failed load is retried by the next use once a backoff has passed
+        (doubling per consecutive failure), so a dependency that was briefly
+        unreachable at startup, like a Chroma server still booting, does not
+        stay unavailable for the life of the process.
+
+        Args:
+            name: Subsystem name used in readiness and startup reports
+            loader: Callable doing the import/initialization and returning the object to hand out
+            required: Whether the API counts as not ready until this subsystem is loaded
+            description: What the subsystem provides
+            retry_backoff: Seconds after the first failure before a load is attempted again
+            max_retry_backoff: Upper bound for the doubled backoff
+        """
+        self.name = name
+        self.loader = loader
+        self.required = required
+        self.description = description
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+
+        self.state = NOT_LOADED
+        self.value = None
+        self.error = None
+        self.load_ms = None
+        self.modules_loaded = None
+        self.loaded_by = None
+        self.failures = 0
+        self.retry_at = None
+        self._lock = threading.Lock()
+
+    def get(self, loaded_by: str = "request"):
+        """Return the loaded subsystem, loading it in the calling thread if needed"""
+        if self.state == READY:
+            return self.value
+
+        with self._lock:
+            if self.state == NOT_LOADED:
+                self._load(loaded_by)
+            elif self.state == FAILED and time.monotonic() >= self.retry_at:
+                logger.info(f"Retrying {self.name} after {self.failures} failed load(s)")
+                self._load(loaded_by)
+
+        if self.state == FAILED:
+            raise SubsystemUnavailable(f"{self.name} is not available: {self.error}")
+        return self.value
+
+    def _load(self, loaded_by: str):
+        self.state = LOADING
+        modules_before = len(sys.modules)
+        started_at = time.perf_counter()
+        try:
+            self.value = self.loader()
+            self.state = READY
+            self.error = None
+            self.failures = 0
+            self.retry_at = None
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+            self.failures += 1
+            backoff = min(self.max_retry_backoff, self.retry_backoff * 2 ** (self.failures - 1))
+            self.retry_at = time.monotonic() + backoff
+            logger.error(f"Failed to load {self.name} (retrying in {backoff:.0f}s): {self.error}")
+        finally:
+            self.load_ms = round((time.perf_counter() - started_at) * 1000, 1)
+            self.modules_loaded = len(sys.modules) - modules_before
+            self.loaded_by = loaded_by
+
+        if self.state == READY:
+            logger.info(f"Loaded {self.name} in {self.load_ms} ms ({self.modules_loaded} modules, {loaded_by})")
+
+    def report(self) -> dict:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "required": self.required,
+            "state": self.state,
+            "load_ms": self.load_ms,
+            "modules_loaded": self.modules_loaded,
+            "loaded_by": self.loaded_by,
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in_seconds": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.state == FAILED else None
+        }
+
+
+class SubsystemRegistry:
+    def __init__(self):
+        """Registry of lazily loaded subsystems with an explicit warm-up phase"""
+        self._subsystems = {}
+        self.created_at = time.perf_counter()
+        self.app_imported_ms = None
+        self.warmup_started_ms = None
+        self.warmup_finished_ms = None
+
+    def register(self, name: str, loader: Callable, required: bool = False, description: str = "") -> LazySubsystem:
+        subsystem = LazySubsystem(name, loader, required=required, description=description)
+        self._subsystems[name] = subsystem
+        return subsystem
+
+    def mark_app_imported(self):
+        """Record how long the application module took to import"""
+        self.app_imported_ms = self._elapsed_ms()
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.created_at) * 1000, 1)
+
+    def get(self, name: str):
+        """Load (if needed) and return a subsystem from synchronous code"""
+        return self._subsystems[name].get()
+
+    async def aget(self, name: str):
+        """Load (if needed) and return a subsystem without blocking the event loop"""
+        subsystem = self._subsystems[name]
+        if subsystem.state == READY:
+            return subsystem.value
+        return await asyncio.to_thread(subsystem.get)
+
+    def is_ready(self, name: str) -> bool:
+        return self._subsystems[name].state == READY
+
+    async def warm_up(self, names: Optional[List[str]] = None):
+        """
+        Load subsystems in the background, in registration order
+
+        Loading happens in a single worker thread so the event loop keeps
+        serving (and the port binds) meanwhile. Loads are sequential because
+        imports are GIL-bound anyway, and it keeps the per-subsystem timings
+        in the startup report free of contention between loads.
+        """
+        self.warmup_started_ms = self._elapsed_ms()
+
+        def load_all():
+            for name in names or list(self._subsystems):
+                subsystem = self._subsystems[name]
+                if subsystem.state == NOT_LOADED:
+                    try:
+                        subsystem.get(loaded_by="warmup")
+                    except SubsystemUnavailable:
+                        pass
+
+        await asyncio.to_thread(load_all)
+        self.warmup_finished_ms = self._elapsed_ms()
+        logger.info(f"Startup warm-up finished {self.warmup_finished_ms} ms after process start: "
+                    + ", ".join(f"{s.name}={s.state} ({s.load_ms} ms)" for s in self._subsystems.values()))
+
+    def readiness(self) -> dict:
+        """Overall readiness plus the state of every subsystem"""
+        required_ready = all(s.state == READY for s in self._subsystems.values() if s.required)
+        return {
+            "ready": required_ready,
+            "warmup_complete": self.warmup_finished_ms is not None,
+            "subsystems": {name: s.state for name, s in self._subsystems.items()}
+        }
+
+    def startup_report(self) -> dict:
+        """Per-subsystem import cost and startup milestones (milliseconds since the API module started importing)"""
+        subsystems = [s.report() for s in self._subsystems.values()]
+        return {
+            "app_imported_ms": self.app_imported_ms,
+            "warmup_started_ms": self.warmup_started_ms,
+            "warmup_finished_ms": self.warmup_finished_ms,
+            "total_subsystem_load_ms": round(sum(s["load_ms"] or 0 for s in subsystems), 1),
+            "subsystems": sorted(subsystems, key=lambda s: s["load_ms"] or 0, reverse=True)
+        }
@@ -0,0 +1,265 @@
+"""
+Tests for ModelResidencyManager against a stub Ollama server.
+
+Run with: python -m pytest -q test_model_residency.py
+"""
+
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from model_residency import ModelResidencyManager
+
+GB = 1024 ** 3
+
+
+class StubOllama:
+    """In-process server answering /api/ps, /api/tags and /api/generate like Ollama"""
+
+    def __init__(self, installed: dict, loaded: list, unload_delay: float = 0.0):
+        self.installed = installed
+        self.loaded = list(loaded)
+        self.unload_delay = unload_delay
+        self.requests = []
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests.append(("GET", self.path, None))
+                    if self.path == "/api/ps":
+                        models = [{"name": name, "size": stub.installed[name], "size_vram": 0} for name in stub.loaded]
+                        self._reply({"models": models})
+                    elif self.path == "/api/tags":
+                        self._reply({"models": [{"name": name, "size": size} for name, size in stub.installed.items()]})
+                    else:
+                        self.send_error(404)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.requests.append(("POST", self.path, body))
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                if body.get("keep_alive") == 0:
+                    time.sleep(stub.unload_delay)
+                    with stub._lock:
+                        if body["model"] in stub.loaded:
+                            stub.loaded.remove(body["model"])
+                else:
+                    with stub._lock:
+                        if body["model"] not in stub.loaded:
+                            stub.loaded.append(body["model"])
+                self._reply({"model": body["model"], "done": True})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def unloads(self) -> list:
+        return [body["model"] for method, path, body in self.requests if method == "POST" and body.get("keep_alive") == 0]
+
+
+class FakeSharedState:
+    def __init__(self, holds_lease: bool):
+        self.holds_lease = holds_lease
+
+    def acquire_lease(self, name, ttl):
+        return self.holds_lease
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def make(**kwargs):
+        server = StubOllama(**kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.server.shutdown()
+
+
+def make_manager(stub_server, tmp_path, **kwargs) -> ModelResidencyManager:
+    return ModelResidencyManager(
+        ollama_base_url=stub_server.url,
+        usage_path=str(tmp_path / "model_usage.json"),
+        **kwargs
+    )
+
+
+def run(coroutine_factory):
+    """Run a test coroutine and close the manager's HTTP client on the same loop"""
+    async def main():
+        manager, coroutine = coroutine_factory()
+        try:
+            return await coroutine
+        finally:
+            if manager._client is not None:
+                await manager._client.aclose()
+    return asyncio.run(main())
+
+
+def test_refresh_resident_reads_api_ps(stub, tmp_path):
+    server = stub(installed={"llama3.2:latest": 2 * GB, "qwen2.5:7b": 5 * GB}, loaded=["llama3.2:latest"])
+    manager = make_manager(server, tmp_path)
+
+    async def scenario():
+        await manager.refresh_resident()
+        first = dict(manager._resident)
+        server.loaded.clear()
+        await manager.refresh_resident()
+        return first
+
+    first = run(lambda: (manager, scenario()))
+    assert set(first) == {"llama3.2:latest"}
+    assert first["llama3.2:latest"]["size"] == 2 * GB
+    assert manager._resident == {}
+    assert [event["type"] for event in manager.get_status()["events"]] == ["unloaded"]
+
+
+def test_model_sizes_come_from_api_tags(stub, tmp_path):
+    server = stub(installed={"llama3.2:latest": 2 * GB, "qwen2.5:7b": 5 * GB}, loaded=[])
+    manager = make_manager(server, tmp_path)
+
+    run(lambda: (manager, manager._refresh_model_sizes()))
+    assert manager._model_sizes == {"llama3.2:latest": 2 * GB, "qwen2.5:7b": 5 * GB}
+
+
+def test_unload_sends_zero_keep_alive(stub, tmp_path):
+    server = stub(installed={"llama3.2:latest": 2 * GB}, loaded=["llama3.2:latest"])
+    manager = make_manager(server, tmp_path)
+
+    async def scenario():
+        await manager.refresh_resident()
+        return await manager.unload("llama3.2:latest", reason="idle")
+
+    assert run(lambda: (manager, scenario())) is True
+    assert server.unloads() == ["llama3.2:latest"]
+    assert server.loaded == []
+    assert "llama3.2:latest" not in manager._resident
+    assert manager.get_status()["events"][-1]["reason"] == "idle"
+
+
+def test_non_ollama_models_are_ignored(stub, tmp_path):
+    server = stub(installed={}, loaded=[])
+    manager = make_manager(server, tmp_path)
+
+    assert run(lambda: (manager, manager.before_request("gpt-4o"))) is None
+    assert server.requests == []
+
+
+def test_cold_start_evicts_least_recently_used_within_budget(stub, tmp_path):
+    server = stub(
+        installed={"a:latest": 4 * GB, "b:latest": 4 * GB, "c:latest": 4 * GB},
+        loaded=["a:latest", "b:latest"]
+    )
+    manager = make_manager(server, tmp_path, memory_budget_bytes=9 * GB)
+
+    async def scenario():
+        for model in ("ollama/a", "ollama/b"):
+            await manager.before_request(model)
+            manager.after_request(model)
+        # a is now the least recently used of the two resident models
+        manager._usage["a:latest"]["last_used"] -= 60
+        keep_alive = await manager.before_request("ollama/c")
+        manager.after_request("ollama/c")
+        return keep_alive
+
+    keep_alive = run(lambda: (manager, scenario()))
+    assert keep_alive == manager.default_keep_alive
+    assert server.unloads() == ["a:latest"]
+    assert set(manager._resident) == {"b:latest", "c:latest"}
+    assert manager.get_status()["cold_starts"] == {"c:latest": 1}
+    # Only the request that paid for the load saw an empty KV cache
+    assert manager.consume_cold_start("ollama/c") is True
+    assert manager.consume_cold_start("ollama/c") is False
+    assert manager.consume_cold_start("ollama/b") is False
+
+
+def test_eviction_does_not_block_requests_for_other_models(stub, tmp_path):
+    server = stub(
+        installed={"a:latest": 4 * GB, "b:latest": 4 * GB, "c:latest": 1 * GB},
+        loaded=["a:latest", "c:latest"],
+        unload_delay=1.0
+    )
+    manager = make_manager(server, tmp_path, memory_budget_bytes=6 * GB)
+
+    async def scenario():
+        for model in ("ollama/a", "ollama/c"):
+            await manager.before_request(model)
+            manager.after_request(model)
+        manager._usage["a:latest"]["last_used"] -= 60
+        # b's cold start unloads a, which the stub makes slow
+        cold = asyncio.create_task(manager.before_request("ollama/b"))
+        await asyncio.sleep(0.2)
+        started_at = time.perf_counter()
+        await manager.before_request("ollama/c")
+        warm_seconds = time.perf_counter() - started_at
+        manager.after_request("ollama/c")
+        await cold
+        manager.after_request("ollama/b")
+        return warm_seconds
+
+    assert run(lambda: (manager, scenario())) < 0.5
+    assert server.unloads() == ["a:latest"]
+    assert set(manager._resident) == {"b:latest", "c:latest"}
+
+
+def test_workers_without_the_lease_do_not_evict(stub, tmp_path):
+    server = stub(installed={"a:latest": 4 * GB, "b:latest": 4 * GB}, loaded=["a:latest"])
+    manager = make_manager(server, tmp_path, memory_budget_bytes=5 * GB, shared_state=FakeSharedState(holds_lease=False))
+
+    async def scenario():
+        assert await manager._holds_lease() is False
+        await manager.before_request("ollama/b")
+        manager.after_request("ollama/b")
+
+    run(lambda: (manager, scenario()))
+    assert server.unloads() == []
+
+
+def test_lease_holder_evicts(stub, tmp_path):
+    server = stub(installed={"a:latest": 4 * GB, "b:latest": 4 * GB}, loaded=["a:latest"])
+    manager = make_manager(server, tmp_path, memory_budget_bytes=5 * GB, shared_state=FakeSharedState(holds_lease=True))
+
+    async def scenario():
+        assert await manager._holds_lease() is True
+        await manager.before_request("ollama/b")
+        manager.after_request("ollama/b")
+
+    run(lambda: (manager, scenario()))
+    assert server.unloads() == ["a:latest"]
+
+
+def test_evict_idle_unloads_idle_unpinned_models(stub, tmp_path):
+    server = stub(installed={"a:latest": 2 * GB, "b:latest": 2 * GB}, loaded=["a:latest", "b:latest"])
+    manager = make_manager(server, tmp_path, idle_evict_seconds=60, preload_models=["b"])
+
+    async def scenario():
+        await manager.refresh_resident()
+        await manager.evict_idle()
+
+    run(lambda: (manager, scenario()))
+    assert server.unloads() == ["a:latest"]
+    assert set(manager._resident) == {"b:latest"}
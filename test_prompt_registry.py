@@ -0,0 +1,78 @@
+"""
+Tests for SystemPromptRegistry prefix cache accounting.
+
+Run with: python -m pytest -q test_prompt_registry.py
+"""
+
+from prompt_registry import SystemPromptRegistry
+
+MODEL = "ollama/llama3.2"
+SYSTEM_PROMPT = "You are a careful assistant. " * 40
+
+
+def make_registry(tmp_path) -> SystemPromptRegistry:
+    return SystemPromptRegistry(storage_path=str(tmp_path / "system_prompts.json"))
+
+
+def ollama_report(prompt_chars: int, evaluated: int, cold: bool = False) -> dict:
+    return {"source": "prompt_eval", "prompt_eval_tokens": evaluated, "prompt_chars": prompt_chars, "cold": cold}
+
+
+def test_uncalibrated_ollama_requests_are_unknown(tmp_path):
+    registry = make_registry(tmp_path)
+    resolved = registry.resolve(system_prompt=SYSTEM_PROMPT)
+
+    registry.record_prompt_eval(resolved, MODEL, ollama_report(len(SYSTEM_PROMPT) + 400, 50), 10.0)
+    registry.record_prompt_eval(resolved, MODEL, None, None)
+
+    stats = registry.get_cache_stats()
+    assert stats["unknown"] == 2
+    assert stats["observed"] == 0
+    assert stats["hit_rate"] is None
+
+
+def test_long_conversation_then_cold_short_conversation_is_a_miss(tmp_path):
+    registry = make_registry(tmp_path)
+    resolved = registry.resolve(system_prompt=SYSTEM_PROMPT)
+    prefix_chars = len(resolved["prompt"])
+
+    # Cold start calibrates the model at 4 characters per token
+    registry.record_prompt_eval(resolved, MODEL, ollama_report(prefix_chars + 400, (prefix_chars + 400) // 4, cold=True), 900.0)
+    # A long conversation re-evaluated in full
+    long_chars = prefix_chars + 40000
+    registry.record_prompt_eval(resolved, MODEL, ollama_report(long_chars, long_chars // 4), 3000.0)
+    # A new, short conversation evaluated in full is still a miss however long the previous one was
+    short_chars = prefix_chars + 200
+    registry.record_prompt_eval(resolved, MODEL, ollama_report(short_chars, short_chars // 4), 400.0)
+
+    stats = registry.get_cache_stats()
+    assert stats["observed"] == 3
+    assert stats["hits"] == 0
+
+
+def test_reused_system_prefix_is_a_hit(tmp_path):
+    registry = make_registry(tmp_path)
+    resolved = registry.resolve(system_prompt=SYSTEM_PROMPT)
+    prefix_chars = len(resolved["prompt"])
+
+    registry.record_prompt_eval(resolved, MODEL, ollama_report(prefix_chars + 400, (prefix_chars + 400) // 4, cold=True), 900.0)
+    # Only the new user turn was evaluated; the system prefix came from the KV cache
+    registry.record_prompt_eval(resolved, MODEL, ollama_report(prefix_chars + 200, 55), 80.0)
+
+    stats = registry.get_cache_stats()
+    assert stats["observed"] == 2
+    assert stats["hits"] == 1
+    assert stats["unknown"] == 0
+
+
+def test_reported_cached_tokens_decide_hits(tmp_path):
+    registry = make_registry(tmp_path)
+    resolved = registry.resolve(system_prompt=SYSTEM_PROMPT)
+
+    registry.record_prompt_eval(resolved, "gpt-4o", {"source": "cached_tokens", "prompt_tokens": 300, "cached_tokens": 256}, 50.0)
+    registry.record_prompt_eval(resolved, "gpt-4o", {"source": "cached_tokens", "prompt_tokens": 300, "cached_tokens": 0}, 90.0)
+
+    stats = registry.get_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["observed"] == 2
+    assert stats["prompts"][0]["cached_tokens"] == 256
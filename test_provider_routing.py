@@ -0,0 +1,92 @@
+"""
+Tests for ProviderRouter against stub LiteLLM streams.
+
+Run with: python -m pytest -q test_provider_routing.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from provider_routing import ProviderRouter
+
+
+def make_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+
+class StubStream:
+    """Async chunk iterator standing in for LiteLLM's CustomStreamWrapper"""
+
+    def __init__(self, texts, first_token_delay=0.0):
+        self.texts = list(texts)
+        self.first_token_delay = first_token_delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed or not self.texts:
+            raise StopAsyncIteration
+        if self.first_token_delay:
+            await asyncio.sleep(self.first_token_delay)
+            self.first_token_delay = 0.0
+        return make_chunk(self.texts.pop(0))
+
+    async def aclose(self):
+        self.closed = True
+
+
+class StubLiteLLM:
+    """Hands out a prepared StubStream per model from acompletion"""
+
+    def __init__(self, streams: dict):
+        self.streams = streams
+
+    async def acompletion(self, model, **kwargs):
+        return self.streams[model]
+
+
+def make_router(streams: dict, **kwargs) -> ProviderRouter:
+    litellm = StubLiteLLM(streams)
+
+    async def loader():
+        return litellm
+
+    return ProviderRouter(litellm_loader=loader, **kwargs)
+
+
+def test_losing_hedge_stream_is_closed():
+    primary = StubStream(["slow"], first_token_delay=5.0)
+    backup = StubStream(["fast", " answer"])
+    router = make_router(
+        {"primary": primary, "backup": backup},
+        policies={"primary": {"mode": "hedge", "backups": ["backup"]}},
+        default_hedge_delay=0.05
+    )
+
+    async def scenario():
+        return [event async for event in router.stream("primary", [{"role": "user", "content": "hi"}])]
+
+    events = asyncio.run(asyncio.wait_for(scenario(), timeout=2.0))
+    assert "".join(event["delta"] for event in events) == "fast answer"
+    assert {event["model"] for event in events} == {"backup"}
+    assert primary.closed
+    assert backup.closed
+    assert router.stats["hedge_wins"] == 1
+
+
+def test_winner_stream_is_closed_when_the_consumer_stops():
+    stream = StubStream(["a", "b", "c"])
+    router = make_router({"model": stream})
+
+    async def scenario():
+        events = router.stream("model", [{"role": "user", "content": "hi"}])
+        first = await events.__anext__()
+        # A disconnected client stops reading mid-answer
+        await events.aclose()
+        return first
+
+    first = asyncio.run(asyncio.wait_for(scenario(), timeout=2.0))
+    assert first["delta"] == "a"
+    assert stream.closed
@@ -0,0 +1,800 @@
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sqlite_tuning import connect_wal, compact_database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VECTOR_STORE_PATH = "./vector_store"
+
+# Rows scored per step of an exact scan; bounds the float32 working copy of the matrix
+SCAN_BLOCK_ROWS = 8192
+
+# Fewest training vectors per IVF list before the coarse index is trained
+IVF_MIN_POINTS_PER_LIST = 39
+
+# Metadata fields written at ingest that get their own indexed SQL columns for filter pushdown
+FILTER_FIELDS = ("source", "page", "ingested_at")
+
+_SQL_OPERATORS = {"$eq": "=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def matches_where(metadata: dict, where: Optional[dict]) -> bool:
+    """
+    Evaluate a Chroma-style metadata filter against one chunk's metadata
+
+    Supports field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin and $and/$or.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                ok = value == operand
+            elif operator == "$ne":
+                ok = value != operand
+            elif operator == "$in":
+                ok = value in operand
+            elif operator == "$nin":
+                ok = value not in operand
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                try:
+                    ok = value is not None and (
+                        value > operand if operator == "$gt" else
+                        value >= operand if operator == "$gte" else
+                        value < operand if operator == "$lt" else
+                        value <= operand
+                    )
+                except TypeError:
+                    # Values of another type never match a range, as in Chroma
+                    ok = False
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+            if not ok:
+                return False
+    return True
+
+
+def where_to_sql(where: dict, columns: Dict[str, str], metadata_column: str) -> Tuple[str, list]:
+    """
+    Translate a Chroma-style metadata filter into an SQL condition
+
+    Fields with a column of their own use it (and its index); any other
+    field is read from the JSON metadata column.
+
+    Args:
+        where: Filter as accepted by matches_where
+        columns: Metadata field -> SQL column expression
+        metadata_column: SQL expression of the JSON metadata
+
+    Returns:
+        (SQL condition, parameters)
+    """
+    clauses = []
+    params = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(clause, columns, metadata_column) for clause in condition]
+            if not parts:
+                clauses.append("1" if key == "$and" else "0")
+                continue
+            clauses.append("(" + (" AND " if key == "$and" else " OR ").join(sql for sql, _ in parts) + ")")
+            for _, part_params in parts:
+                params += part_params
+            continue
+
+        if key not in columns and not re.fullmatch(r"[A-Za-z0-9_]+", key):
+            raise ValueError(f"Unsupported filter field: {key}")
+        column = columns.get(key) or f"json_extract({metadata_column}, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator in _SQL_OPERATORS:
+                clauses.append(f"{column} {_SQL_OPERATORS[operator]} ?")
+                params.append(operand)
+            elif operator == "$ne":
+                # Chunks without the field count as different, as in matches_where
+                clauses.append(f"({column} IS NULL OR {column} != ?)")
+                params.append(operand)
+            elif operator in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(operand))
+                if operator == "$in":
+                    clauses.append(f"{column} IN ({placeholders})")
+                else:
+                    clauses.append(f"({column} IS NULL OR {column} NOT IN ({placeholders}))")
+                params += list(operand)
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+class VectorStore:
+    """
+    Storage of chunk vectors, texts and metadata used by RAGManager
+
+    Query and get results are dicts with "id", "content" and "metadata",
+    plus "distance" (lower is closer) for queries and "embedding" when
+    requested.
+    """
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[dict]):
+        raise NotImplementedError
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        raise NotImplementedError
+
+    def query(self, embedding: List[float], n_results: int, where: Optional[dict] = None) -> List[dict]:
+        """Nearest chunks to embedding, closest first, among those matching the metadata filter where"""
+        raise NotImplementedError
+
+    def get(self, ids: List[str], include_embeddings: bool = False) -> List[dict]:
+        """Stored chunks among ids (missing ids are left out)"""
+        raise NotImplementedError
+
+    def list(self, limit: int, offset: int = 0) -> List[dict]:
+        """One page of all stored chunks, in a stable order"""
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def delete_where(self, where: dict) -> int:
+        """Delete every chunk whose metadata matches a Chroma-style filter; returns how many were deleted"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def get_stats(self) -> dict:
+        return {"backend": type(self).__name__, "chunks": self.count()}
+
+
+class ChromaVectorStore(VectorStore):
+    def __init__(self, collection):
+        """
+        Vector store backed by a Chroma collection (HNSW index)
+
+        Args:
+            collection: Chroma collection created without an embedding function
+        """
+        self.collection = collection
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update_metadata(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def query(self, embedding, n_results, where=None):
+        # Chroma applies the filter on its metadata index before the HNSW search
+        results = self.collection.query(query_embeddings=[embedding], n_results=n_results, where=where or None)
+        ranked = []
+        if results['documents'] and results['documents'][0]:
+            for i, doc in enumerate(results['documents'][0]):
+                ranked.append({
+                    'id': results['ids'][0][i],
+                    'content': doc,
+                    'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
+                    'distance': results['distances'][0][i] if results['distances'] else None
+                })
+        return ranked
+
+    def _to_rows(self, result: dict, include_embeddings: bool = False) -> List[dict]:
+        rows = []
+        for i, chunk_id in enumerate(result["ids"]):
+            row = {
+                "id": chunk_id,
+                "content": result["documents"][i] if result.get("documents") is not None else None,
+                "metadata": (result["metadatas"][i] if result.get("metadatas") is not None else None) or {}
+            }
+            if include_embeddings:
+                row["embedding"] = result["embeddings"][i]
+            rows.append(row)
+        return rows
+
+    def get(self, ids, include_embeddings=False):
+        if not ids:
+            return []
+        include = ["metadatas", "documents"] + (["embeddings"] if include_embeddings else [])
+        return self._to_rows(self.collection.get(ids=ids, include=include), include_embeddings)
+
+    def list(self, limit, offset=0):
+        return self._to_rows(self.collection.get(limit=limit, offset=offset, include=["metadatas", "documents"]))
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def delete_where(self, where):
+        # Chroma's delete does not report what it removed
+        ids = self.collection.get(where=where, include=[])["ids"]
+        if ids:
+            self.collection.delete(ids=ids)
+        return len(ids)
+
+    def count(self):
+        return self.collection.count()
+
+    def get_stats(self):
+        return {"backend": "chroma", "collection": self.collection.name, "chunks": self.count()}
+
+
+class MmapVectorStore(VectorStore):
+    def __init__(self, path: str = DEFAULT_VECTOR_STORE_PATH, dtype: str = "float16",
+                 ivf_lists: int = 0, nprobe: int = 8, initial_capacity: int = 1024):
+        """
+        In-process vector store on a memory-mapped matrix
+
+        Unit-normalized vectors are kept in one preallocated file as float16,
+        or as int8 with a float32 scale per row, and searched exactly with
+        NumPy (cosine distance). Chunk text and metadata live in SQLite next
+        to it. Opening the store maps the files instead of loading or
+        rebuilding an index, so start-up is immediate, and every process
+        (API workers, the bulk ingestion CLI) shares the same page cache.
+
+        With ivf_lists > 0 a coarse IVF index (spherical k-means centroids) is
+        trained once enough vectors are stored and retrained whenever the
+        store doubles; queries then scan only the nprobe closest lists.
+
+        Args:
+            path: Directory holding the matrix files and rows.sqlite3
+            dtype: 'float16' or 'int8' (fixed when the store is created)
+            ivf_lists: Number of IVF lists (0 keeps exact search)
+            nprobe: IVF lists scanned per query
+            initial_capacity: Rows allocated when the store is created
+        """
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self.initial_capacity = initial_capacity
+        self._local = threading.local()
+        self._map_lock = threading.Lock()
+        self._maps = None
+        self._centroids = None
+        self._ivf_version = None
+
+        os.makedirs(path, exist_ok=True)
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                source TEXT,
+                page INTEGER,
+                ingested_at INTEGER,
+                content TEXT,
+                metadata TEXT
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        # Stores created before filter pushdown lack the page and ingested_at columns
+        present = {column for _, column, *_ in conn.execute("PRAGMA table_info(rows)")}
+        for column in ("page", "ingested_at"):
+            if column not in present:
+                conn.execute(f"ALTER TABLE rows ADD COLUMN {column} INTEGER")
+                conn.execute(f"UPDATE rows SET {column} = json_extract(metadata, '$.{column}')")
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_rows_source ON rows (source);
+            CREATE INDEX IF NOT EXISTS idx_rows_page ON rows (page);
+            CREATE INDEX IF NOT EXISTS idx_rows_ingested_at ON rows (ingested_at);
+        """)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dtype', ?)", (dtype,))
+        self.dtype = self._meta(conn).get("dtype", dtype)
+        if self.dtype != dtype:
+            logger.warning(f"Vector store at {path} was created as {self.dtype}; ignoring requested {dtype}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_wal(os.path.join(self.path, "rows.sqlite3"))
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _meta(conn) -> Dict[str, str]:
+        return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+
+    @staticmethod
+    def _set_meta(conn, **values):
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()]
+        )
+
+    # --- Matrix files ---
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _layout(self, dim: int, generation: int = 0):
+        """(file name, dtype, row shape) of every per-row array of one generation of the files"""
+        # Generation 0 keeps the names of stores created before compaction existed
+        suffix = f".{generation}" if generation else ""
+        layout = [
+            (f"vectors{suffix}.bin", np.float16 if self.dtype == "float16" else np.int8, (dim,)),
+            (f"live{suffix}.bin", np.uint8, ()),
+            (f"lists{suffix}.bin", np.int32, ())
+        ]
+        if self.dtype == "int8":
+            layout.append((f"scales{suffix}.bin", np.float32, ()))
+        return layout
+
+    def _resize_files(self, capacity: int, dim: int, generation: int = 0):
+        for name, dtype, shape in self._layout(dim, generation):
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+            with open(self._file(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+
+    def _open_maps(self, capacity: int, dim: int, generation: int) -> dict:
+        maps = {"capacity": capacity, "generation": generation}
+        for name, dtype, shape in self._layout(dim, generation):
+            maps[name.split(".")[0]] = np.memmap(self._file(name), dtype=dtype, mode="r+", shape=(capacity, *shape))
+        return maps
+
+    def _mapped(self, capacity: int, dim: int, generation: int = 0) -> dict:
+        """Memory maps of the per-row arrays for the current capacity (remapped after growth or compaction)"""
+        with self._map_lock:
+            if self._maps is None or (self._maps["capacity"], self._maps["generation"]) != (capacity, generation):
+                self._maps = self._open_maps(capacity, dim, generation)
+            return self._maps
+
+    def _dimensions(self, conn) -> Optional[dict]:
+        meta = self._meta(conn)
+        if "dim" not in meta:
+            return None
+        return {"dim": int(meta["dim"]), "rows": int(meta["rows"]), "capacity": int(meta["capacity"]),
+                "ivf_version": int(meta.get("ivf_version", 0)), "generation": int(meta.get("generation", 0))}
+
+    def _read(self, statements):
+        """
+        Run statements(conn) on one consistent snapshot of the rows and meta
+
+        A compaction committed meanwhile removes the files of the generation
+        the snapshot refers to; if they are gone before they could be mapped,
+        the read starts over on the new generation.
+        """
+        conn = self._connect()
+        for attempt in range(2):
+            conn.execute("BEGIN")
+            try:
+                return statements(conn)
+            except FileNotFoundError:
+                if attempt:
+                    raise
+            finally:
+                conn.execute("COMMIT")
+
+    def _encode(self, vectors: np.ndarray):
+        """Normalize rows and convert them to the storage dtype; returns (stored rows, scales or None)"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+    def _decode(self, maps: dict, rows) -> np.ndarray:
+        vectors = np.asarray(maps["vectors"][rows], dtype=np.float32)
+        if self.dtype == "int8":
+            vectors *= np.asarray(maps["scales"][rows])[..., None]
+        return vectors
+
+    def _refresh_ivf(self, ivf_version: int):
+        if ivf_version == self._ivf_version:
+            return
+        centroids_path = self._file("centroids.npy")
+        self._centroids = np.load(centroids_path) if ivf_version and os.path.exists(centroids_path) else None
+        self._ivf_version = ivf_version
+
+    # --- Writes ---
+    @staticmethod
+    def _filter_values(metadata: Optional[dict]) -> tuple:
+        """Values of the indexed filter columns for one chunk's metadata"""
+        return tuple((metadata or {}).get(field) for field in FILTER_FIELDS)
+
+    def _where_sql(self, where: dict) -> Tuple[str, list]:
+        return where_to_sql(where, {field: field for field in FILTER_FIELDS}, "metadata")
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        encoded, scales = self._encode(vectors)
+
+        def statements(conn):
+            dims = self._dimensions(conn)
+            if dims is None:
+                dims = {"dim": vectors.shape[1], "rows": 0, "capacity": 0, "ivf_version": 0, "generation": 0}
+            elif dims["dim"] != vectors.shape[1]:
+                raise ValueError(f"Vector store holds {dims['dim']}-dimensional vectors, got {vectors.shape[1]}")
+
+            existing = {}
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                existing.update(conn.execute(
+                    f"SELECT chunk_id, row FROM rows WHERE chunk_id IN ({','.join('?' * len(part))})", part
+                ).fetchall())
+
+            rows = []
+            next_row = dims["rows"]
+            for chunk_id in ids:
+                if chunk_id in existing:
+                    rows.append(existing[chunk_id])
+                else:
+                    existing[chunk_id] = next_row
+                    rows.append(next_row)
+                    next_row += 1
+
+            capacity = dims["capacity"]
+            if next_row > capacity:
+                capacity = max(self.initial_capacity, capacity)
+                while capacity < next_row:
+                    capacity *= 2
+                self._resize_files(capacity, dims["dim"], dims["generation"])
+
+            # Vectors are written before the row count is committed, so readers never see half-written new rows
+            maps = self._mapped(capacity, dims["dim"], dims["generation"])
+            row_index = np.asarray(rows, dtype=np.int64)
+            maps["vectors"][row_index] = encoded
+            if scales is not None:
+                maps["scales"][row_index] = scales
+            self._refresh_ivf(dims["ivf_version"])
+            if self._centroids is not None:
+                maps["lists"][row_index] = np.argmax(vectors @ self._centroids.T, axis=1)
+            else:
+                maps["lists"][row_index] = -1
+            maps["live"][row_index] = 1
+            for array in maps.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO rows (row, chunk_id, source, page, ingested_at, content, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (row, chunk_id, *self._filter_values(metadata), document, json.dumps(metadata or {}))
+                    for row, chunk_id, document, metadata in zip(rows, ids, documents, metadatas)
+                ]
+            )
+            self._set_meta(conn, dim=dims["dim"], rows=next_row, capacity=capacity)
+
+        self._write(statements)
+        if self.ivf_lists > 0:
+            self._maybe_train_ivf()
+
+    def update_metadata(self, ids, metadatas):
+        def statements(conn):
+            conn.executemany(
+                "UPDATE rows SET source = ?, page = ?, ingested_at = ?, metadata = ? WHERE chunk_id = ?",
+                [(*self._filter_values(metadata), json.dumps(metadata or {}), chunk_id)
+                 for chunk_id, metadata in zip(ids, metadatas)]
+            )
+
+        self._write(statements)
+
+    def _delete_rows(self, conn, rows: List[int]):
+        if not rows:
+            return
+        dims = self._dimensions(conn)
+        maps = self._mapped(dims["capacity"], dims["dim"], dims["generation"])
+        maps["live"][np.asarray(rows, dtype=np.int64)] = 0
+        maps["live"].flush()
+        for i in range(0, len(rows), 500):
+            part = rows[i:i + 500]
+            conn.execute(f"DELETE FROM rows WHERE row IN ({','.join('?' * len(part))})", part)
+
+    def delete(self, ids):
+        if not ids:
+            return
+
+        def statements(conn):
+            rows = []
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows += [row for (row,) in conn.execute(
+                    f"SELECT row FROM rows WHERE chunk_id IN ({','.join('?' * len(part))})", part
+                )]
+            self._delete_rows(conn, rows)
+
+        self._write(statements)
+
+    def delete_where(self, where):
+        sql, params = self._where_sql(where)
+
+        def statements(conn):
+            rows = [row for (row,) in conn.execute(f"SELECT row FROM rows WHERE {sql}", params)]
+            self._delete_rows(conn, rows)
+            return len(rows)
+
+        return self._write(statements)
+
+    # --- Coarse index ---
+    def _maybe_train_ivf(self):
+        conn = self._connect()
+        meta = self._meta(conn)
+        live = self.count()
+        trained_on = int(meta.get("ivf_trained_rows", 0))
+        if live < self.ivf_lists * IVF_MIN_POINTS_PER_LIST or (trained_on and live < trained_on * 2):
+            return
+        self.train_ivf()
+
+    def train_ivf(self, iterations: int = 10, sample_per_list: int = 256, seed: int = 0):
+        """(Re)train the IVF centroids and reassign every row to its closest list"""
+        def statements(conn):
+            dims = self._dimensions(conn)
+            if dims is None or not dims["rows"]:
+                return
+            maps = self._mapped(dims["capacity"], dims["dim"], dims["generation"])
+            live_rows = np.flatnonzero(np.asarray(maps["live"][:dims["rows"]]))
+            if len(live_rows) < self.ivf_lists:
+                return
+
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(live_rows, min(len(live_rows), self.ivf_lists * sample_per_list), replace=False))
+            points = self._decode(maps, sample)
+            centroids = points[rng.choice(len(points), self.ivf_lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(points @ centroids.T, axis=1)
+                for k in range(self.ivf_lists):
+                    members = points[assignment == k]
+                    centroids[k] = members.sum(axis=0) if len(members) else points[rng.integers(len(points))]
+                centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+            for start in range(0, dims["rows"], SCAN_BLOCK_ROWS):
+                end = min(start + SCAN_BLOCK_ROWS, dims["rows"])
+                maps["lists"][start:end] = np.argmax(self._decode(maps, slice(start, end)) @ centroids.T, axis=1)
+            maps["lists"].flush()
+
+            tmp_path = self._file("centroids.npy.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, centroids.astype(np.float32))
+            os.replace(tmp_path, self._file("centroids.npy"))
+            self._set_meta(conn, ivf_version=dims["ivf_version"] + 1, ivf_trained_rows=len(live_rows))
+            logger.info(f"Trained {self.ivf_lists} IVF lists on {len(sample)} of {len(live_rows)} vectors")
+
+        self._write(statements)
+
+    # --- Compaction ---
+    def _disk_bytes(self) -> int:
+        return sum(
+            os.path.getsize(self._file(name)) for name in os.listdir(self.path)
+            if os.path.isfile(self._file(name))
+        )
+
+    def _remove_generations(self, dim: int, generations):
+        for generation in generations:
+            for name, _, _ in self._layout(dim, generation):
+                try:
+                    os.remove(self._file(name))
+                except FileNotFoundError:
+                    pass
+
+    def compact(self, min_dead_ratio: float = 0.2) -> dict:
+        """
+        Repack the live rows into new, right-sized matrix files
+
+        Deletes only clear a row's live flag, so the slots of deleted chunks
+        stay allocated on disk and are still scanned by every exact search.
+        Compaction copies the live rows in order into the next generation of
+        the files and renumbers them in one write transaction. Searches that
+        started before the commit finish on the previous generation (its
+        files stay mapped until they are done); later ones use the new files.
+        The rows database is then checkpointed and, once min_dead_ratio of it
+        is free pages, vacuumed.
+
+        Args:
+            min_dead_ratio: Share of deleted rows among the allocated rows from which the store is repacked
+
+        Returns:
+            Rows, dead rows, capacity and bytes on disk before and after, and whether the store was repacked
+        """
+        before_bytes = self._disk_bytes()
+
+        def statements(conn):
+            dims = self._dimensions(conn)
+            if dims is None:
+                return {"rows": 0, "dead_rows": 0, "repacked": False}
+            live_rows = np.fromiter((row for (row,) in conn.execute("SELECT row FROM rows ORDER BY row")), dtype=np.int64)
+            report = {"rows": len(live_rows), "dead_rows": dims["rows"] - len(live_rows),
+                      "capacity_before": dims["capacity"], "capacity_after": dims["capacity"], "repacked": False}
+            if not report["dead_rows"] or report["dead_rows"] / dims["rows"] < min_dead_ratio:
+                return report
+
+            capacity = self.initial_capacity
+            while capacity < len(live_rows):
+                capacity *= 2
+            generation = dims["generation"] + 1
+            # Start from empty files in case an interrupted compaction left this generation behind
+            for name, _, _ in self._layout(dims["dim"], generation):
+                open(self._file(name), "wb").close()
+            self._resize_files(capacity, dims["dim"], generation)
+            try:
+                old = self._mapped(dims["capacity"], dims["dim"], dims["generation"])
+                new = self._open_maps(capacity, dims["dim"], generation)
+                for start in range(0, len(live_rows), SCAN_BLOCK_ROWS):
+                    block = live_rows[start:start + SCAN_BLOCK_ROWS]
+                    for name, array in new.items():
+                        if isinstance(array, np.memmap):
+                            array[start:start + len(block)] = old[name][block]
+                for array in new.values():
+                    if isinstance(array, np.memmap):
+                        array.flush()
+
+                # Ascending order never moves a row onto one that has not been moved yet
+                conn.executemany(
+                    "UPDATE rows SET row = ? WHERE row = ?",
+                    [(new_row, int(old_row)) for new_row, old_row in enumerate(live_rows) if new_row != old_row]
+                )
+                self._set_meta(conn, rows=len(live_rows), capacity=capacity, generation=generation)
+            except Exception:
+                self._remove_generations(dims["dim"], [generation])
+                raise
+            report.update(capacity_after=capacity, repacked=True, dim=dims["dim"], generation=generation)
+            return report
+
+        report = self._write(statements)
+        if report["repacked"]:
+            # Unmapped old files release their disk space once no other process maps them either
+            with self._map_lock:
+                self._maps = None
+            self._remove_generations(report.pop("dim"), range(report["generation"]))
+            logger.info(f"Compacted vector store at {self.path}: dropped {report['dead_rows']} deleted rows")
+        report["vacuumed"] = compact_database(self._file("rows.sqlite3"), min_dead_ratio)["vacuumed"]
+        report["before_bytes"] = before_bytes
+        report["after_bytes"] = self._disk_bytes()
+        return report
+
+    # --- Reads ---
+    def query(self, embedding, n_results, where=None):
+        return self._read(lambda conn: self._query(conn, embedding, n_results, where))
+
+    def _query(self, conn, embedding, n_results, where):
+        dims = self._dimensions(conn)
+        if dims is None or not dims["rows"] or n_results <= 0:
+            return []
+        maps = self._mapped(dims["capacity"], dims["dim"], dims["generation"])
+        count = dims["rows"]
+
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+
+        self._refresh_ivf(dims["ivf_version"])
+        if where:
+            # Pushdown: the indexed columns select the matching rows, and only those are scored exactly
+            sql, params = self._where_sql(where)
+            candidates = np.fromiter(
+                (row for (row,) in conn.execute(f"SELECT row FROM rows WHERE {sql} AND row < ? ORDER BY row", [*params, count])),
+                dtype=np.int64
+            )
+            scores = np.empty(len(candidates), dtype=np.float32)
+            for start in range(0, len(candidates), SCAN_BLOCK_ROWS):
+                block = candidates[start:start + SCAN_BLOCK_ROWS]
+                scores[start:start + len(block)] = self._decode(maps, block) @ query_vector
+        elif self.ivf_lists > 0 and self._centroids is not None:
+            probed = np.argsort(self._centroids @ query_vector)[-self.nprobe:]
+            candidates = np.flatnonzero(np.isin(maps["lists"][:count], probed) & (maps["live"][:count] == 1))
+            scores = self._decode(maps, candidates) @ query_vector if len(candidates) else np.empty(0, dtype=np.float32)
+        else:
+            candidates = None
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SCAN_BLOCK_ROWS):
+                end = min(start + SCAN_BLOCK_ROWS, count)
+                scores[start:end] = self._decode(maps, slice(start, end)) @ query_vector
+            scores[np.asarray(maps["live"][:count]) == 0] = -np.inf
+
+        k = min(n_results, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        rows = [int(candidates[i]) if candidates is not None else int(i) for i in top]
+
+        found = {
+            row: (chunk_id, content, metadata)
+            for row, chunk_id, content, metadata in conn.execute(
+                f"SELECT row, chunk_id, content, metadata FROM rows WHERE row IN ({','.join('?' * len(rows))})", rows
+            )
+        } if rows else {}
+        ranked = []
+        for row, i in zip(rows, top):
+            # A row deleted while this query ran is skipped
+            if row not in found:
+                continue
+            chunk_id, content, metadata = found[row]
+            ranked.append({
+                "id": chunk_id,
+                "content": content,
+                "metadata": json.loads(metadata),
+                "distance": float(1.0 - scores[i])
+            })
+        return ranked
+
+    def get(self, ids, include_embeddings=False):
+        if not ids:
+            return []
+        return self._read(lambda conn: self._get(conn, ids, include_embeddings))
+
+    def _get(self, conn, ids, include_embeddings):
+        found = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            for row, chunk_id, content, metadata in conn.execute(
+                f"SELECT row, chunk_id, content, metadata FROM rows WHERE chunk_id IN ({','.join('?' * len(part))})", part
+            ):
+                found[chunk_id] = {"row": row, "id": chunk_id, "content": content, "metadata": json.loads(metadata)}
+
+        results = [found[chunk_id] for chunk_id in dict.fromkeys(ids) if chunk_id in found]
+        if include_embeddings and results:
+            dims = self._dimensions(conn)
+            maps = self._mapped(dims["capacity"], dims["dim"], dims["generation"])
+            vectors = self._decode(maps, np.asarray([result["row"] for result in results], dtype=np.int64))
+            for result, vector in zip(results, vectors):
+                result["embedding"] = vector
+        for result in results:
+            del result["row"]
+        return results
+
+    def list(self, limit, offset=0):
+        return [
+            {"id": chunk_id, "content": content, "metadata": json.loads(metadata)}
+            for chunk_id, content, metadata in self._connect().execute(
+                "SELECT chunk_id, content, metadata FROM rows ORDER BY row LIMIT ? OFFSET ?", (limit, offset)
+            )
+        ]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def get_stats(self):
+        conn = self._connect()
+        dims = self._dimensions(conn) or {"dim": None, "rows": 0, "capacity": 0}
+        chunks = self.count()
+        return {
+            "backend": "mmap",
+            "path": self.path,
+            "dtype": self.dtype,
+            "dimensions": dims["dim"],
+            "chunks": chunks,
+            "rows_allocated": dims["rows"],
+            "dead_rows": dims["rows"] - chunks,
+            "capacity": dims["capacity"],
+            "disk_bytes": self._disk_bytes(),
+            "ivf_lists": self.ivf_lists if self._centroids is not None else 0,
+            "nprobe": self.nprobe
+        }